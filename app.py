@@ -1,17 +1,32 @@
-from flask import Flask, render_template, request, jsonify, redirect, url_for, send_file
-from flask_socketio import SocketIO, emit
+from flask import Flask, render_template, request, jsonify, redirect, url_for, send_file, g, Response
+from flask_socketio import SocketIO, emit, join_room, leave_room
 from werkzeug.utils import secure_filename
 import os
+import sys
 import json
+import zipfile
 import time
-import threading
+import shutil
 from pathlib import Path
 from datetime import datetime
 
 from config import config
-from nextflow_runner.pipeline_manager import NextflowPipelineManager
+from nextflow_runner.factory import create_pipeline_manager
+from nextflow_runner.model_registry import ModelRegistry
 from utils.file_handler import FileHandler
+from utils.chunked_upload import ChunkedUploadManager, UploadError
+from utils.image_ingest import ImageIngestor, ImageRejected, IngestBusy, probe_image
 from utils.result_parser import ResultParser
+from utils.result_cache import ResultCache
+from utils.disk_janitor import DiskJanitor
+from utils.detections import Rethresholder
+from utils.artifacts import ArtifactServer, DERIVATIVE_FORMATS
+from utils.export import stream_zip, job_entries
+from utils.hot_folder import HotFolderWatcher
+from utils.spot_table import SpotTablePending, SpotTableStore, spots_path
+from utils.spot_matching import compare_gels
+from utils.system_sampler import SystemSampler
+from utils.metrics import PipelineMetrics, CONTENT_TYPE as METRICS_CONTENT_TYPE
 
 # Initialize Flask app
 app = Flask(__name__)
@@ -48,18 +63,231 @@ def strftime_filter(datetime_obj, format_string='%Y-%m-%d %H:%M:%S'):
 # Initialize SocketIO for real-time updates
 socketio = SocketIO(app, cors_allowed_origins="*")
 
-# Initialize components
-pipeline_manager = NextflowPipelineManager(
-    pipeline_dir=app.config['NEXTFLOW_PIPELINE_DIR'],
-    results_dir=app.config['NEXTFLOW_RESULTS_DIR'],
-    work_dir=app.config['NEXTFLOW_WORK_DIR']
-)
+# Services and background threads, built by create_app() in the serving
+# process only. The ingest, spot recompute and warm-worker pools spawn
+# processes that re-import this module, and those must not recover jobs
+# or start background threads of their own.
+result_cache = None
+model_registry = None
+spot_tables = None
+file_handler = None
+ingestor = None
+pipeline_manager = None
+system_sampler = None
+chunked_uploads = None
+metrics = None
+result_parser = None
+rethresholder = None
+artifacts = None
+disk_janitor = None
+hot_folder = None
 
-file_handler = FileHandler(app.config['UPLOAD_FOLDER'])
-result_parser = ResultParser()
+def purge_job_results(path):
+    """Disk janitor hook: a job's results directory was deleted"""
+    job_id = Path(path).name[len('results_'):]
+    pipeline_manager.mark_artifacts_purged(job_id)
+    artifacts.forget(job_id)
+    shutil.rmtree(artifacts.derivative_dir / job_id, ignore_errors=True)
 
-# Ensure upload directory exists
-os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+def submit_hot_folder_images(items):
+    """Hot-folder callback: run a micro-batch of stored (path, hash) images.
+    
+    A single image goes through ingest like an upload, several run as one
+    batch. Returns a {'job_id'} or {'error'} dict per item.
+    """
+    results, image_paths = [], []
+    for file_path, image_hash in items:
+        try:
+            probe_image(file_path, app.config['INGEST_MAX_PIXELS'])
+        except ImageRejected as e:
+            metrics.uploads.inc(outcome='rejected')
+            results.append({'error': str(e)})
+            continue
+        results.append(None)
+        image_paths.append(file_path)
+    
+    params = dict(
+        score_threshold=app.config['SCORE_THRESHOLD'],
+        mask_threshold=app.config['MASK_THRESHOLD'],
+        num_classes=app.config['NUM_CLASSES']
+    )
+    job_ids = []
+    if len(image_paths) == 1:
+        image_hash = dict(items)[image_paths[0]]
+        job_id, _ = pipeline_manager.run_prediction_when_ready(
+            ingestor.submit(image_paths[0], image_hash),
+            image_path=image_paths[0],
+            image_hash=image_hash,
+            **params
+        )
+        job_ids.append(job_id)
+    elif image_paths:
+        _, job_ids = pipeline_manager.run_batch_prediction(
+            image_paths=image_paths,
+            image_hashes=dict(items),
+            parallelism=app.config['BATCH_PARALLELISM'],
+            **params
+        )
+    
+    # Every image that passed the probe must have been given a job
+    accepted = dict(zip(image_paths, job_ids)) if len(job_ids) == len(image_paths) else {}
+    if image_paths and not accepted:
+        print(f"[hot-folder] Pipeline returned {len(job_ids)} jobs for {len(image_paths)} images")
+    return [
+        result or ({'job_id': accepted[file_path]} if file_path in accepted
+                   else {'error': 'Not accepted by the pipeline'})
+        for (file_path, _), result in zip(items, results)
+    ]
+
+def create_app():
+    """Build the services behind the routes and start their background threads"""
+    global result_cache, model_registry, spot_tables, file_handler, ingestor, pipeline_manager, system_sampler, chunked_uploads, metrics, result_parser, rethresholder, artifacts, disk_janitor, hot_folder
+    
+    result_cache = ResultCache(app.config['RESULT_CACHE_DIR'])
+
+    model_registry = ModelRegistry(
+        app.config['MODEL_DIRS'].split(os.pathsep),
+        default_model=app.config['MODEL_DEFAULT'],
+        reload_interval=app.config['MODEL_RELOAD_INTERVAL']
+    )
+
+    spot_tables = SpotTableStore(
+        recompute_workers=app.config['SPOT_RECOMPUTE_WORKERS'],
+        min_parallel=app.config['SPOT_RECOMPUTE_MIN_PARALLEL']
+    )
+
+    file_handler = FileHandler(app.config['UPLOAD_FOLDER'])
+    ingestor = ImageIngestor(
+        os.path.join(app.config['UPLOAD_FOLDER'], 'normalized'),
+        os.path.join(app.config['UPLOAD_FOLDER'], 'thumbnails'),
+        max_workers=app.config['INGEST_WORKERS'],
+        thumbnail_size=app.config['THUMBNAIL_SIZE'],
+        max_pending=app.config['INGEST_MAX_PENDING']
+    )
+
+    pipeline_manager = create_pipeline_manager(
+        app.config,
+        cache=result_cache,
+        model_registry=model_registry,
+        spot_tables=spot_tables,
+        tile_pool=ingestor
+    )
+
+    # Status requests read the latest background sample instead of probing
+    # the host and workers themselves
+    system_sampler = SystemSampler(
+        pipeline_manager.get_system_status,
+        interval=app.config['SYSTEM_SAMPLE_INTERVAL'],
+        size=app.config['SYSTEM_HISTORY_SIZE']
+    )
+    system_sampler.start()
+
+    chunked_uploads = ChunkedUploadManager(
+        file_handler,
+        max_upload_bytes=app.config['CHUNKED_UPLOAD_MAX_BYTES'],
+        chunk_size=app.config['CHUNKED_UPLOAD_CHUNK_SIZE'],
+        session_ttl_hours=app.config['CHUNKED_UPLOAD_TTL_HOURS']
+    )
+
+    metrics = PipelineMetrics()
+    metrics.instrument_pipeline(pipeline_manager)
+    metrics.registry.gauge('gel_cache_entries', 'Entries in the result cache',
+                           callback=lambda: result_cache.get_stats()['entries'])
+    result_parser = ResultParser()
+    rethresholder = Rethresholder()
+
+    # Completed-job downloads and previews; derivatives are evicted by the
+    # disk janitor below
+    artifacts = ArtifactServer(
+        pipeline_manager.get_completed_results_dir,
+        app.config['ARTIFACT_DERIVATIVE_DIR'],
+        sizes=[int(size) for size in app.config['ARTIFACT_PREVIEW_SIZES'].split(',')],
+        max_age=app.config['ARTIFACT_MAX_AGE']
+    )
+
+    # Background quotas for uploads, ingest outputs, per-job results and the
+    # Nextflow work dir; artifacts of unfinished jobs and recently hit cached results are kept
+    disk_janitor = DiskJanitor(
+        pipeline_manager,
+        file_handler=file_handler,
+        result_cache=result_cache,
+        index_path=app.config['DISK_INDEX_PATH'],
+        interval=app.config['DISK_JANITOR_INTERVAL'],
+        recent_hit_seconds=app.config['DISK_RECENT_HIT_HOURS'] * 3600,
+        upload_max_bytes=app.config['UPLOAD_MAX_TOTAL_BYTES'],
+        upload_max_age_hours=app.config['UPLOAD_MAX_AGE_HOURS']
+    )
+    for ingest_dir in (ingestor.output_dir, ingestor.thumbnail_dir):
+        disk_janitor.add_area(
+            ingest_dir.name, ingest_dir,
+            max_bytes=app.config['INGEST_MAX_TOTAL_BYTES'],
+            max_age_hours=app.config['UPLOAD_MAX_AGE_HOURS']
+        )
+    disk_janitor.add_area(
+        'results', pipeline_manager.pipeline_dir, pattern='results_*',
+        max_bytes=app.config['RESULTS_MAX_TOTAL_BYTES'],
+        max_age_hours=app.config['RESULTS_MAX_AGE_HOURS'],
+        on_remove=purge_job_results
+    )
+    disk_janitor.add_area(
+        'derivatives', artifacts.derivative_dir,
+        max_bytes=app.config['ARTIFACT_DERIVATIVE_MAX_BYTES']
+    )
+    artifacts.on_access = disk_janitor.touch
+    disk_janitor.add_area(
+        'work', pipeline_manager.pipeline_dir / app.config['NEXTFLOW_WORK_DIR'], pattern='*/*',
+        max_bytes=app.config['WORK_MAX_TOTAL_BYTES'],
+        max_age_hours=app.config['WORK_MAX_AGE_HOURS'],
+        keep_during_runs=True
+    )
+    # Only here, in the serving process: its pipeline manager is the one
+    # that knows which jobs are still running
+    disk_janitor.start()
+    metrics.registry.gauge('gel_disk_bytes', 'Accounted disk usage by area', ('area',),
+                           callback=disk_janitor.usage)
+
+    # Scanner output directories; the watcher only runs in the process
+    # holding the checkpoint lock
+    hot_folder = None
+    if app.config['HOT_FOLDER_DIRS']:
+        hot_folder = HotFolderWatcher(
+            app.config['HOT_FOLDER_DIRS'].split(os.pathsep),
+            submit_hot_folder_images,
+            file_handler,
+            app.config['HOT_FOLDER_CHECKPOINT'],
+            queue_depth_fn=lambda: pipeline_manager.scheduler.get_stats()['queued'],
+            extensions=app.config['ALLOWED_EXTENSIONS'],
+            recursive=app.config['HOT_FOLDER_RECURSIVE'],
+            settle_seconds=app.config['HOT_FOLDER_SETTLE_SECONDS'],
+            poll_interval=app.config['HOT_FOLDER_POLL_INTERVAL'],
+            batch_size=min(app.config['HOT_FOLDER_BATCH_SIZE'], app.config['MAX_BATCH_IMAGES']),
+            max_queued=app.config['HOT_FOLDER_MAX_QUEUED']
+        )
+        hot_folder.start()
+
+    # Ensure upload directory exists
+    os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+
+    pipeline_manager.add_listener(emit_job_progress)
+    pipeline_manager.logs.add_subscriber(emit_job_log)
+    return app
+
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+
+@app.after_request
+def record_request_metrics(response):
+    start = getattr(g, 'request_start', None)
+    if start is not None:
+        endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+        metrics.observe_request(endpoint, request.method, response.status_code, time.perf_counter() - start)
+    return response
+
+def parse_priority(value):
+    """Job priority from a request, clamped to the configured range; ValueError if not an integer"""
+    limit = app.config['MAX_JOB_PRIORITY']
+    return max(-limit, min(limit, int(value or 0)))
 
 def allowed_file(filename):
     return '.' in filename and \
@@ -68,7 +296,7 @@ def allowed_file(filename):
 @app.route('/')
 def index():
     """Main upload page"""
-    return render_template('index.html')
+    return render_template('index.html', models=model_registry.list_models())
 
 @app.route('/upload', methods=['POST'])
 def upload_file():
@@ -83,40 +311,258 @@ def upload_file():
         return jsonify({'error': 'No file selected'}), 400
     
     if file and allowed_file(file.filename):
-        # Save uploaded file
+        # Keep the upload store within its size/age budget
+        disk_janitor.request_sweep()
+        
+        # Save uploaded file, reusing an identical earlier upload if present
+        upload_start = time.monotonic()
         filename = secure_filename(file.filename)
         timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
         unique_filename = f"{timestamp}_{filename}"
-        file_path = os.path.join(app.config['UPLOAD_FOLDER'], unique_filename)
-        file.save(file_path)
+        file_path, image_hash, is_duplicate = file_handler.save_file_deduped(file, unique_filename)
+        upload_seconds = time.monotonic() - upload_start
+        metrics.upload_bytes.inc(request.content_length or 0)
+        metrics.uploads.inc(outcome='duplicate' if is_duplicate else 'new')
         
-        # Get prediction parameters
-        score_threshold = float(request.form.get('score_threshold', 0.8))
-        mask_threshold = float(request.form.get('mask_threshold', 0.8))
-        
-        # Start prediction job
-        job_id, job_info = pipeline_manager.run_prediction(
-            image_path=file_path,
-            score_threshold=score_threshold,
-            mask_threshold=mask_threshold,
-            num_classes=app.config['NUM_CLASSES']
+        return submit_prediction(file_path, image_hash, request.form, upload_seconds, is_duplicate)
+    
+    return jsonify({'error': 'Invalid file type'}), 400
+
+def submit_prediction(file_path, image_hash, params, upload_seconds, is_duplicate=False):
+    """Validate a stored upload and start its prediction job; returns the JSON response.
+    
+    Only the image header is checked here. Full decode, EXIF orientation,
+    bit-depth/colorspace normalization and the thumbnail run in the ingest
+    process pool, and the job is queued with the normalized image when
+    that finishes.
+    """
+    try:
+        probe_image(file_path, app.config['INGEST_MAX_PIXELS'])
+    except ImageRejected as e:
+        if not is_duplicate:
+            file_handler.delete_file(os.path.basename(file_path))
+        metrics.uploads.inc(outcome='rejected')
+        return jsonify({'error': str(e)}), 400
+    
+    model = params.get('model') or None
+    if model and model_registry.get(model) is None:
+        return jsonify({'error': f'Unknown model: {model}'}), 400
+    try:
+        priority = parse_priority(params.get('priority', 0))
+    except (TypeError, ValueError):
+        return jsonify({'error': 'priority must be an integer'}), 400
+    try:
+        score_threshold = float(params.get('score_threshold', 0.8))
+        mask_threshold = float(params.get('mask_threshold', 0.8))
+    except (TypeError, ValueError):
+        return jsonify({'error': 'Thresholds must be numbers'}), 400
+    if not (0.0 <= score_threshold <= 1.0 and 0.0 <= mask_threshold <= 1.0):
+        return jsonify({'error': 'Thresholds must be between 0 and 1'}), 400
+    
+    try:
+        prepared = ingestor.submit(file_path, image_hash)
+    except IngestBusy as e:
+        response = jsonify({'error': str(e)})
+        response.headers['Retry-After'] = '10'
+        return response, 503
+    
+    job_id, job_info = pipeline_manager.run_prediction_when_ready(
+        prepared,
+        image_path=file_path,
+        score_threshold=score_threshold,
+        mask_threshold=mask_threshold,
+        num_classes=app.config['NUM_CLASSES'],
+        image_hash=image_hash,
+        model=model,
+        priority=priority,
+        upload_seconds=upload_seconds
+    )
+    
+    return jsonify({
+        'job_id': job_id,
+        'status': job_info['status'],
+        'redirect_url': url_for('job_status', job_id=job_id)
+    })
+
+def upload_error_response(error, upload_id=None):
+    body = {'error': str(error), 'upload_id': upload_id}
+    if error.offset is not None:
+        body['offset'] = error.offset  # where the client should resume
+    return jsonify(body), error.status_code
+
+@app.route('/upload/chunked', methods=['POST'])
+def create_chunked_upload():
+    """Start a resumable upload: JSON {filename, size, sha256?, score_threshold, ...}"""
+    data = request.get_json(silent=True) or {}
+    filename = secure_filename(data.get('filename') or '')
+    
+    if not filename or not allowed_file(filename):
+        return jsonify({'error': 'Invalid file type'}), 400
+    
+    chunked_uploads.cleanup_stale()
+    
+    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    params = {key: data[key] for key in ('score_threshold', 'mask_threshold', 'priority') if key in data}
+    try:
+        session = chunked_uploads.create(
+            f"{timestamp}_{filename}", int(data.get('size') or 0), data.get('sha256'), params
         )
+    except (TypeError, ValueError):
+        return jsonify({'error': 'Invalid upload size'}), 400
+    except UploadError as e:
+        return upload_error_response(e)
+    
+    return jsonify(session), 201
+
+@app.route('/upload/chunked/<upload_id>', methods=['GET', 'PUT', 'DELETE'])
+def chunked_upload(upload_id):
+    """Query (GET), append a chunk to (PUT) or abort (DELETE) a resumable upload.
+    
+    PUT bodies are raw bytes; the offset comes from a Content-Range header
+    (``bytes start-end/total``) or ?offset=, and must equal the bytes
+    received so far. A 409 response carries the offset to resume from.
+    """
+    try:
+        if request.method == 'GET':
+            return jsonify(chunked_uploads.status(upload_id))
         
-        # Start monitoring thread
-        monitor_thread = threading.Thread(
-            target=monitor_job_progress,
-            args=(job_id,)
-        )
-        monitor_thread.daemon = True
-        monitor_thread.start()
+        if request.method == 'DELETE':
+            chunked_uploads.abort(upload_id)
+            return jsonify({'upload_id': upload_id, 'aborted': True})
         
-        return jsonify({
-            'job_id': job_id,
-            'status': 'started',
-            'redirect_url': url_for('job_status', job_id=job_id)
-        })
+        offset = request.args.get('offset', type=int)
+        content_range = request.headers.get('Content-Range', '')
+        if offset is None and content_range.startswith('bytes '):
+            try:
+                offset = int(content_range[6:].split('-', 1)[0])
+            except ValueError:
+                return jsonify({'error': 'Invalid Content-Range header'}), 400
+        if offset is None:
+            return jsonify({'error': 'Missing chunk offset'}), 400
+        
+        # Read from the raw request stream so the chunk is never buffered whole
+        session = chunked_uploads.append(upload_id, offset, request.stream, request.content_length)
+        metrics.upload_bytes.inc(request.content_length or 0)
+        return jsonify(session)
+    except UploadError as e:
+        return upload_error_response(e, upload_id)
+
+@app.route('/upload/chunked/<upload_id>/complete', methods=['POST'])
+def complete_chunked_upload(upload_id):
+    """Finalize a fully received upload into the upload store and start prediction"""
+    disk_janitor.request_sweep()
     
-    return jsonify({'error': 'Invalid file type'}), 400
+    try:
+        session, file_path, image_hash, is_duplicate = chunked_uploads.finalize(upload_id)
+    except UploadError as e:
+        return upload_error_response(e, upload_id)
+    
+    metrics.uploads.inc(outcome='duplicate' if is_duplicate else 'new')
+    
+    # Parameters given at completion override those given at creation
+    params = dict(session['params'], **(request.get_json(silent=True) or request.form.to_dict()))
+    return submit_prediction(file_path, image_hash, params, time.time() - session['created'], is_duplicate)
+
+@app.route('/upload/batch', methods=['POST'])
+def upload_batch():
+    """Handle multi-file or zip upload and run all images in one pipeline run"""
+    
+    files = [f for f in request.files.getlist('files') if f.filename]
+    if not files:
+        return jsonify({'error': 'No files selected'}), 400
+    
+    model = request.form.get('model') or None
+    if model and model_registry.get(model) is None:
+        return jsonify({'error': f'Unknown model: {model}'}), 400
+    try:
+        priority = parse_priority(request.form.get('priority', 0))
+    except ValueError:
+        return jsonify({'error': 'priority must be an integer'}), 400
+    
+    # Count images from the zip directories before extracting or storing anything
+    image_count = 0
+    for file in files:
+        filename = secure_filename(file.filename)
+        if filename.lower().endswith('.zip'):
+            try:
+                with zipfile.ZipFile(file.stream) as archive:
+                    image_count += sum(
+                        1 for member in archive.infolist()
+                        if not member.is_dir() and allowed_file(secure_filename(os.path.basename(member.filename)))
+                    )
+            except zipfile.BadZipFile:
+                return jsonify({'error': f'Invalid zip archive: {filename}'}), 400
+            file.stream.seek(0)
+        elif allowed_file(filename):
+            image_count += 1
+    if image_count > app.config['MAX_BATCH_IMAGES']:
+        return jsonify({'error': f"Too many images (max {app.config['MAX_BATCH_IMAGES']})"}), 400
+    
+    disk_janitor.request_sweep()
+    
+    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    image_paths = []
+    image_hashes = {}
+    rejected = []
+    
+    def add_image(file_path, image_hash):
+        if file_path in image_hashes:
+            return
+        try:
+            probe_image(file_path, app.config['INGEST_MAX_PIXELS'])
+        except ImageRejected as e:
+            rejected.append({'filename': os.path.basename(file_path), 'error': str(e)})
+            metrics.uploads.inc(outcome='rejected')
+            return
+        image_paths.append(file_path)
+        image_hashes[file_path] = image_hash
+    
+    for file in files:
+        filename = secure_filename(file.filename)
+        
+        if filename.lower().endswith('.zip'):
+            try:
+                with zipfile.ZipFile(file.stream) as archive:
+                    for member in archive.infolist():
+                        member_name = secure_filename(os.path.basename(member.filename))
+                        if member.is_dir() or not allowed_file(member_name):
+                            continue
+                        with archive.open(member) as member_file:
+                            file_path, image_hash, _ = file_handler.save_fileobj_deduped(
+                                member_file, f"{timestamp}_{member_name}"
+                            )
+                        add_image(file_path, image_hash)
+            except zipfile.BadZipFile:
+                return jsonify({'error': f'Invalid zip archive: {filename}'}), 400
+        elif allowed_file(filename):
+            file_path, image_hash, _ = file_handler.save_file_deduped(file, f"{timestamp}_{filename}")
+            add_image(file_path, image_hash)
+    
+    metrics.upload_bytes.inc(request.content_length or 0)
+    
+    if not image_paths:
+        return jsonify({'error': 'No valid images found', 'rejected': rejected}), 400
+    
+    if len(image_paths) > app.config['MAX_BATCH_IMAGES']:
+        return jsonify({'error': f"Too many images (max {app.config['MAX_BATCH_IMAGES']})"}), 400
+    
+    batch_id, job_ids = pipeline_manager.run_batch_prediction(
+        image_paths=image_paths,
+        image_hashes=image_hashes,
+        parallelism=int(request.form.get('parallelism', app.config['BATCH_PARALLELISM'])),
+        score_threshold=float(request.form.get('score_threshold', 0.8)),
+        mask_threshold=float(request.form.get('mask_threshold', 0.8)),
+        num_classes=app.config['NUM_CLASSES'],
+        model=model,
+        priority=priority
+    )
+    
+    return jsonify({
+        'batch_id': batch_id,
+        'job_ids': job_ids,
+        'rejected': rejected,
+        'status_url': url_for('api_batch_status', batch_id=batch_id)
+    })
 
 @app.route('/status/<job_id>')
 def job_status(job_id):
@@ -139,7 +585,8 @@ def view_results(job_id):
     if job_info['status'] != 'completed':
         return redirect(url_for('job_status', job_id=job_id))
     
-    return render_template('results.html', job_id=job_id, job_info=job_info)
+    disk_janitor.touch(job_info['results_dir'])
+    return render_template('results.html', job_id=job_id, job_info=job_info, preview_sizes=artifacts.sizes)
 
 @app.route('/api/job/<job_id>/status')
 def api_job_status(job_id):
@@ -154,6 +601,281 @@ def api_job_status(job_id):
             'job_id': job_id
         }), 500
 
+@app.route('/api/batch/<batch_id>/status')
+def api_batch_status(batch_id):
+    """API endpoint for the status of every job in a batch"""
+    jobs = [
+        pipeline_manager.get_job_status(job['job_id'])
+        for job in pipeline_manager.list_jobs(batch_id=batch_id)
+    ]
+    
+    if not jobs:
+        return jsonify({'status': 'not_found', 'batch_id': batch_id}), 404
+    
+    return jsonify({
+        'batch_id': batch_id,
+        'run': pipeline_manager.get_job_status(batch_id),
+        'jobs': jobs
+    })
+
+@app.route('/api/job/<job_id>/thumbnail')
+def api_job_thumbnail(job_id):
+    """Thumbnail of a job's input image, generated at ingest"""
+    job_info = pipeline_manager.get_job_status(job_id)
+    thumbnail = (job_info.get('input') or {}).get('thumbnail')
+    
+    if not thumbnail or not os.path.exists(thumbnail):
+        return jsonify({'error': 'Thumbnail not found', 'job_id': job_id}), 404
+    return send_file(os.path.abspath(thumbnail), mimetype='image/jpeg')
+
+@app.route('/api/job/<job_id>/log')
+def api_job_log(job_id):
+    """API endpoint for paginated job log reads (?offset=&limit=) or ?tail=N"""
+    tail = request.args.get('tail', type=int)
+    offset = request.args.get('offset', 0, type=int)
+    limit = min(request.args.get('limit', 64 * 1024, type=int), 1024 * 1024)
+    if offset < 0 or limit < 0 or (tail is not None and tail < 0):
+        return jsonify({'error': 'offset, limit and tail must not be negative', 'job_id': job_id}), 400
+    
+    page = pipeline_manager.get_job_log(job_id, offset=offset, limit=limit, tail=tail)
+    if page is None:
+        return jsonify({'error': 'Log not found', 'job_id': job_id}), 404
+    return jsonify(page)
+
+@app.route('/api/job/<job_id>/rethreshold', methods=['GET', 'POST'])
+def api_rethreshold(job_id):
+    """Re-apply score/mask thresholds to a completed job's stored detections"""
+    job_info = pipeline_manager.get_job_status(job_id)
+    
+    if job_info['status'] == 'not_found':
+        return jsonify({'error': 'Job not found', 'job_id': job_id}), 404
+    if job_info['status'] != 'completed':
+        return jsonify({'error': 'Job not completed', 'job_id': job_id}), 400
+    if job_info.get('child_jobs'):
+        return jsonify({'error': 'Re-threshold the individual images of a batch', 'job_id': job_id}), 400
+    
+    params = request.get_json(silent=True) or request.values
+    try:
+        score_threshold = float(params.get('score_threshold', job_info.get('score_threshold', 0.8)))
+        mask_threshold = float(params.get('mask_threshold', job_info.get('mask_threshold', 0.8)))
+    except (TypeError, ValueError):
+        return jsonify({'error': 'Thresholds must be numbers', 'job_id': job_id}), 400
+    
+    try:
+        result = rethresholder.rethreshold(
+            job_info['results_dir'],
+            job_info.get('result_stem') or Path(job_info['image_path']).stem,
+            job_info['image_path'],
+            score_threshold,
+            mask_threshold,
+            tiling=job_info.get('tiling')
+        )
+    except FileNotFoundError as e:
+        return jsonify({'error': str(e), 'job_id': job_id}), 404
+    except ValueError as e:
+        return jsonify({'error': str(e), 'job_id': job_id}), 400
+    
+    disk_janitor.touch(job_info['results_dir'])
+    result['job_id'] = job_id
+    result['download_url'] = url_for('download_result', job_id=job_id, filename=result['overlay'])
+    return jsonify(result)
+
+def spot_stem(job_info):
+    return job_info.get('result_stem') or Path(job_info['image_path']).stem
+
+def load_spot_table(job_info, wait=False):
+    """Spot table of a completed single-image job.
+
+    A missing table is built in the background on first access; until it
+    is ready this raises SpotTablePending unless wait is set.
+    """
+    return spot_tables.get(
+        job_info['results_dir'],
+        spot_stem(job_info),
+        job_info['image_path'],
+        job_info.get('score_threshold', 0.8),
+        job_info.get('mask_threshold', 0.8),
+        tiling=job_info.get('tiling'),
+        wait=wait
+    )
+
+def spot_table_pending(e, job_id):
+    response = jsonify({'error': str(e), 'job_id': job_id, 'status': 'pending'})
+    response.headers['Retry-After'] = '5'
+    return response, 202
+
+@app.route('/api/job/<job_id>/spots')
+def api_job_spots(job_id):
+    """Filtered, sorted and paged per-spot measurements of a completed job"""
+    job_info = pipeline_manager.get_job_status(job_id)
+    
+    if job_info['status'] == 'not_found':
+        return jsonify({'error': 'Job not found', 'job_id': job_id}), 404
+    if job_info['status'] != 'completed':
+        return jsonify({'error': 'Job not completed', 'job_id': job_id}), 400
+    if job_info.get('child_jobs'):
+        return jsonify({'error': 'Query the spots of the individual images of a batch', 'job_id': job_id}), 400
+    
+    args = request.args
+    try:
+        region = args.get('region') or args.get('bbox')
+        if region:
+            region = [float(v) for v in region.split(',')]
+            if len(region) != 4:
+                raise ValueError('region must be x0,y0,x1,y1')
+        query = dict(
+            min_score=args.get('min_score', type=float),
+            max_score=args.get('max_score', type=float),
+            min_area=args.get('min_area', type=int),
+            max_area=args.get('max_area', type=int),
+            label=args.get('label', type=int),
+            lane=args.get('lane', type=int),
+            region=region or None,
+            sort=args.get('sort', 'id'),
+            descending=args.get('order', 'asc').lower() == 'desc',
+            offset=max(0, args.get('offset', 0, type=int)),
+            limit=args.get('limit', 100, type=int),
+            include_rle=args.get('rle', 'false').lower() == 'true'
+        )
+        table = load_spot_table(job_info)
+        total, spots = table.query(**query)
+    except SpotTablePending as e:
+        return spot_table_pending(e, job_id)
+    except FileNotFoundError as e:
+        return jsonify({'error': str(e), 'job_id': job_id}), 404
+    except ValueError as e:
+        return jsonify({'error': str(e), 'job_id': job_id}), 400
+    
+    disk_janitor.touch(job_info['results_dir'])
+    score_threshold, mask_threshold = (float(v) for v in table.columns['thresholds'])
+    return jsonify({
+        'job_id': job_id,
+        'total': total,
+        'offset': query['offset'],
+        'count': len(spots),
+        'score_threshold': round(score_threshold, 4),
+        'mask_threshold': round(mask_threshold, 4),
+        'spots': spots,
+        'download_url': url_for('download_result', job_id=job_id,
+                                filename=spots_path(job_info['results_dir'], spot_stem(job_info)).name)
+    })
+
+@app.route('/api/compare', methods=['GET', 'POST'])
+def api_compare_jobs():
+    """Align gels of completed jobs and match their spots against the first one"""
+    params = request.get_json(silent=True) or request.values
+    job_ids = params.get('jobs') or params.get('job_ids') or []
+    if isinstance(job_ids, str):
+        job_ids = [j for j in job_ids.split(',') if j]
+    if len(job_ids) < 2:
+        return jsonify({'error': 'Select at least two jobs to compare'}), 400
+    
+    try:
+        radius = float(params['radius']) if params.get('radius') else None
+    except (TypeError, ValueError):
+        return jsonify({'error': 'radius must be a number'}), 400
+    if radius is not None and radius <= 0:
+        return jsonify({'error': 'radius must be positive'}), 400
+    align = str(params.get('align', 'true')).lower() != 'false'
+    
+    tables = []
+    for job_id in job_ids:
+        job_info = pipeline_manager.get_job_status(job_id)
+        if job_info['status'] == 'not_found':
+            return jsonify({'error': 'Job not found', 'job_id': job_id}), 404
+        if job_info['status'] != 'completed' or job_info.get('child_jobs'):
+            return jsonify({'error': 'Only completed single-image jobs can be compared', 'job_id': job_id}), 400
+        try:
+            tables.append((job_id, load_spot_table(job_info)))
+        except SpotTablePending as e:
+            return spot_table_pending(e, job_id)
+        except FileNotFoundError as e:
+            return jsonify({'error': str(e), 'job_id': job_id}), 404
+        except ValueError as e:
+            return jsonify({'error': str(e), 'job_id': job_id}), 400
+        disk_janitor.touch(job_info['results_dir'])
+    
+    started = time.time()
+    result = compare_gels(tables[0][1], tables[1:], radius=radius, align=align)
+    result['reference'] = job_ids[0]
+    result['elapsed'] = round(time.time() - started, 4)
+    return jsonify(result)
+
+def export_entries(job_infos):
+    """Archive entries of the exported jobs, resolved as the archive is written"""
+    manifest = []
+    for job_info in job_infos:
+        disk_janitor.touch(job_info['results_dir'])
+        images = [pipeline_manager.get_job_status(child_id) for child_id in job_info.get('child_jobs', [])]
+        by_stem = {spot_stem(image): image for image in images or [job_info] if image.get('status') == 'completed'}
+        
+        def spot_csv(stem):
+            try:
+                # The archive is already streaming, so wait for a missing table
+                return load_spot_table(by_stem[stem], wait=True).iter_csv()
+            except (OSError, ValueError) as e:
+                print(f"[{job_info['job_id']}] No spot table for {stem} in export: {e}")
+                return None
+        
+        yield from job_entries(job_info, list(by_stem), spot_csv)
+        manifest.append({
+            'job_id': job_info['job_id'],
+            'images': sorted(by_stem),
+            'model': job_info.get('model'),
+            'score_threshold': job_info.get('score_threshold'),
+            'mask_threshold': job_info.get('mask_threshold'),
+            'end_time': job_info.get('end_time')
+        })
+    yield 'manifest.json', [json.dumps({'exported': datetime.now().isoformat(), 'jobs': manifest}, indent=2).encode()]
+
+@app.route('/api/export', methods=['GET', 'POST'])
+def api_export_jobs():
+    """Stream a ZIP of the artifacts and spot tables (CSV) of completed jobs"""
+    params = request.get_json(silent=True) or request.values
+    job_ids = params.get('jobs') or params.get('job_ids') or []
+    if isinstance(job_ids, str):
+        job_ids = [j for j in job_ids.split(',') if j]
+    job_ids = list(dict.fromkeys(job_ids))
+    if not job_ids:
+        return jsonify({'error': 'Select at least one job to export'}), 400
+    if len(job_ids) > app.config['EXPORT_MAX_JOBS']:
+        return jsonify({'error': f"At most {app.config['EXPORT_MAX_JOBS']} jobs can be exported at once"}), 400
+    
+    job_infos = []
+    for job_id in job_ids:
+        job_info = pipeline_manager.get_job_status(job_id)
+        if job_info['status'] == 'not_found':
+            return jsonify({'error': 'Job not found', 'job_id': job_id}), 404
+        if job_info['status'] != 'completed':
+            return jsonify({'error': 'Job not completed', 'job_id': job_id}), 400
+        if job_info.get('artifacts_purged'):
+            return jsonify({'error': 'Job results were deleted', 'job_id': job_id}), 410
+        job_infos.append(job_info)
+    
+    name = job_ids[0] if len(job_ids) == 1 else f"export_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+    return Response(
+        stream_zip(export_entries(job_infos)),
+        mimetype='application/zip',
+        headers={'Content-Disposition': f'attachment; filename="{name}.zip"', 'Cache-Control': 'no-store'},
+        direct_passthrough=True
+    )
+
+@app.route('/api/spots/recompute', methods=['GET', 'POST'])
+def api_recompute_spots():
+    """Rebuild the spot tables of completed jobs in the background (all, or the given job_ids)"""
+    if request.method == 'GET':
+        return jsonify(spot_tables.recompute_status or {'state': 'idle'})
+    
+    params = request.get_json(silent=True) or {}
+    job_ids = params.get('job_ids')
+    if job_ids is not None and not isinstance(job_ids, list):
+        return jsonify({'error': 'job_ids must be a list'}), 400
+    
+    sources = pipeline_manager.spot_table_sources(job_ids)
+    if not spot_tables.start_recompute(sources, on_done=pipeline_manager.update_spot_tables):
+        return jsonify(dict(spot_tables.recompute_status, error='A recompute is already running')), 409
+    return jsonify(spot_tables.recompute_status), 202
+
 @app.route('/api/job/<job_id>/cancel', methods=['POST'])
 def api_cancel_job(job_id):
     """API endpoint to cancel job"""
@@ -169,42 +891,110 @@ def api_cancel_job(job_id):
 
 @app.route('/api/system/status')
 def api_system_status():
-    """API endpoint for system status"""
-    try:
-        status = pipeline_manager.get_system_status()
-        return jsonify(status)
-    except Exception as e:
+    """API endpoint for system status (the latest background sample)"""
+    status = system_sampler.latest()
+    if status is None or 'error' in status:
         return jsonify({
             'cpu_percent': 0,
             'memory_percent': 0,
             'disk_usage': 0,
             'active_jobs': 0,
-            'error': str(e)
+            'error': status['error'] if status else 'No status sample yet'
         }), 500
+    return jsonify(status)
+
+@app.route('/api/system/history')
+def api_system_history():
+    """API endpoint for the sampled system status as time series"""
+    since = request.args.get('since', type=float)
+    limit = request.args.get('limit', type=int)
+    fields = request.args.get('fields')
+    if 'since' in request.args and since is None:
+        return jsonify({'error': 'since must be a timestamp'}), 400
+    if 'limit' in request.args and (limit is None or limit < 1):
+        return jsonify({'error': 'limit must be a positive integer'}), 400
+
+    if since is None and limit is None and not fields:
+        return Response(system_sampler.history_json(), mimetype='application/json')
+    fields = [field.strip() for field in fields.split(',') if field.strip()] if fields else None
+    return jsonify(system_sampler.history(since=since, fields=fields, limit=limit))
+
+@app.route('/api/models')
+def api_models():
+    """API endpoint listing registered models and their digests"""
+    return jsonify({'default': model_registry.default_id, 'models': model_registry.list_models()})
+
+@app.route('/api/models/reload', methods=['POST'])
+def api_models_reload():
+    """Rescan model directories now instead of waiting for the next periodic reload"""
+    changes = model_registry.reload()
+    return jsonify(dict(changes, default=model_registry.default_id, models=len(model_registry.list_models())))
+
+@app.route('/api/hot-folder')
+def api_hot_folder():
+    """API endpoint for the hot-folder watcher"""
+    if hot_folder is None:
+        return jsonify({'enabled': False})
+    return jsonify(dict(hot_folder.get_stats(), enabled=True))
+
+@app.route('/api/system/disk')
+def api_system_disk():
+    """API endpoint for disk usage and quotas of the managed storage areas"""
+    return jsonify(disk_janitor.get_stats())
+
+@app.route('/api/metrics')
+def api_metrics():
+    """API endpoint for stage timing and resource percentiles over recent jobs"""
+    try:
+        limit = min(request.args.get('limit', 500, type=int), 5000)
+        return jsonify(pipeline_manager.get_metrics_summary(limit=limit))
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/metrics')
+def prometheus_metrics():
+    """Prometheus scrape endpoint"""
+    return Response(metrics.render(), mimetype=None, content_type=METRICS_CONTENT_TYPE)
 
 @app.route('/download/<job_id>/<filename>')
 def download_result(job_id, filename):
-    """Download result files"""
-    job_info = pipeline_manager.get_job_status(job_id)
+    """Download result files (cacheable, conditional and Range requests)"""
+    file_path = artifacts.resolve(job_id, filename)
+    if file_path is None:
+        if pipeline_manager.get_job_status(job_id)['status'] != 'completed':
+            return jsonify({'error': 'Job not completed'}), 400
+        return jsonify({'error': 'File not found'}), 404
     
-    if job_info['status'] != 'completed':
-        return jsonify({'error': 'Job not completed'}), 400
+    return artifacts.send(file_path, as_attachment=True)
+
+@app.route('/preview/<job_id>/<filename>')
+def preview_result(job_id, filename):
+    """Inline result image, optionally downscaled (?size=) and converted (?format=webp|png|jpeg)"""
+    file_path = artifacts.resolve(job_id, filename)
+    if file_path is None:
+        return jsonify({'error': 'File not found', 'job_id': job_id}), 404
     
-    file_path = Path(job_info['results_dir']) / 'predictions' / filename
+    size = request.args.get('size', type=int)
+    fmt = request.args.get('format', 'webp' if size else None)
+    if size is None and fmt is None:
+        return artifacts.send(file_path)
+    if fmt not in DERIVATIVE_FORMATS or (size is not None and size < 1):
+        return jsonify({'error': 'size must be a positive integer and format one of ' +
+                                 ', '.join(DERIVATIVE_FORMATS)}), 400
     
-    if file_path.exists():
-        return send_file(str(file_path), as_attachment=True)
-    else:
-        return jsonify({'error': 'File not found'}), 404
+    try:
+        derivative, etag = artifacts.derivative(job_id, file_path, size or artifacts.sizes[-1], fmt)
+    except (OSError, ValueError) as e:
+        return jsonify({'error': f'Cannot render preview: {e}', 'job_id': job_id}), 415
+    return artifacts.send(derivative, etag=etag, mimetype=DERIVATIVE_FORMATS[fmt][1])
 
 @app.route('/debug/job/<job_id>')
 def debug_job(job_id):
     """Debug endpoint to see full job details"""
-    if job_id not in pipeline_manager.running_jobs:
+    job_info = pipeline_manager.get_job_status(job_id)
+    if job_info['status'] == 'not_found':
         return jsonify({'error': 'Job not found'}), 404
     
-    job_info = pipeline_manager.running_jobs[job_id]
-    
     debug_info = {
         'job_id': job_id,
         'status': job_info.get('status'),
@@ -213,7 +1003,8 @@ def debug_job(job_id):
         'image_path': job_info.get('image_path'),
         'results_dir': job_info.get('results_dir'),
         'error': job_info.get('error'),
-        'stdout': job_info.get('stdout'),
+        'log_path': job_info.get('log_path'),
+        'log_tail': pipeline_manager.logs.tail(job_id, 100),
         'stderr': job_info.get('stderr'),
         'return_code': job_info.get('return_code'),
         'start_time': job_info.get('start_time'),
@@ -241,40 +1032,57 @@ def debug_system():
     
     return jsonify(debug_info)
 
-def monitor_job_progress(job_id):
-    """Monitor job progress and emit updates via SocketIO"""
-    
-    while True:
-        job_info = pipeline_manager.get_job_status(job_id)
-        
-        # Emit progress update
-        socketio.emit('job_progress', {
-            'job_id': job_id,
-            'status': job_info['status'],
-            'progress': job_info.get('progress', 0)
-        })
-        
-        # Stop monitoring if job is finished
-        if job_info['status'] in ['completed', 'failed', 'cancelled']:
-            break
-        
-        time.sleep(2)  # Update every 2 seconds
+def job_room(job_id):
+    """SocketIO room name for a job's subscribers"""
+    return f'job:{job_id}'
+
+def job_progress_payload(job_id, job_info):
+    return {
+        'job_id': job_id,
+        'status': job_info['status'],
+        'progress': job_info.get('progress', 0),
+        'queue_position': job_info.get('queue_position')
+    }
+
+def emit_job_progress(job_id, job_info):
+    """Push job state changes from the pipeline manager to the job's room"""
+    socketio.emit('job_progress', job_progress_payload(job_id, job_info), to=job_room(job_id))
+
+def emit_job_log(job_id, lines):
+    """Stream newly written log lines via SocketIO"""
+    socketio.emit('job_log', {'job_id': job_id, 'lines': lines}, to=job_room(job_id))
 
 @socketio.on('connect')
 def handle_connect():
+    metrics.socketio_clients.inc()
     print('Client connected')
 
 @socketio.on('disconnect')
 def handle_disconnect():
+    metrics.socketio_clients.dec()
     print('Client disconnected')
 
 @socketio.on('join_job')
 def handle_join_job(data):
-    """Join a job room for updates"""
+    """Join a job room for updates and send the job's current state"""
     job_id = data['job_id']
-    # Join room for this specific job
-    # (implement room joining if needed)
+    join_room(job_room(job_id))
     emit('joined', {'job_id': job_id})
+    
+    # Late joiners would otherwise wait for the next transition
+    job_info = pipeline_manager.get_job_status(job_id)
+    if job_info['status'] != 'not_found':
+        emit('job_progress', job_progress_payload(job_id, job_info))
+
+@socketio.on('leave_job')
+def handle_leave_job(data):
+    """Leave a job room"""
+    leave_room(job_room(data['job_id']))
 
 if __name__ == '__main__':
-    socketio.run(app, debug=True, host='0.0.0.0', port=5000)
\ No newline at end of file
+    # The debug reloader serves from a child process (WERKZEUG_RUN_MAIN);
+    # the parent only watches files and must not start services of its own
+    use_reloader = True
+    if not use_reloader or os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        create_app()
+    socketio.run(app, debug=True, use_reloader=use_reloader, host='0.0.0.0', port=5000)
\ No newline at end of file
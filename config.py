@@ -12,20 +12,143 @@ class Config:
     UPLOAD_FOLDER = 'static/uploads'
     MAX_CONTENT_LENGTH = 16 * 1024 * 1024  # 16MB
     ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'bmp', 'tiff'}
+    UPLOAD_MAX_TOTAL_BYTES = int(os.environ.get('UPLOAD_MAX_TOTAL_BYTES', 2 * 1024 * 1024 * 1024))  # 2GB
+    UPLOAD_MAX_AGE_HOURS = float(os.environ.get('UPLOAD_MAX_AGE_HOURS', 24 * 7))
+    
+    # Resumable chunked uploads bypass MAX_CONTENT_LENGTH for the whole file;
+    # each chunk request must still fit within it
+    CHUNKED_UPLOAD_MAX_BYTES = int(os.environ.get('CHUNKED_UPLOAD_MAX_BYTES', 2 * 1024 * 1024 * 1024))  # 2GB
+    CHUNKED_UPLOAD_CHUNK_SIZE = int(os.environ.get('CHUNKED_UPLOAD_CHUNK_SIZE', 8 * 1024 * 1024))
+    CHUNKED_UPLOAD_TTL_HOURS = float(os.environ.get('CHUNKED_UPLOAD_TTL_HOURS', 24))
+    
+    # Upload ingest: decode/verify, EXIF orientation, 8-bit normalization and
+    # thumbnails run in a process pool before the job is queued
+    INGEST_WORKERS = int(os.environ.get('INGEST_WORKERS', 2))
+    INGEST_MAX_PIXELS = int(os.environ.get('INGEST_MAX_PIXELS', 500 * 1000 * 1000))
+    # Images queued for ingest before uploads are turned away with 503 (0 = unlimited)
+    INGEST_MAX_PENDING = int(os.environ.get('INGEST_MAX_PENDING', 64)) or None
+    THUMBNAIL_SIZE = int(os.environ.get('THUMBNAIL_SIZE', 256))
+    INGEST_MAX_TOTAL_BYTES = int(os.environ.get('INGEST_MAX_TOTAL_BYTES', 2 * 1024 * 1024 * 1024)) or None
     
     # Nextflow pipeline settings
     NEXTFLOW_PIPELINE_DIR = os.environ.get('NEXTFLOW_PIPELINE_DIR') or '/home/moon/mask_rcnn_gel'
     NEXTFLOW_RESULTS_DIR = 'results'
     NEXTFLOW_WORK_DIR = 'work'
+    # Each concurrent run gets its own launch dir (own .nextflow history,
+    # cache and locks); with NEXTFLOW_SHARED_CACHE the slots share one
+    # history/cache and are handed idle sessions to resume
+    NEXTFLOW_ISOLATE_LAUNCHES = os.environ.get('NEXTFLOW_ISOLATE_LAUNCHES', 'true').lower() == 'true'
+    NEXTFLOW_LAUNCH_DIR = os.environ.get('NEXTFLOW_LAUNCH_DIR') or None  # default: <pipeline dir>/.launch
+    NEXTFLOW_SHARED_CACHE = os.environ.get('NEXTFLOW_SHARED_CACHE', 'false').lower() == 'true'
+    
+    # Scheduler settings
+    MAX_CONCURRENT_RUNS = int(os.environ.get('MAX_CONCURRENT_RUNS', 2))
+    SCHEDULER_MAX_MEMORY_PERCENT = float(os.environ.get('SCHEDULER_MAX_MEMORY_PERCENT', 85))
+    SCHEDULER_MAX_CPU_PERCENT = float(os.environ.get('SCHEDULER_MAX_CPU_PERCENT', 95))
+    # Client-supplied job priorities are clamped to +/- MAX_JOB_PRIORITY
+    MAX_JOB_PRIORITY = int(os.environ.get('MAX_JOB_PRIORITY', 10))
+    
+    # Job store settings ('sqlite', 'memory', or 'redis' at REDIS_URL for workers on several nodes)
+    JOB_STORE_BACKEND = os.environ.get('JOB_STORE_BACKEND') or 'sqlite'
+    JOB_STORE_PATH = os.environ.get('JOB_STORE_PATH') or 'jobs.db'
+    JOB_RETENTION_HOURS = float(os.environ.get('JOB_RETENTION_HOURS', 24 * 30))
+    
+    # Job log settings
+    JOB_LOG_DIR = os.environ.get('JOB_LOG_DIR') or 'logs'
+    JOB_LOG_TAIL_LINES = int(os.environ.get('JOB_LOG_TAIL_LINES', 200))
+    
+    # Batch prediction settings
+    BATCH_PARALLELISM = int(os.environ.get('BATCH_PARALLELISM', 4))
+    MAX_BATCH_IMAGES = int(os.environ.get('MAX_BATCH_IMAGES', 200))
+    
+    # Tiled inference for large scans: images above TILING_MIN_PIXELS run as
+    # overlapping tiles that are stitched back into one result. Splitting
+    # decodes the whole scan in an ingest worker, so each of the
+    # INGEST_WORKERS can hold up to INGEST_MAX_PIXELS pixels (x bytes per
+    # pixel) while it splits; only later stages work a tile at a time
+    TILING_ENABLED = os.environ.get('TILING_ENABLED', 'true').lower() == 'true'
+    TILE_SIZE = int(os.environ.get('TILE_SIZE', 1024))
+    TILE_OVERLAP = int(os.environ.get('TILE_OVERLAP', 128))
+    TILING_MIN_PIXELS = int(os.environ.get('TILING_MIN_PIXELS', 2048 * 2048))
+    
+    # Disk janitor: per-area quotas (0 disables a limit); a sweep runs every
+    # DISK_JANITOR_INTERVAL seconds and after uploads
+    DISK_JANITOR_INTERVAL = float(os.environ.get('DISK_JANITOR_INTERVAL', 300))
+    DISK_INDEX_PATH = os.environ.get('DISK_INDEX_PATH') or 'disk_index.json'
+    # Cached results hit within this many hours are kept even over quota
+    DISK_RECENT_HIT_HOURS = float(os.environ.get('DISK_RECENT_HIT_HOURS', 24))
+    RESULTS_MAX_TOTAL_BYTES = int(os.environ.get('RESULTS_MAX_TOTAL_BYTES', 50 * 1024 * 1024 * 1024)) or None  # 50GB
+    RESULTS_MAX_AGE_HOURS = float(os.environ.get('RESULTS_MAX_AGE_HOURS', 24 * 30)) or None
+    WORK_MAX_TOTAL_BYTES = int(os.environ.get('WORK_MAX_TOTAL_BYTES', 20 * 1024 * 1024 * 1024)) or None  # 20GB
+    WORK_MAX_AGE_HOURS = float(os.environ.get('WORK_MAX_AGE_HOURS', 72)) or None
     
     # Model settings
-    MODEL_PATH = 'results/models/maskrcnn_gel_spots.pth'
+    # Model registry: directories searched in order (os.pathsep-separated),
+    # each optionally with a models.json manifest of named/versioned models
+    MODEL_DIRS = os.environ.get('MODEL_DIRS') or os.pathsep.join([
+        '/home/moon/gel_app/models',
+        os.path.join(NEXTFLOW_PIPELINE_DIR, 'results', 'models')
+    ])
+    MODEL_DEFAULT = os.environ.get('MODEL_DEFAULT') or 'maskrcnn_gel_spots'
+    MODEL_RELOAD_INTERVAL = float(os.environ.get('MODEL_RELOAD_INTERVAL', 30))
     SCORE_THRESHOLD = 0.8
     MASK_THRESHOLD = 0.8
     NUM_CLASSES = 2
     
+    # Execution backend: 'nextflow' launches a pipeline run per job, 'warm'
+    # keeps the model loaded in long-lived worker processes and only uses
+    # Nextflow for batches or when a worker cannot start
+    INFERENCE_BACKEND = os.environ.get('INFERENCE_BACKEND') or 'nextflow'
+    WARM_WORKERS = int(os.environ.get('WARM_WORKERS', 1))
+    WARM_WORKER_THREADS = int(os.environ.get('WARM_WORKER_THREADS', 0)) or None
+    
+    # Result cache settings
+    RESULT_CACHE_DIR = os.environ.get('RESULT_CACHE_DIR') or 'cache'
+    
+    # Completed-job artifacts are served with immutable caching for
+    # ARTIFACT_MAX_AGE seconds; previews are downscaled to the nearest of
+    # ARTIFACT_PREVIEW_SIZES and kept under ARTIFACT_DERIVATIVE_DIR (LRU)
+    ARTIFACT_MAX_AGE = int(os.environ.get('ARTIFACT_MAX_AGE', 365 * 24 * 3600))
+    ARTIFACT_PREVIEW_SIZES = os.environ.get('ARTIFACT_PREVIEW_SIZES') or '320,640,1280'
+    ARTIFACT_DERIVATIVE_DIR = os.environ.get('ARTIFACT_DERIVATIVE_DIR') or 'derivatives'
+    ARTIFACT_DERIVATIVE_MAX_BYTES = int(os.environ.get('ARTIFACT_DERIVATIVE_MAX_BYTES', 2 * 1024 * 1024 * 1024)) or None  # 2GB
+    
+    # Hot folders: image files written into HOT_FOLDER_DIRS (os.pathsep-separated,
+    # empty disables) are submitted once unchanged for HOT_FOLDER_SETTLE_SECONDS,
+    # in runs of up to HOT_FOLDER_BATCH_SIZE while fewer than
+    # HOT_FOLDER_MAX_QUEUED runs are waiting
+    HOT_FOLDER_DIRS = os.environ.get('HOT_FOLDER_DIRS') or ''
+    HOT_FOLDER_CHECKPOINT = os.environ.get('HOT_FOLDER_CHECKPOINT') or 'hot_folder.json'
+    HOT_FOLDER_RECURSIVE = os.environ.get('HOT_FOLDER_RECURSIVE', 'true').lower() == 'true'
+    HOT_FOLDER_SETTLE_SECONDS = float(os.environ.get('HOT_FOLDER_SETTLE_SECONDS', 10))
+    HOT_FOLDER_POLL_INTERVAL = float(os.environ.get('HOT_FOLDER_POLL_INTERVAL', 15))
+    HOT_FOLDER_BATCH_SIZE = int(os.environ.get('HOT_FOLDER_BATCH_SIZE', 16))
+    HOT_FOLDER_MAX_QUEUED = int(os.environ.get('HOT_FOLDER_MAX_QUEUED', 2))
+    
+    # Most jobs in one ZIP export (/api/export)
+    EXPORT_MAX_JOBS = int(os.environ.get('EXPORT_MAX_JOBS', 1000))
+    
+    # Spot quantification: bulk rebuilds of at least SPOT_RECOMPUTE_MIN_PARALLEL
+    # spot tables run in a pool of SPOT_RECOMPUTE_WORKERS processes
+    SPOT_RECOMPUTE_WORKERS = int(os.environ.get('SPOT_RECOMPUTE_WORKERS', 4))
+    SPOT_RECOMPUTE_MIN_PARALLEL = int(os.environ.get('SPOT_RECOMPUTE_MIN_PARALLEL', 8))
+    
     # Redis settings (optional - for job queue)
     REDIS_URL = os.environ.get('REDIS_URL') or 'redis://localhost:6379/0'
+    
+    # Worker tier: empty runs jobs inside the web process. 'file' queues them
+    # in WORKER_BROKER_DIR for worker.py processes on this host, 'celery' on
+    # Celery/Redis for workers on any node (they also need a shared job store
+    # and shared pipeline/results directories)
+    WORKER_BROKER = os.environ.get('WORKER_BROKER') or ''
+    WORKER_BROKER_DIR = os.environ.get('WORKER_BROKER_DIR') or 'broker'
+    WORKER_CONCURRENCY = int(os.environ.get('WORKER_CONCURRENCY', 2))
+    WORKER_PREFETCH = int(os.environ.get('WORKER_PREFETCH', 1))
+    
+    # System status is sampled every SYSTEM_SAMPLE_INTERVAL seconds in the
+    # background; the last SYSTEM_HISTORY_SIZE samples are kept (1h at 5s)
+    SYSTEM_SAMPLE_INTERVAL = float(os.environ.get('SYSTEM_SAMPLE_INTERVAL', 5))
+    SYSTEM_HISTORY_SIZE = int(os.environ.get('SYSTEM_HISTORY_SIZE', 720))
 
 class DevelopmentConfig(Config):
     DEBUG = True
@@ -0,0 +1,249 @@
+import os
+import json
+import time
+import socket
+from pathlib import Path
+
+# Workers whose last heartbeat is older than this are considered dead
+HEARTBEAT_TIMEOUT = 30
+# Priorities are stored offset so pending entries sort by name
+PRIORITY_OFFSET = 500000
+
+
+class FileBroker:
+    """Job queue in a directory, for running the worker tier on one box.
+
+    Queued jobs are files in pending/ named so that a sorted listing is
+    priority order (FIFO within a priority). Workers claim a job by
+    renaming its file into claimed/, which is atomic, so every job is
+    delivered to exactly one worker. Revocations and worker heartbeats
+    are plain files as well; the directory must be on a local (or
+    otherwise rename-atomic) filesystem shared by the web app and workers.
+    """
+
+    def __init__(self, root):
+        self.root = Path(root)
+        self.pending_dir = self.root / 'pending'
+        self.claimed_dir = self.root / 'claimed'
+        self.revoked_dir = self.root / 'revoked'
+        self.workers_dir = self.root / 'workers'
+        for path in (self.pending_dir, self.claimed_dir, self.revoked_dir, self.workers_dir):
+            path.mkdir(parents=True, exist_ok=True)
+
+    def _write(self, path, data):
+        tmp_path = path.with_name(f'.{path.name}.{os.getpid()}.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump(data, f)
+        os.replace(tmp_path, path)
+
+    def _pending(self):
+        """Pending entry names in delivery order"""
+        return sorted(name for name in os.listdir(self.pending_dir) if not name.startswith('.'))
+
+    def enqueue(self, job_id, priority=0):
+        name = f'{PRIORITY_OFFSET - int(priority):07d}-{time.time_ns()}__{job_id}.json'
+        self._write(self.pending_dir / name, {'job_id': job_id, 'priority': priority, 'enqueued': time.time()})
+
+    def remove(self, job_id):
+        """Drop a job nobody has claimed yet; False if it was already delivered"""
+        for name in self._pending():
+            if name.endswith(f'__{job_id}.json'):
+                try:
+                    os.unlink(self.pending_dir / name)
+                    return True
+                except FileNotFoundError:
+                    return False  # Claimed meanwhile
+        return False
+
+    def claim(self, worker_id):
+        """Take the next pending job for worker_id; returns its id or None"""
+        for name in self._pending():
+            job_id = name.split('__', 1)[1][:-len('.json')]
+            claimed = self.claimed_dir / f'{job_id}.json'
+            try:
+                os.rename(self.pending_dir / name, claimed)
+            except FileNotFoundError:
+                continue  # Another worker was faster
+            self._write(claimed, {'job_id': job_id, 'worker': worker_id, 'claimed': time.time(), 'entry': name})
+            return job_id
+        return None
+
+    def begin(self, job_id, worker_id):
+        """Called when a worker starts a delivered job; claims are already exclusive here"""
+        return True
+
+    def ack(self, job_id):
+        """Forget a finished (or skipped) job"""
+        for path in (self.claimed_dir / f'{job_id}.json', self.revoked_dir / job_id):
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+
+    def revoke(self, job_id):
+        """Ask whichever worker holds job_id to cancel it"""
+        (self.revoked_dir / job_id).touch()
+
+    def is_revoked(self, job_id):
+        return (self.revoked_dir / job_id).exists()
+
+    def queue_position(self, job_id):
+        for position, name in enumerate(self._pending(), 1):
+            if name.endswith(f'__{job_id}.json'):
+                return position
+        return None
+
+    def queued_count(self):
+        return len(self._pending())
+
+    def heartbeat(self, worker_id, info):
+        self._write(self.workers_dir / f'{worker_id}.json', dict(info, worker_id=worker_id, updated=time.time()))
+
+    def workers(self):
+        """Heartbeats of live workers"""
+        live = []
+        for path in self.workers_dir.glob('*.json'):
+            try:
+                with open(path, 'r') as f:
+                    info = json.load(f)
+            except (OSError, ValueError):
+                continue
+            if time.time() - info.get('updated', 0) < HEARTBEAT_TIMEOUT:
+                live.append(info)
+            elif time.time() - info.get('updated', 0) > HEARTBEAT_TIMEOUT * 10:
+                path.unlink(missing_ok=True)
+        return live
+
+    def requeue_stale(self):
+        """Put jobs claimed by dead workers back in the queue; returns their ids"""
+        live = {w['worker_id'] for w in self.workers()}
+        requeued = []
+        for path in self.claimed_dir.glob('*.json'):
+            try:
+                with open(path, 'r') as f:
+                    claim = json.load(f)
+                # A rename into claimed/ updates ctime, unlike mtime
+                claimed_at = os.stat(path).st_ctime
+            except (OSError, ValueError):
+                continue
+            if 'worker' not in claim:
+                # Still the pending entry: its worker has not annotated the
+                # claim yet, which only makes it stale once old enough
+                if time.time() - claimed_at < HEARTBEAT_TIMEOUT:
+                    continue
+            elif claim['worker'] in live:
+                continue
+            job_id = claim.get('job_id') or path.stem
+            entry = claim.get('entry') or f"{PRIORITY_OFFSET - int(claim.get('priority', 0)):07d}-0__{job_id}.json"
+            try:
+                os.rename(path, self.pending_dir / entry)
+                requeued.append(job_id)
+            except FileNotFoundError:
+                pass
+        return requeued
+
+    def describe(self):
+        return {'backend': 'file', 'root': str(self.root)}
+
+
+class CeleryBroker:
+    """Job queue on Celery with Redis, for workers on several nodes.
+
+    Jobs are Celery tasks named gel.run_job with the job id as task id.
+    Celery only delivers; which side wins a cancel/start race, the
+    revocation flags and the worker heartbeats are kept in Redis so
+    remove() can tell whether a job was withdrawn before any worker
+    started it.
+    """
+
+    TASK_NAME = 'gel.run_job'
+
+    def __init__(self, redis_url, queue='gel_jobs', prefix='gel:broker'):
+        import redis
+        from celery import Celery
+
+        self.redis = redis.Redis.from_url(redis_url, decode_responses=True)
+        self.queue = queue
+        self.prefix = prefix
+        self.app = Celery('gel_worker', broker=redis_url)
+        self.app.conf.update(
+            task_default_queue=queue,
+            # A job is only acknowledged once it finished, so jobs of a
+            # worker that dies mid-run are redelivered
+            task_acks_late=True,
+            task_reject_on_worker_lost=True,
+            broker_transport_options={'priority_steps': list(range(10)), 'queue_order_strategy': 'priority'}
+        )
+
+    def _key(self, *parts):
+        return ':'.join((self.prefix,) + parts)
+
+    def enqueue(self, job_id, priority=0):
+        # Celery on Redis runs priority 0 first
+        self.app.send_task(self.TASK_NAME, args=[job_id], task_id=job_id,
+                           priority=max(0, min(9, 5 - int(priority))))
+
+    def remove(self, job_id):
+        if self.redis.set(self._key('claim', job_id), 'cancelled', nx=True, ex=7 * 24 * 3600):
+            self.app.control.revoke(job_id)
+            return True
+        return False
+
+    def begin(self, job_id, worker_id):
+        """Claim a delivered job; False if it was withdrawn or another live worker runs it"""
+        key = self._key('claim', job_id)
+        if self.redis.set(key, worker_id, nx=True, ex=7 * 24 * 3600):
+            return True
+        owner = self.redis.get(key)
+        if owner == 'cancelled':
+            return False
+        if owner == worker_id or not self.redis.exists(self._key('worker', owner)):
+            # Redelivered after its worker died
+            self.redis.set(key, worker_id, ex=7 * 24 * 3600)
+            return True
+        return False
+
+    def ack(self, job_id):
+        self.redis.delete(self._key('claim', job_id), self._key('revoked', job_id))
+
+    def revoke(self, job_id):
+        self.redis.set(self._key('revoked', job_id), 1, ex=7 * 24 * 3600)
+
+    def is_revoked(self, job_id):
+        return bool(self.redis.exists(self._key('revoked', job_id)))
+
+    def queue_position(self, job_id):
+        return None  # Not observable through Celery
+
+    def queued_count(self):
+        # Celery's Redis transport keeps one list per queue and priority step
+        return sum(self.redis.llen(name) for name in self.redis.scan_iter(f'{self.queue}*')
+                   if self.redis.type(name) == 'list')
+
+    def heartbeat(self, worker_id, info):
+        self.redis.set(self._key('worker', worker_id),
+                       json.dumps(dict(info, worker_id=worker_id, updated=time.time())),
+                       ex=HEARTBEAT_TIMEOUT)
+
+    def workers(self):
+        keys = list(self.redis.scan_iter(self._key('worker', '*')))
+        return [json.loads(value) for value in self.redis.mget(keys) if value] if keys else []
+
+    def requeue_stale(self):
+        return []  # Celery redelivers unacknowledged tasks itself
+
+    def register(self, execute):
+        """Register execute(job_id) as the task run by Celery workers"""
+        return self.app.task(name=self.TASK_NAME)(execute)
+
+    def describe(self):
+        return {'backend': 'celery', 'queue': self.queue, 'host': socket.gethostname()}
+
+
+def create_broker(backend, path='broker', redis_url=None):
+    """Build a worker tier broker from configuration"""
+    if backend == 'file':
+        return FileBroker(path)
+    if backend == 'celery':
+        return CeleryBroker(redis_url)
+    raise ValueError(f"Unknown worker broker: {backend}")
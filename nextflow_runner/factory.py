@@ -0,0 +1,75 @@
+import os
+
+from .pipeline_manager import NextflowPipelineManager
+from .warm_worker import WarmWorkerPipelineManager
+from .worker_tier import DistributedPipelineManager
+from .brokers import create_broker
+from .job_store import create_job_store
+from .job_log import JobLogManager
+from .launch_dirs import LaunchDirPool
+from utils.tiling import Tiler
+
+
+def create_pipeline_manager(cfg, cache=None, model_registry=None, spot_tables=None, role='web', tile_pool=None):
+    """Build the pipeline manager for the web app or a worker from configuration.
+
+    cfg is a mapping of the settings in config.py. The web app queues
+    jobs on the worker tier when WORKER_BROKER is set and runs them
+    itself otherwise; role='worker' always runs them locally. Large scans
+    are split into tiles on tile_pool (an ImageIngestor) when given.
+    """
+    distributed = role == 'web' and bool(cfg['WORKER_BROKER'])
+
+    tiler = None
+    if cfg['TILING_ENABLED']:
+        tiler = Tiler(
+            tile_size=cfg['TILE_SIZE'],
+            overlap=cfg['TILE_OVERLAP'],
+            min_pixels=cfg['TILING_MIN_PIXELS'],
+            parallelism=cfg['BATCH_PARALLELISM'],
+            pool=tile_pool
+        )
+
+    # Only the processes that launch Nextflow need launch directories
+    launch_dirs = None
+    if cfg['NEXTFLOW_ISOLATE_LAUNCHES'] and not distributed:
+        launch_dirs = LaunchDirPool(
+            cfg['NEXTFLOW_PIPELINE_DIR'],
+            root=cfg['NEXTFLOW_LAUNCH_DIR'],
+            slots=cfg['WORKER_CONCURRENCY'] if role == 'worker' else cfg['MAX_CONCURRENT_RUNS'],
+            work_dir=os.path.join(cfg['NEXTFLOW_PIPELINE_DIR'], cfg['NEXTFLOW_WORK_DIR']),
+            shared_cache=cfg['NEXTFLOW_SHARED_CACHE']
+        )
+
+    pipeline_kwargs = dict(
+        pipeline_dir=cfg['NEXTFLOW_PIPELINE_DIR'],
+        results_dir=cfg['NEXTFLOW_RESULTS_DIR'],
+        work_dir=cfg['NEXTFLOW_WORK_DIR'],
+        cache=cache,
+        tiler=tiler,
+        launch_dirs=launch_dirs,
+        model_registry=model_registry,
+        spot_tables=spot_tables,
+        job_store=create_job_store(cfg['JOB_STORE_BACKEND'], cfg['JOB_STORE_PATH'], cfg['REDIS_URL']),
+        job_retention_hours=cfg['JOB_RETENTION_HOURS'],
+        log_manager=JobLogManager(cfg['JOB_LOG_DIR'], cfg['JOB_LOG_TAIL_LINES']),
+        max_concurrent_runs=cfg['MAX_CONCURRENT_RUNS'],
+        max_memory_percent=cfg['SCHEDULER_MAX_MEMORY_PERCENT'],
+        max_cpu_percent=cfg['SCHEDULER_MAX_CPU_PERCENT']
+    )
+
+    if distributed:
+        broker = create_broker(cfg['WORKER_BROKER'], cfg['WORKER_BROKER_DIR'], cfg['REDIS_URL'])
+        return DistributedPipelineManager(broker=broker, **pipeline_kwargs)
+
+    if role == 'worker':
+        # Queued jobs belong to the broker, which redelivers them
+        pipeline_kwargs['recover_statuses'] = ('starting', 'running')
+
+    if cfg['INFERENCE_BACKEND'] == 'warm':
+        return WarmWorkerPipelineManager(
+            num_workers=cfg['WARM_WORKERS'],
+            worker_threads=cfg['WARM_WORKER_THREADS'],
+            **pipeline_kwargs
+        )
+    return NextflowPipelineManager(**pipeline_kwargs)
@@ -0,0 +1,134 @@
+import os
+import queue
+import threading
+from collections import deque
+from pathlib import Path
+
+
+class JobLogManager:
+    """Per-job log files with an in-memory tail.
+
+    Reader threads call ``append`` which only touches an in-memory ring
+    buffer and a queue; a single writer thread does all file I/O and
+    hands batches of new lines to subscribers for live tailing.
+    """
+
+    def __init__(self, log_dir='logs', tail_lines=200):
+        self.log_dir = Path(log_dir)
+        self.log_dir.mkdir(parents=True, exist_ok=True)
+        self.tail_lines = tail_lines
+        self._tails = {}
+        self._subscribers = []
+        self._queue = queue.SimpleQueue()
+
+        self._writer = threading.Thread(target=self._write_loop, daemon=True)
+        self._writer.start()
+
+    def log_path(self, job_id):
+        return self.log_dir / f'{job_id}.log'
+
+    def open(self, job_id):
+        """Start capturing output for a job"""
+        self._tails[job_id] = deque(maxlen=self.tail_lines)
+        return str(self.log_path(job_id))
+
+    def append(self, job_id, line):
+        """Record one output line without blocking on I/O"""
+        tail = self._tails.get(job_id)
+        if tail is not None:
+            tail.append(line)
+        self._queue.put((job_id, line))
+
+    def close(self, job_id):
+        """Finish a job's log; the tail stays readable from disk"""
+        self._queue.put((job_id, None))
+        self._tails.pop(job_id, None)
+
+    def add_subscriber(self, callback):
+        """Register callback(job_id, lines) for newly written lines"""
+        self._subscribers.append(callback)
+
+    def tail(self, job_id, lines=50):
+        """Return the last lines of a job's output"""
+        live = self._tails.get(job_id)
+        if live is not None:
+            return list(live)[-lines:]
+        return self._read_tail_from_file(job_id, lines)
+
+    def read(self, job_id, offset=0, limit=64 * 1024):
+        """Read whole lines starting at a byte offset of the job's log file"""
+        path = self.log_path(job_id)
+        if not path.exists():
+            return None
+
+        size = path.stat().st_size
+        with open(path, 'rb') as f:
+            f.seek(offset)
+            data = f.read(limit)
+
+        # Only hand out complete lines unless this is the end of the file
+        eof = offset + len(data) >= size
+        if not eof and b'\n' in data:
+            data = data[:data.rindex(b'\n') + 1]
+
+        return {
+            'offset': offset,
+            'next_offset': offset + len(data),
+            'size': size,
+            'eof': eof,
+            'lines': data.decode('utf-8', errors='replace').splitlines()
+        }
+
+    def _read_tail_from_file(self, job_id, lines):
+        """Read the last lines of a log file by seeking backwards from the end"""
+        path = self.log_path(job_id)
+        if not path.exists():
+            return []
+
+        block_size = 8192
+        with open(path, 'rb') as f:
+            f.seek(0, os.SEEK_END)
+            position = f.tell()
+            data = b''
+            while position > 0 and data.count(b'\n') <= lines:
+                step = min(block_size, position)
+                position -= step
+                f.seek(position)
+                data = f.read(step) + data
+
+        return data.decode('utf-8', errors='replace').splitlines()[-lines:]
+
+    def _write_loop(self):
+        """Drain queued lines into log files and notify subscribers"""
+        files = {}
+        while True:
+            pending = {}
+            item = self._queue.get()
+            while True:
+                job_id, line = item
+                if line is None:
+                    handle = files.pop(job_id, None)
+                    if handle is not None:
+                        handle.close()
+                else:
+                    handle = files.get(job_id)
+                    if handle is None:
+                        handle = open(self.log_path(job_id), 'a', encoding='utf-8')
+                        files[job_id] = handle
+                    handle.write(line + '\n')
+                    pending.setdefault(job_id, []).append(line)
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+
+            for job_id in pending:
+                if job_id in files:
+                    files[job_id].flush()
+
+            for callback in self._subscribers:
+                for job_id, lines in pending.items():
+                    try:
+                        callback(job_id, lines)
+                    except Exception as e:
+                        print(f"[{job_id}] Log subscriber error: {e}")
@@ -0,0 +1,258 @@
+import json
+import time
+import sqlite3
+import threading
+from datetime import datetime
+
+
+class MemoryJobStore:
+    """In-process job store; records are lost on restart"""
+
+    def __init__(self):
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def save(self, record):
+        """Insert or replace a job record"""
+        with self._lock:
+            self._jobs[record['job_id']] = dict(record, updated=time.time())
+
+    def get(self, job_id):
+        with self._lock:
+            record = self._jobs.get(job_id)
+            return dict(record) if record is not None else None
+
+    def find(self, status=None, batch_id=None, limit=None):
+        """Return records filtered by status and/or batch, newest first"""
+        with self._lock:
+            records = [
+                dict(r) for r in self._jobs.values()
+                if (status is None or r.get('status') in _as_tuple(status))
+                and (batch_id is None or r.get('batch_id') == batch_id)
+            ]
+        records.sort(key=lambda r: r.get('submit_time') or r.get('start_time') or '', reverse=True)
+        return records[:limit] if limit else records
+
+    def claim(self, job_id, expected_owner, owner):
+        """Set the owner of a record only if it is still expected_owner; True on success"""
+        with self._lock:
+            record = self._jobs.get(job_id)
+            if record is None or record.get('owner') != expected_owner:
+                return False
+            self._jobs[job_id] = dict(record, owner=owner, updated=time.time())
+            return True
+
+    def delete(self, job_id):
+        with self._lock:
+            return self._jobs.pop(job_id, None) is not None
+
+    def prune(self, max_age_hours, statuses=('completed', 'failed', 'cancelled')):
+        """Delete finished records last updated more than max_age_hours ago"""
+        cutoff = time.time() - max_age_hours * 3600
+        with self._lock:
+            stale = [job_id for job_id, r in self._jobs.items()
+                     if r.get('status') in statuses and r['updated'] < cutoff]
+            for job_id in stale:
+                del self._jobs[job_id]
+        return len(stale)
+
+
+class SQLiteJobStore:
+    """Durable job store backed by SQLite, shareable across processes on one host"""
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS jobs (
+            job_id TEXT PRIMARY KEY,
+            status TEXT NOT NULL,
+            batch_id TEXT,
+            start_time TEXT,
+            submit_time TEXT,
+            owner TEXT,
+            updated REAL NOT NULL,
+            data TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs(status);
+        CREATE INDEX IF NOT EXISTS idx_jobs_start_time ON jobs(start_time);
+        CREATE INDEX IF NOT EXISTS idx_jobs_batch_id ON jobs(batch_id);
+    """
+
+    def __init__(self, db_path):
+        self.db_path = str(db_path)
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.executescript(self.SCHEMA)
+
+    def _connect(self):
+        """Return this thread's connection, opening it on first use"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def save(self, record):
+        """Insert or replace a job record"""
+        with self._connect() as conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO jobs '
+                '(job_id, status, batch_id, start_time, submit_time, owner, updated, data) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                (
+                    record['job_id'],
+                    record.get('status', 'unknown'),
+                    record.get('batch_id'),
+                    record.get('start_time'),
+                    record.get('submit_time'),
+                    record.get('owner'),
+                    time.time(),
+                    json.dumps(record)
+                )
+            )
+
+    def get(self, job_id):
+        row = self._connect().execute('SELECT data FROM jobs WHERE job_id = ?', (job_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def find(self, status=None, batch_id=None, limit=None):
+        """Return records filtered by status and/or batch, newest first"""
+        query = 'SELECT data FROM jobs'
+        clauses, params = [], []
+        if status is not None:
+            statuses = _as_tuple(status)
+            clauses.append(f"status IN ({', '.join('?' * len(statuses))})")
+            params.extend(statuses)
+        if batch_id is not None:
+            clauses.append('batch_id = ?')
+            params.append(batch_id)
+        if clauses:
+            query += ' WHERE ' + ' AND '.join(clauses)
+        query += ' ORDER BY COALESCE(submit_time, start_time) DESC'
+        if limit:
+            query += ' LIMIT ?'
+            params.append(int(limit))
+        return [json.loads(row[0]) for row in self._connect().execute(query, params)]
+
+    def claim(self, job_id, expected_owner, owner):
+        """Set the owner of a record only if it is still expected_owner; True on success"""
+        with self._connect() as conn:
+            return conn.execute(
+                "UPDATE jobs SET owner = ?, data = json_set(data, '$.owner', ?), updated = ? "
+                'WHERE job_id = ? AND owner IS ?',
+                (owner, owner, time.time(), job_id, expected_owner)
+            ).rowcount > 0
+
+    def delete(self, job_id):
+        with self._connect() as conn:
+            return conn.execute('DELETE FROM jobs WHERE job_id = ?', (job_id,)).rowcount > 0
+
+    def prune(self, max_age_hours, statuses=('completed', 'failed', 'cancelled')):
+        """Delete finished records last updated more than max_age_hours ago"""
+        cutoff = time.time() - max_age_hours * 3600
+        with self._connect() as conn:
+            return conn.execute(
+                f"DELETE FROM jobs WHERE updated < ? AND status IN ({', '.join('?' * len(statuses))})",
+                (cutoff, *statuses)
+            ).rowcount
+
+
+class RedisJobStore:
+    """Job store in Redis, shared by the web app and workers on any node"""
+
+    def __init__(self, redis_url, prefix='gel:jobs'):
+        import redis
+        self._redis = redis.Redis.from_url(redis_url, decode_responses=True)
+        self.prefix = prefix
+        self.index = f'{prefix}:index'
+
+    def _key(self, job_id):
+        return f'{self.prefix}:{job_id}'
+
+    def save(self, record):
+        """Insert or replace a job record"""
+        record = dict(record, updated=time.time())
+        submitted = record.get('submit_time') or record.get('start_time')
+        try:
+            score = datetime.fromisoformat(submitted).timestamp() if submitted else record['updated']
+        except ValueError:
+            score = record['updated']
+        pipe = self._redis.pipeline()
+        pipe.set(self._key(record['job_id']), json.dumps(record))
+        pipe.zadd(self.index, {record['job_id']: score})
+        pipe.execute()
+
+    def get(self, job_id):
+        data = self._redis.get(self._key(job_id))
+        return json.loads(data) if data else None
+
+    def _records(self):
+        """All records, newest first"""
+        job_ids = self._redis.zrevrange(self.index, 0, -1)
+        for start in range(0, len(job_ids), 500):
+            chunk = job_ids[start:start + 500]
+            for data in self._redis.mget([self._key(job_id) for job_id in chunk]):
+                if data:
+                    yield json.loads(data)
+
+    def find(self, status=None, batch_id=None, limit=None):
+        """Return records filtered by status and/or batch, newest first"""
+        records = []
+        for record in self._records():
+            if ((status is None or record.get('status') in _as_tuple(status))
+                    and (batch_id is None or record.get('batch_id') == batch_id)):
+                records.append(record)
+                if limit and len(records) >= limit:
+                    break
+        return records
+
+    def claim(self, job_id, expected_owner, owner):
+        """Set the owner of a record only if it is still expected_owner; True on success"""
+        import redis
+        key = self._key(job_id)
+        with self._redis.pipeline() as pipe:
+            try:
+                pipe.watch(key)
+                data = pipe.get(key)
+                if not data:
+                    return False
+                record = json.loads(data)
+                if record.get('owner') != expected_owner:
+                    return False
+                record.update(owner=owner, updated=time.time())
+                pipe.multi()
+                pipe.set(key, json.dumps(record))
+                pipe.execute()
+                return True
+            except redis.WatchError:
+                return False
+
+    def delete(self, job_id):
+        pipe = self._redis.pipeline()
+        pipe.delete(self._key(job_id))
+        pipe.zrem(self.index, job_id)
+        return pipe.execute()[0] > 0
+
+    def prune(self, max_age_hours, statuses=('completed', 'failed', 'cancelled')):
+        """Delete finished records last updated more than max_age_hours ago"""
+        cutoff = time.time() - max_age_hours * 3600
+        stale = [r['job_id'] for r in self._records()
+                 if r.get('status') in statuses and r.get('updated', 0) < cutoff]
+        for job_id in stale:
+            self.delete(job_id)
+        return len(stale)
+
+
+def _as_tuple(value):
+    return tuple(value) if isinstance(value, (list, tuple, set)) else (value,)
+
+
+def create_job_store(backend='sqlite', path='jobs.db', redis_url=None):
+    """Build a job store from configuration"""
+    if backend == 'memory':
+        return MemoryJobStore()
+    if backend == 'sqlite':
+        return SQLiteJobStore(path)
+    if backend == 'redis':
+        return RedisJobStore(redis_url)
+    raise ValueError(f"Unknown job store backend: {backend}")
@@ -0,0 +1,175 @@
+import os
+import threading
+from pathlib import Path
+
+
+class LaunchSlot:
+    """One isolated Nextflow launch directory"""
+
+    def __init__(self, index, path):
+        self.index = index
+        self.path = path
+        self.job_id = None
+        self.session_id = None
+
+
+class LaunchDirPool:
+    """Per-slot launch directories so concurrent Nextflow runs do not share locks.
+
+    Nextflow keeps its run history, task cache and session locks under
+    .nextflow/ in the launch directory, so two runs started with -resume
+    from the same directory resume the same session and contend for its
+    cache lock. Each slot here is its own launch directory: pipeline
+    assets are symlinked in read-only, .nextflow/ and .nextflow.log are
+    private, and all slots share one work directory (task hashes include
+    the session id, so sessions never collide in it).
+
+    With shared_cache, the slots also share .nextflow/history and
+    .nextflow/cache, and every run is handed an idle session to resume
+    explicitly. Completed tasks are then visible to the next run on any
+    slot, not just the next run on the same slot, while no session is
+    ever resumed by two runs at once.
+    """
+
+    def __init__(self, pipeline_dir, root=None, slots=2, work_dir=None, shared_cache=False):
+        self.pipeline_dir = Path(os.path.abspath(pipeline_dir))
+        self.root = Path(os.path.abspath(root)) if root else self.pipeline_dir / '.launch'
+        self.work_dir = Path(os.path.abspath(work_dir)) if work_dir else self.pipeline_dir / 'work'
+        self.shared_cache = shared_cache
+        self._lock = threading.Condition()
+        self._idle_sessions = []
+        self.slots = []
+        self.root.mkdir(parents=True, exist_ok=True)
+        for index in range(max(1, slots)):
+            self.slots.append(self._create_slot(index))
+        if shared_cache:
+            self._idle_sessions = self._recent_sessions(len(self.slots))
+
+    def _create_slot(self, index):
+        path = self.root / f'slot_{index}'
+        nextflow_dir = path / '.nextflow'
+        nextflow_dir.mkdir(parents=True, exist_ok=True)
+        if self.shared_cache:
+            shared = self.root / 'shared'
+            (shared / 'cache').mkdir(parents=True, exist_ok=True)
+            (shared / 'history').touch()
+            for name in ('cache', 'history'):
+                self._link(shared / name, nextflow_dir / name)
+        self._link_assets(path)
+        return LaunchSlot(index, path)
+
+    def _is_asset(self, name):
+        """Top-level pipeline entries that are inputs rather than per-run state"""
+        return not (
+            name.startswith('results_')
+            or name.startswith('.nextflow')
+            or name in (self.work_dir.name, self.root.name)
+        )
+
+    def _link(self, target, link):
+        if os.path.islink(link):
+            if os.readlink(link) == str(target):
+                return
+            os.unlink(link)
+        elif link.exists():
+            return  # Real per-slot state, keep it
+        os.symlink(str(target), str(link))
+
+    def _link_assets(self, slot_path):
+        """Mirror the pipeline's top-level assets into a slot as symlinks"""
+        names = {entry.name for entry in os.scandir(self.pipeline_dir) if self._is_asset(entry.name)}
+        for name in names:
+            self._link(self.pipeline_dir / name, slot_path / name)
+        # Drop links to assets that no longer exist
+        for entry in os.scandir(slot_path):
+            if entry.is_symlink() and entry.name not in names and not entry.name.startswith('.'):
+                os.unlink(entry.path)
+
+    def acquire(self, job_id):
+        """Reserve a free slot for job_id, blocking until one is available"""
+        with self._lock:
+            while True:
+                slot = next((s for s in self.slots if s.job_id is None), None)
+                if slot is not None:
+                    break
+                self._lock.wait()
+            slot.job_id = job_id
+            slot.session_id = self._idle_sessions.pop() if self.shared_cache and self._idle_sessions else None
+        try:
+            self._link_assets(slot.path)
+        except OSError as e:
+            print(f"[{job_id}] Could not refresh launch dir assets: {e}")
+        return slot
+
+    def claim(self, launch_dir, job_id, session_id=None):
+        """Mark the slot of a re-attached run as busy; returns the slot or None"""
+        with self._lock:
+            for slot in self.slots:
+                if str(slot.path) == str(launch_dir) and slot.job_id is None:
+                    slot.job_id = job_id
+                    slot.session_id = session_id
+                    if session_id in self._idle_sessions:
+                        self._idle_sessions.remove(session_id)
+                    return slot
+        return None
+
+    def release(self, slot, run_name=None):
+        """Free a slot; its session becomes resumable by the next run"""
+        session_id = slot.session_id
+        if self.shared_cache and session_id is None and run_name:
+            session_id = self._session_of(slot.path, run_name)
+        with self._lock:
+            if self.shared_cache and session_id and session_id not in self._idle_sessions:
+                self._idle_sessions.append(session_id)
+            slot.job_id = None
+            slot.session_id = None
+            self._lock.notify()
+
+    def _session_of(self, launch_dir, run_name):
+        """Session id of a run from the Nextflow history file"""
+        try:
+            with open(Path(launch_dir) / '.nextflow' / 'history', 'r') as f:
+                for line in f:
+                    # timestamp, duration, run name, status, revision, session id, command
+                    fields = line.rstrip('\n').split('\t')
+                    if len(fields) > 5 and fields[2] == run_name:
+                        return fields[5]
+        except OSError:
+            pass
+        return None
+
+    def _recent_sessions(self, limit):
+        """Newest distinct sessions of the shared history, oldest first"""
+        sessions = []
+        try:
+            with open(self.root / 'shared' / 'history', 'r') as f:
+                for line in f:
+                    fields = line.rstrip('\n').split('\t')
+                    if len(fields) > 5:
+                        if fields[5] in sessions:
+                            sessions.remove(fields[5])
+                        sessions.append(fields[5])
+        except OSError:
+            pass
+        return sessions[-limit:]
+
+    def launch_args(self, slot, run_name):
+        """Nextflow options placing a run in its slot"""
+        args = ['-name', run_name, '-w', str(self.work_dir)]
+        if self.shared_cache:
+            # Resume a known idle session explicitly; a bare -resume would
+            # pick the newest session in the shared history, which may be running
+            if slot.session_id:
+                args += ['-resume', slot.session_id]
+        else:
+            args.append('-resume')
+        return args
+
+    def get_stats(self):
+        with self._lock:
+            return {
+                'slots': len(self.slots),
+                'busy': sum(1 for s in self.slots if s.job_id is not None),
+                'idle_sessions': len(self._idle_sessions),
+                'shared_cache': self.shared_cache
+            }
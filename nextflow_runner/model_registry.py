@@ -0,0 +1,164 @@
+import os
+import json
+import time
+import threading
+from pathlib import Path
+
+from utils.file_handler import FileHandler
+
+MODEL_SUFFIXES = ('.pth', '.pt')
+MANIFEST_NAME = 'models.json'
+
+
+class ModelRegistry:
+    """Named, versioned model files with precomputed content digests.
+
+    Models are discovered in model_dirs, earlier directories taking
+    precedence. A directory may hold a models.json manifest listing
+    entries as {"path", "name", "version", "num_classes", "description",
+    "default"}; other model files are registered under their file stem.
+    Digests are computed at (re)load and only for files whose mtime or
+    size changed, so resolving a model on the request path is a dict
+    lookup. A background thread reloads every reload_interval seconds,
+    which picks up new, replaced and removed models without a restart.
+    """
+
+    def __init__(self, model_dirs, default_model=None, reload_interval=30):
+        self.model_dirs = [Path(os.path.abspath(d)) for d in model_dirs if d]
+        self.default_model = default_model
+        self.reload_interval = reload_interval
+        self._models = {}
+        self._default_id = None
+        self._digests = {}
+        self._reload_lock = threading.Lock()
+        self.reload()
+
+        if reload_interval:
+            self._thread = threading.Thread(target=self._reload_loop, daemon=True)
+            self._thread.start()
+
+    def _reload_loop(self):
+        while True:
+            time.sleep(self.reload_interval)
+            try:
+                self.reload()
+            except Exception as e:
+                print(f"[models] Reload error: {e}")
+
+    def _digest(self, path, stat):
+        """Content digest of a model file, reusing the last one while mtime/size are unchanged"""
+        signature = (stat.st_mtime_ns, stat.st_size)
+        cached = self._digests.get(path)
+        if cached and cached[0] == signature:
+            return cached[1]
+        digest = FileHandler.hash_file(path)
+        self._digests[path] = (signature, digest)
+        return digest
+
+    def _read_manifest(self, model_dir):
+        manifest_path = model_dir / MANIFEST_NAME
+        if not manifest_path.exists():
+            return []
+        try:
+            with open(manifest_path, 'r') as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"[models] Ignoring unreadable manifest {manifest_path}: {e}")
+            return []
+        return data.get('models', []) if isinstance(data, dict) else data
+
+    def _discover(self):
+        """Yield candidate model entries from all model directories"""
+        for model_dir in self.model_dirs:
+            if not model_dir.is_dir():
+                continue
+            listed = set()
+            for entry in self._read_manifest(model_dir):
+                if not isinstance(entry, dict) or not entry.get('path') or not entry.get('name'):
+                    print(f"[models] Skipping manifest entry missing path or name in {model_dir}: {entry!r}")
+                    continue
+                path = (model_dir / entry['path']).resolve()
+                listed.add(path)
+                yield dict(entry, path=str(path))
+            for path in sorted(model_dir.iterdir()):
+                if path.suffix in MODEL_SUFFIXES and path.resolve() not in listed:
+                    yield {'name': path.stem, 'path': str(path.resolve())}
+
+    def reload(self):
+        """Rescan model directories; returns the ids added, changed and removed"""
+        with self._reload_lock:
+            models = {}
+            for entry in self._discover():
+                try:
+                    stat = os.stat(entry['path'])
+                    digest = self._digest(entry['path'], stat)
+                except OSError as e:
+                    print(f"[models] Skipping {entry['path']}: {e}")
+                    continue
+                version = entry.get('version')
+                model_id = f"{entry['name']}:{version}" if version else entry['name']
+                if model_id in models:
+                    continue  # Shadowed by an earlier model directory
+                models[model_id] = {
+                    'id': model_id,
+                    'name': entry['name'],
+                    'version': str(version) if version else None,
+                    'path': entry['path'],
+                    'digest': digest,
+                    'size': stat.st_size,
+                    'mtime': stat.st_mtime,
+                    'num_classes': entry.get('num_classes'),
+                    'description': entry.get('description'),
+                    'default': bool(entry.get('default'))
+                }
+
+            previous = self._models
+            changes = {
+                'added': sorted(set(models) - set(previous)),
+                'removed': sorted(set(previous) - set(models)),
+                'changed': sorted(m for m in set(models) & set(previous)
+                                  if models[m]['digest'] != previous[m]['digest'])
+            }
+            live_paths = {m['path'] for m in models.values()}
+            self._digests = {p: d for p, d in self._digests.items() if p in live_paths}
+
+            self._models = models
+            default = self._lookup(models, self.default_model) if self.default_model else None
+            if default is None:
+                default = next((m for m in models.values() if m['default']), None)
+            if default is None and models:
+                default = next(iter(models.values()))
+            self._default_id = default['id'] if default else None
+
+            if any(changes.values()):
+                print(f"[models] Reloaded: {len(models)} models, added {changes['added']}, "
+                      f"changed {changes['changed']}, removed {changes['removed']}")
+            return changes
+
+    @staticmethod
+    def _lookup(models, key):
+        """Find a model by id, by name (default or newest version) or by digest prefix"""
+        if key in models:
+            return models[key]
+        versions = [m for m in models.values() if m['name'] == key]
+        if versions:
+            return max(versions, key=lambda m: (m['default'], m['mtime']))
+        if len(key) >= 8:
+            matches = [m for m in models.values() if m['digest'].startswith(key)]
+            if len(matches) == 1:
+                return matches[0]
+        return None
+
+    def get(self, key=None):
+        """Return a copy of the selected (or default) model, or None if unknown"""
+        models = self._models
+        model = self._lookup(models, key) if key else models.get(self._default_id)
+        return dict(model) if model is not None else None
+
+    def list_models(self):
+        models = self._models
+        return [dict(m, default=(m['id'] == self._default_id)) for m in models.values()]
+
+    @property
+    def default_id(self):
+        return self._default_id
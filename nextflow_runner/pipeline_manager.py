@@ -3,17 +3,58 @@ import subprocess
 import json
 import time
 import uuid
+import shutil
+import socket
 from pathlib import Path
 from datetime import datetime
 import psutil
 import threading
 
+from .scheduler import JobScheduler
+from .job_store import MemoryJobStore
+from .job_log import JobLogManager
+from .trace_parser import NextflowProgressTracker
+from .profiler import JobProfiler, parse_report, summarize_tasks, aggregate_metrics
+from .model_registry import ModelRegistry
+from utils.file_handler import FileHandler
+
+TRACE_POLL_INTERVAL = 1.0
+
+TERMINAL_STATUSES = ('completed', 'failed', 'cancelled')
+ACTIVE_STATUSES = ('preparing', 'queued', 'starting', 'running')
+
 class NextflowPipelineManager:
-    def __init__(self, pipeline_dir, results_dir='results', work_dir='work'):
-        self.pipeline_dir = Path(pipeline_dir)
+    def __init__(self, pipeline_dir, results_dir='results', work_dir='work', cache=None,
+                 max_concurrent_runs=2, max_memory_percent=85.0, max_cpu_percent=95.0,
+                 job_store=None, job_retention_hours=24 * 30, log_manager=None, profiler=None,
+                 tiler=None, launch_dirs=None, model_registry=None, spot_tables=None,
+                 recover_statuses=ACTIVE_STATUSES):
+        # Absolute, since runs may be launched from other directories
+        self.pipeline_dir = Path(os.path.abspath(pipeline_dir))
         self.results_dir = Path(results_dir)
         self.work_dir = Path(work_dir)
+        # Live records (with process handles) of jobs owned by this process;
+        # finished jobs are served from the job store
         self.running_jobs = {}
+        self.job_store = job_store if job_store is not None else MemoryJobStore()
+        self.job_retention_hours = job_retention_hours
+        self.owner = f"{socket.gethostname()}:{os.getpid()}"
+        self.logs = log_manager if log_manager is not None else JobLogManager()
+        self.profiler = profiler if profiler is not None else JobProfiler()
+        self._last_prune = 0
+        self.cache = cache
+        self.tiler = tiler
+        self.launch_dirs = launch_dirs
+        self.spot_tables = spot_tables
+        # Workers leave queued jobs to the broker, which redelivers them
+        self.recover_statuses = recover_statuses
+        self._listeners = []
+        self.scheduler = JobScheduler(
+            max_concurrent=max_concurrent_runs,
+            max_memory_percent=max_memory_percent,
+            max_cpu_percent=max_cpu_percent,
+            resource_probe=self._sample_resources
+        )
         
         # Validate pipeline directory
         if not self.pipeline_dir.exists():
@@ -21,6 +62,15 @@ class NextflowPipelineManager:
         
         if not (self.pipeline_dir / 'main.nf').exists():
             raise ValueError(f"main.nf not found in: {pipeline_dir}")
+        
+        if model_registry is None:
+            model_registry = ModelRegistry(
+                ['/home/moon/gel_app/models', self.pipeline_dir / 'results' / 'models'],
+                default_model='maskrcnn_gel_spots'
+            )
+        self.models = model_registry
+        
+        self._recover_jobs()
     
     def run_prediction(self, image_path, job_id=None, **kwargs):
         """Run Nextflow pipeline for single image prediction"""
@@ -37,67 +87,342 @@ class NextflowPipelineManager:
                 'start_time': datetime.now().isoformat()
             }
     
-        # Check for model in app directory first, then pipeline directory
-        app_model_path = Path('/home/moon/gel_app/models/maskrcnn_gel_spots.pth')
-        pipeline_model_path = self.pipeline_dir / 'results' / 'models' / 'maskrcnn_gel_spots.pth'
-    
-        if app_model_path.exists():
-            model_path = str(app_model_path.absolute())
-            print(f"[{job_id}] Using model from app directory: {model_path}")
-        elif pipeline_model_path.exists():
-            model_path = str(pipeline_model_path.absolute())
-            print(f"[{job_id}] Using model from pipeline directory: {model_path}")
-        else:
+        model, model_error = self._resolve_model(job_id, kwargs.get('model'))
+        if model is None:
             return job_id, {
                 'job_id': job_id,
                 'status': 'failed',
-                'error': f'Trained model not found in:\n- {app_model_path}\n- {pipeline_model_path}',
+                'error': model_error,
                 'start_time': datetime.now().isoformat()
             }
+        if model.get('num_classes'):
+            kwargs = dict(kwargs, num_classes=model['num_classes'])
+    
+        # Serve identical requests from the result cache
+        cache_key, cached = self._lookup_cache(image_path, model, kwargs.get('image_hash'), kwargs)
+        if cached is not None:
+            return job_id, self._create_cached_job(job_id, image_path, model, cached)
     
         # Prepare output directory
         output_dir = self.pipeline_dir / f'results_{job_id}'
         output_dir.mkdir(exist_ok=True)
     
+        # Large scans run as one batch of overlapping tiles that is stitched
+        # back into a single result when the run finishes
+        tiling = None
+        test_image = os.path.abspath(image_path)
+        if self.tiler is not None and self.tiler.needs_tiling(image_path):
+            try:
+                tiling = self.tiler.split(image_path, output_dir / 'tiles' / 'input')
+            except Exception as e:
+                return job_id, {
+                    'job_id': job_id,
+                    'status': 'failed',
+                    'error': f'Could not split image into tiles: {e}',
+                    'start_time': datetime.now().isoformat()
+                }
+            test_image = str(output_dir / 'tiles' / 'input' / '*.png')
+            kwargs = dict(kwargs, parallelism=kwargs.get('parallelism') or self.tiler.parallelism)
+            print(f"[{job_id}] Split {tiling['image_size'][0]}x{tiling['image_size'][1]} image into {len(tiling['tiles'])} tiles")
+    
+        cmd = self._build_command(test_image, model['path'], output_dir, kwargs)
+    
+        # Create job info
+        job_info = {
+            'job_id': job_id,
+            'status': 'queued',
+            'command': ' '.join(cmd),
+            'command_args': cmd,
+            'submit_time': datetime.now().isoformat(),
+            'image_path': str(image_path),
+            'results_dir': str(output_dir),
+            'result_stem': Path(image_path).stem,
+            'process': None,
+            'progress': 0,
+            'priority': kwargs.get('priority', 0),
+            'upload_seconds': kwargs.get('upload_seconds'),
+            'prepare_seconds': kwargs.get('prepare_seconds'),
+            'input': kwargs.get('input'),
+            'score_threshold': kwargs.get('score_threshold', 0.8),
+            'mask_threshold': kwargs.get('mask_threshold', 0.8),
+            'num_classes': kwargs.get('num_classes', 2),
+            'pipeline_dir': str(self.pipeline_dir),
+            **self._model_fields(model),
+            'cache_key': cache_key,
+            'tiling': tiling
+        }
+    
+        self.running_jobs[job_id] = job_info
+        self.scheduler.submit(job_id, self._run_job, priority=job_info['priority'])
+        self._notify(job_id)
+    
+        print(f"[{job_id}] Job queued (priority {job_info['priority']})")
+        return job_id, job_info
+    
+    def run_prediction_when_ready(self, future, image_path, job_id=None, **kwargs):
+        """Register a job now and run it once its input has been prepared.
+        
+        future (e.g. from an ingest process pool) must resolve to a dict
+        with the 'path' of the image to run, or an 'error' that fails the
+        job; the dict is recorded on the job as 'input'. The caller does
+        not wait for preparation.
+        """
+        
+        if job_id is None:
+            job_id = str(uuid.uuid4())
+        
+        job_info = {
+            'job_id': job_id,
+            'status': 'preparing',
+            'submit_time': datetime.now().isoformat(),
+            'image_path': str(image_path),
+            'process': None,
+            'progress': 0,
+            'priority': kwargs.get('priority', 0),
+            'upload_seconds': kwargs.get('upload_seconds')
+        }
+        self._register_job(job_info)
+        # Submitting may split tiles or hash files, so keep it off the pool's callback thread
+        future.add_done_callback(lambda done: threading.Thread(
+            target=self._on_input_ready, args=(job_id, done, kwargs), daemon=True
+        ).start())
+        return job_id, job_info
+    
+    def _on_input_ready(self, job_id, future, kwargs):
+        """Submit a preparing job once its input future has resolved"""
+        job_info = self.running_jobs.get(job_id)
+        if job_info is None or job_info['status'] != 'preparing':
+            return  # Cancelled while preparing
+        
+        try:
+            prepared = future.result()
+        except Exception as e:
+            prepared = {'error': str(e)}
+        
+        prepare_seconds = (datetime.now() - datetime.fromisoformat(job_info['submit_time'])).total_seconds()
+        if not prepared.get('error'):
+            _, result = self.run_prediction(
+                prepared['path'], job_id=job_id, input=prepared, prepare_seconds=prepare_seconds, **kwargs
+            )
+            if result['status'] != 'failed':
+                return
+            prepared = dict(prepared, error=result['error'])
+        
+        # Failures before queueing are not registered by run_prediction
+        job_info['status'] = 'failed'
+        job_info['error'] = prepared['error']
+        job_info['input'] = prepared
+        job_info['end_time'] = datetime.now().isoformat()
+        print(f"[{job_id}] Input preparation failed: {prepared['error']}")
+        self._notify(job_id)
+    
+    def run_batch_prediction(self, image_paths, batch_id=None, image_hashes=None, parallelism=4, **kwargs):
+        """Run many images through a single Nextflow pipeline run.
+        
+        Each image gets its own job record; images already in the result
+        cache complete immediately and are not staged. Returns
+        (batch_id, job_ids).
+        """
+    
+        if batch_id is None:
+            batch_id = str(uuid.uuid4())
+        image_hashes = image_hashes or {}
+    
+        model, model_error = self._resolve_model(batch_id, kwargs.get('model'))
+        if model is None:
+            job_ids = []
+            for image_path in image_paths:
+                job_id = str(uuid.uuid4())
+                self._register_job({
+                    'job_id': job_id,
+                    'status': 'failed',
+                    'error': model_error,
+                    'image_path': str(image_path),
+                    'batch_id': batch_id,
+                    'start_time': datetime.now().isoformat()
+                })
+                job_ids.append(job_id)
+            return batch_id, job_ids
+    
+        if model.get('num_classes'):
+            kwargs = dict(kwargs, num_classes=model['num_classes'])
+    
+        batch_dir = self.pipeline_dir / f'results_{batch_id}'
+        input_dir = batch_dir / 'input'
+        input_dir.mkdir(parents=True, exist_ok=True)
+    
+        job_ids = []
+        child_jobs = []
+        for index, image_path in enumerate(image_paths):
+            job_id = str(uuid.uuid4())
+            job_ids.append(job_id)
+    
+            if not os.path.exists(image_path):
+                self._register_job({
+                    'job_id': job_id,
+                    'status': 'failed',
+                    'error': f'Input image not found: {image_path}',
+                    'image_path': str(image_path),
+                    'batch_id': batch_id,
+                    'start_time': datetime.now().isoformat()
+                })
+                continue
+    
+            cache_key, cached = self._lookup_cache(image_path, model, image_hashes.get(image_path), kwargs)
+            if cached is not None:
+                self._create_cached_job(job_id, image_path, model, cached, batch_id=batch_id)
+                continue
+    
+            # Prefix with the index so identical basenames don't collide
+            staged_name = f'{index:04d}_{os.path.basename(image_path)}'
+            self._stage_file(image_path, input_dir / staged_name)
+    
+            self.running_jobs[job_id] = {
+                'job_id': job_id,
+                'status': 'queued',
+                'submit_time': datetime.now().isoformat(),
+                'image_path': str(image_path),
+                'staged_name': staged_name,
+                'results_dir': str(batch_dir),
+                'result_stem': Path(staged_name).stem,
+                'process': None,
+                'progress': 0,
+                'score_threshold': kwargs.get('score_threshold', 0.8),
+                'mask_threshold': kwargs.get('mask_threshold', 0.8),
+                'pipeline_dir': str(self.pipeline_dir),
+                **self._model_fields(model),
+                'cache_key': cache_key,
+                'batch_id': batch_id
+            }
+            child_jobs.append(job_id)
+    
+        if not child_jobs:
+            print(f"[{batch_id}] Batch fully served from cache")
+            return batch_id, job_ids
+    
+        batch_kwargs = dict(kwargs, parallelism=parallelism)
+        cmd = self._build_command(str(input_dir / '*'), model['path'], batch_dir, batch_kwargs)
+    
+        batch_info = {
+            'job_id': batch_id,
+            'status': 'queued',
+            'command': ' '.join(cmd),
+            'command_args': cmd,
+            'submit_time': datetime.now().isoformat(),
+            'image_path': str(input_dir),
+            'results_dir': str(batch_dir),
+            'process': None,
+            'progress': 0,
+            'priority': kwargs.get('priority', 0),
+            'pipeline_dir': str(self.pipeline_dir),
+            **self._model_fields(model),
+            'child_jobs': child_jobs,
+            'batch_size': len(child_jobs)
+        }
+    
+        self.running_jobs[batch_id] = batch_info
+        self.scheduler.submit(batch_id, self._run_job, priority=batch_info['priority'])
+        self._notify(batch_id)
+    
+        print(f"[{batch_id}] Batch of {len(child_jobs)} images queued")
+        return batch_id, job_ids
+    
+    def _build_command(self, test_image, model_path, output_dir, kwargs):
+        """Build the nextflow command line for a test run"""
+        
         # CRITICAL: Make sure this command includes --model_file with full path
         cmd = [
             'nextflow', 'run', str(self.pipeline_dir / 'main.nf'),
             '-profile', 'docker,low_memory,monitor',
             '--mode', 'test',
-            '--test_image', os.path.abspath(image_path),
+            '--test_image', test_image,
             '--model_file', model_path,  # ← THIS LINE MUST BE HERE
             '--outdir', str(output_dir),
             '--score_threshold', str(kwargs.get('score_threshold', 0.8)),
             '--mask_threshold', str(kwargs.get('mask_threshold', 0.8)),
             '--num_classes', str(kwargs.get('num_classes', 2)),
+            '--save_detections', 'true',  # raw scores/boxes/soft masks for re-thresholding
             '-with-trace', str(output_dir / 'trace.txt'),
             '-with-report', str(output_dir / 'report.html'),
             '-resume'
         ]
+        
+        # Limit how many tasks of a batch run in parallel
+        if kwargs.get('parallelism'):
+            cmd += ['-qs', str(kwargs['parallelism'])]
+        
+        return cmd
     
-        # Create job info
-        job_info = {
-            'job_id': job_id,
-            'status': 'starting',
-            'command': ' '.join(cmd),
-            'start_time': datetime.now().isoformat(),
-            'image_path': str(image_path),
-            'results_dir': str(output_dir),
-            'process': None,
-            'progress': 0,
-            'pipeline_dir': str(self.pipeline_dir),
-            'model_path': model_path
-        }
+    def _lookup_cache(self, image_path, model, image_hash, kwargs):
+        """Return (cache_key, cached_entry) for a prediction request"""
+        if self.cache is None:
+            return None, None
+        
+        if image_hash is None:
+            image_hash = FileHandler.hash_file(image_path)
+        cache_key = self.cache.make_key(
+            image_hash,
+            kwargs.get('score_threshold', 0.8),
+            kwargs.get('mask_threshold', 0.8),
+            kwargs.get('num_classes', 2),
+            model['digest']
+        )
+        return cache_key, self.cache.get(cache_key)
+    
+    def _stage_file(self, source, target):
+        """Link an input image into a staging directory, copying as a fallback"""
+        source = os.path.abspath(source)
+        try:
+            os.link(source, target)
+        except OSError:
+            try:
+                os.symlink(source, target)
+            except OSError:
+                shutil.copy2(source, target)
+    
+    def _run_job(self, job_id):
+        """Launch a queued job and monitor it on the scheduler's worker thread"""
+        
+        job_info = self.running_jobs.get(job_id)
+        if job_info is None or job_info['status'] != 'queued':
+            return  # Cancelled while waiting in the queue
+        
+        cmd = job_info['command_args']
+        job_info['start_time'] = datetime.now().isoformat()
+        
+        # Run from an isolated launch dir so concurrent runs do not share
+        # Nextflow's history, cache and session locks
+        slot = None
+        launch_dir = self.pipeline_dir
+        if self.launch_dirs is not None:
+            slot = self.launch_dirs.acquire(job_id)
+            launch_dir = slot.path
+            run_name = f'job-{job_id}'
+            cmd = [arg for arg in cmd if arg != '-resume'] + self.launch_dirs.launch_args(slot, run_name)
+            job_info['command'] = ' '.join(cmd)
+            job_info['launch_dir'] = str(launch_dir)
+            job_info['run_name'] = run_name
+            job_info['resumed_session'] = slot.session_id
+        
+        try:
+            self._launch_and_monitor(job_id, cmd, launch_dir)
+        finally:
+            if slot is not None:
+                self.launch_dirs.release(slot, job_info.get('run_name'))
+    
+    def _launch_and_monitor(self, job_id, cmd, launch_dir):
+        """Start the Nextflow process of a job and block until it finishes"""
+        job_info = self.running_jobs[job_id]
     
         try:
             print(f"[{job_id}] Starting Nextflow with Docker:")
             print(f"[{job_id}] Command: {' '.join(cmd)}")
-            print(f"[{job_id}] Model path being passed: {model_path}")
+            print(f"[{job_id}] Model path being passed: {job_info['model_path']}")
         
             # Start the process
             process = subprocess.Popen(
                 cmd,
-                cwd=str(self.pipeline_dir),
+                cwd=str(launch_dir),
                 stdout=subprocess.PIPE,
                 stderr=subprocess.STDOUT,
                 universal_newlines=True,
@@ -107,19 +432,10 @@ class NextflowPipelineManager:
             job_info['process'] = process
             job_info['status'] = 'running'
             job_info['pid'] = process.pid
-        
-            self.running_jobs[job_id] = job_info
-        
-            # Start monitoring thread
-            monitor_thread = threading.Thread(
-                target=self._monitor_process,
-                args=(job_id,),
-                daemon=True
-            )
-            monitor_thread.start()
+            self.profiler.start_job(job_id, process.pid)
+            self._notify(job_id)
         
             print(f"[{job_id}] Job started with PID {process.pid} using Docker")
-            return job_id, job_info
         
         except Exception as e:
             error_msg = f"Failed to start Nextflow process: {str(e)}"
@@ -128,7 +444,202 @@ class NextflowPipelineManager:
             job_info['status'] = 'failed'
             job_info['error'] = error_msg
             job_info['end_time'] = datetime.now().isoformat()
-            return job_id, job_info
+            self._notify(job_id)
+            return
+        
+        self._monitor_process(job_id)
+    
+    def add_listener(self, callback):
+        """Register callback(job_id, job_info) for job state changes"""
+        self._listeners.append(callback)
+    
+    def _register_job(self, job_info):
+        """Track a new job record and persist it"""
+        self.running_jobs[job_info['job_id']] = job_info
+        self._notify(job_info['job_id'])
+    
+    def _notify(self, job_id):
+        """Persist a job state change and send it to all listeners"""
+        if job_id not in self.running_jobs:
+            return
+        
+        # Batch runs fan their state out to the per-image job records
+        live_info = self.running_jobs[job_id]
+        child_jobs = live_info.get('child_jobs')
+        if child_jobs:
+            self._sync_batch_children(job_id)
+            for child_id in child_jobs:
+                self._notify(child_id)
+        
+        # Write-through to the job store
+        record = self._make_json_serializable(live_info)
+        record['command_args'] = live_info.get('command_args')
+        record['owner'] = self.owner
+        try:
+            self.job_store.save(record)
+        except Exception as e:
+            print(f"[{job_id}] Job store error: {e}")
+        
+        job_info = self.get_job_status(job_id)
+        for callback in self._listeners:
+            try:
+                callback(job_id, job_info)
+            except Exception as e:
+                print(f"[{job_id}] Listener error: {e}")
+        
+        # Finished jobs only live in the store from now on
+        if live_info.get('status') in TERMINAL_STATUSES and not live_info.get('worker'):
+            self.running_jobs.pop(job_id, None)
+            self._prune_store()
+    
+    def _prune_store(self):
+        """Drop old finished records from the job store, at most once an hour"""
+        if time.time() - self._last_prune < 3600:
+            return
+        self._last_prune = time.time()
+        try:
+            removed = self.job_store.prune(self.job_retention_hours)
+            if removed:
+                print(f"[jobs] Pruned {removed} old job records")
+        except Exception as e:
+            print(f"[jobs] Job store prune error: {e}")
+    
+    def _recover_jobs(self):
+        """Re-attach to or fail in-flight jobs left behind by a dead process"""
+        try:
+            records = self.job_store.find(status=self.recover_statuses)
+        except Exception as e:
+            print(f"[jobs] Job store recovery error: {e}")
+            return
+        
+        hostname = socket.gethostname()
+        for record in records:
+            owner = record.get('owner') or ''
+            owner_host, _, owner_pid = owner.partition(':')
+            
+            # Leave jobs of other live web workers alone
+            if owner_host != hostname:
+                continue
+            if owner_pid.isdigit() and int(owner_pid) != os.getpid() and psutil.pid_exists(int(owner_pid)):
+                continue
+            
+            job_id = record['job_id']
+            pid = record.get('pid')
+            
+            # Processes starting together race for the same orphans
+            if not self.job_store.claim(job_id, record.get('owner'), self.owner):
+                continue
+            record['owner'] = self.owner
+            
+            if record['status'] == 'running' and pid and self._is_nextflow_pid(pid):
+                record['recovered'] = True
+                self.running_jobs[job_id] = record
+                if self.launch_dirs is not None and record.get('launch_dir'):
+                    # Keep new runs out of the slot until the process exits
+                    record['launch_slot'] = self.launch_dirs.claim(
+                        record['launch_dir'], job_id, record.get('resumed_session'))
+                threading.Thread(target=self._watch_recovered, args=(job_id, pid), daemon=True).start()
+                print(f"[{job_id}] Re-attached to running Nextflow PID {pid}")
+            elif record['status'] == 'queued' and record.get('command_args') and not record.get('batch_id'):
+                record['recovered'] = True
+                self.running_jobs[job_id] = record
+                self.scheduler.submit(job_id, self._run_job, priority=record.get('priority', 0))
+                print(f"[{job_id}] Re-queued after restart")
+            else:
+                record['status'] = 'failed'
+                record['error'] = 'Job interrupted by application restart'
+                record['end_time'] = datetime.now().isoformat()
+                self.running_jobs[job_id] = record
+                print(f"[{job_id}] Marked failed after restart")
+            
+            self._notify(job_id)
+    
+    def _is_nextflow_pid(self, pid):
+        """Check that pid is still a live nextflow process"""
+        try:
+            return 'nextflow' in ' '.join(psutil.Process(pid).cmdline())
+        except (psutil.NoSuchProcess, psutil.AccessDenied):
+            return False
+    
+    def _watch_recovered(self, job_id, pid):
+        """Wait for a re-attached Nextflow process and collect its results"""
+        job_info = self.running_jobs[job_id]
+        try:
+            psutil.Process(pid).wait()
+        except psutil.NoSuchProcess:
+            pass
+        
+        # The exit code of a process we did not spawn is unavailable,
+        # so judge success by the published outputs
+        cancelled = job_info['status'] == 'cancelled'
+        if not cancelled:
+            job_info['end_time'] = datetime.now().isoformat()
+            if not (Path(job_info['results_dir']) / 'predictions').exists():
+                job_info['status'] = 'failed'
+                job_info['error'] = 'Re-attached process exited without results'
+            else:
+                stitch_error = self._stitch_tiles(job_id) if job_info.get('tiling') else None
+                if stitch_error:
+                    job_info['status'] = 'failed'
+                    job_info['error'] = stitch_error
+                else:
+                    job_info['status'] = 'completed'
+                    job_info['progress'] = 100
+                    job_info['results'] = self._parse_results(job_id)
+                    if self.cache is not None and job_info.get('cache_key'):
+                        self.cache.put(job_info['cache_key'], job_info)
+        
+        slot = job_info.pop('launch_slot', None)
+        if slot is not None:
+            self.launch_dirs.release(slot, job_info.get('run_name'))
+        if not cancelled:
+            self._notify(job_id)  # cancel_job already reported the cancellation
+    
+    def _resolve_model(self, job_id, model_name=None):
+        """Look up the requested (or default) model in the registry, returning (model, error)"""
+        model = self.models.get(model_name)
+        if model is None:
+            if model_name:
+                return None, f'Unknown model: {model_name}'
+            return None, 'Trained model not found in:\n' + '\n'.join(f'- {d}' for d in self.models.model_dirs)
+        
+        print(f"[{job_id}] Using model {model['id']} (sha256 {model['digest'][:12]}): {model['path']}")
+        return model, None
+    
+    def _model_fields(self, model):
+        """Job record fields identifying the model that produces a job's results"""
+        return {
+            'model_path': model['path'],
+            'model': {key: model[key] for key in ('id', 'name', 'version', 'digest')},
+            'model_digest': model['digest']
+        }
+    
+    def _create_cached_job(self, job_id, image_path, model, cached, **extra):
+        """Register a completed job backed by cached artifacts"""
+        now = datetime.now().isoformat()
+        job_info = {
+            'job_id': job_id,
+            'status': 'completed',
+            'command': None,
+            'start_time': now,
+            'end_time': now,
+            'image_path': str(image_path),
+            'results_dir': cached['results_dir'],
+            # Per-image outputs are named after the image the results were computed for
+            'result_stem': cached.get('result_stem') or Path(cached.get('image_path') or image_path).stem,
+            'process': None,
+            'progress': 100,
+            'pipeline_dir': str(self.pipeline_dir),
+            **self._model_fields(model),
+            'results': cached.get('results', {}),
+            'cached': True,
+            'cached_from': cached.get('job_id'),
+            **extra
+        }
+        print(f"[{job_id}] Cache hit, reusing results of job {cached.get('job_id')}")
+        self._register_job(job_info)
+        return job_info
+    
     def _monitor_process(self, job_id):
         """Monitor process execution in background thread"""
         
@@ -141,34 +652,71 @@ class NextflowPipelineManager:
         if not process:
             return
         
-        output_lines = []
+        job_info['log_path'] = self.logs.open(job_id)
+        tracker = NextflowProgressTracker(Path(job_info['results_dir']) / 'trace.txt')
+        tracker_lock = threading.Lock()
+        stop_polling = threading.Event()
+        task_times = []
+        parse_seconds = None
+        
+        def progress_changed():
+            if not task_times:
+                task_times.append(datetime.now())
+            self._update_progress(job_id, tracker)
+        
+        def poll_trace():
+            # trace.txt grows while the console is quiet (long tasks), so it
+            # is read on a timer rather than when output arrives
+            while not stop_polling.wait(TRACE_POLL_INTERVAL):
+                try:
+                    with tracker_lock:
+                        if tracker.poll_trace():
+                            progress_changed()
+                except Exception as e:
+                    print(f"[{job_id}] Trace poll error: {e}")
+        
+        trace_thread = threading.Thread(target=poll_trace, daemon=True)
+        trace_thread.start()
         
         try:
-            # Read output line by line
+            # Read output line by line until EOF; file I/O happens on the log writer thread
             for line in iter(process.stdout.readline, ''):
-                if line:
-                    output_lines.append(line.strip())
-                    print(f"[{job_id}] {line.strip()}")
-                    
-                    # Update progress based on output
-                    progress = self._parse_progress_from_output(line)
-                    if progress > job_info.get('progress', 0):
-                        job_info['progress'] = progress
+                line = line.rstrip()
+                self.logs.append(job_id, line)
                 
-                # Check if process finished
-                if process.poll() is not None:
-                    break
+                # Console task counts; new trace rows come from the poll thread
+                with tracker_lock:
+                    if tracker.feed_line(line):
+                        progress_changed()
             
             # Process finished
+            stop_polling.set()
+            trace_thread.join()
             return_code = process.wait()
             job_info['return_code'] = return_code
             job_info['end_time'] = datetime.now().isoformat()
-            job_info['stdout'] = '\n'.join(output_lines)
+            job_info['log_tail'] = self.logs.tail(job_id, 20)
+            tracker.poll_trace()
+            job_info['tasks'] = tracker.summary()
             
-            if return_code == 0:
-                job_info['status'] = 'completed'
-                job_info['results'] = self._parse_results(job_id)
-                print(f"[{job_id}] Job completed successfully")
+            if job_info['status'] == 'cancelled':
+                print(f"[{job_id}] Job cancelled")
+            elif return_code == 0:
+                parse_start = time.monotonic()
+                stitch_error = self._stitch_tiles(job_id) if job_info.get('tiling') else None
+                if stitch_error:
+                    job_info['status'] = 'failed'
+                    job_info['error'] = stitch_error
+                else:
+                    job_info['status'] = 'completed'
+                    job_info['progress'] = 100
+                    job_info['results'] = self._parse_results(job_id)
+                    if job_info.get('child_jobs'):
+                        self._split_batch_results(job_id)
+                    if not job_info.get('child_jobs') and self.cache is not None and job_info.get('cache_key'):
+                        self.cache.put(job_info['cache_key'], job_info)
+                    print(f"[{job_id}] Job completed successfully")
+                parse_seconds = time.monotonic() - parse_start
             else:
                 job_info['status'] = 'failed'
                 job_info['error'] = f"Process exited with code {return_code}"
@@ -179,41 +727,275 @@ class NextflowPipelineManager:
             job_info['error'] = f"Monitoring error: {str(e)}"
             job_info['end_time'] = datetime.now().isoformat()
             print(f"[{job_id}] Monitoring error: {e}")
+        
+        self.logs.close(job_id)
+        
+        stage_timings = {'result_parsing': parse_seconds}
+        if task_times:
+            stage_timings['startup'] = (task_times[0] - datetime.fromisoformat(job_info['start_time'])).total_seconds()
+        job_info['metrics'] = self._build_metrics(
+            job_id,
+            stage_timings,
+            task_metrics=tracker.summary()['task_metrics'],
+            report_path=Path(job_info['results_dir']) / 'report.html'
+        )
+        self._notify(job_id)
+    
+    def _sync_batch_children(self, batch_id):
+        """Copy run-level state from a batch onto its per-image jobs"""
+        batch_info = self.running_jobs[batch_id]
+        for child_id in batch_info['child_jobs']:
+            child = self.running_jobs.get(child_id)
+            if child is None:
+                continue
+            for key in ('status', 'progress', 'start_time', 'end_time', 'error', 'return_code', 'pid'):
+                if key in batch_info:
+                    child[key] = batch_info[key]
+    
+    def _split_batch_results(self, batch_id):
+        """Assign per-image outputs of a finished batch to its job records"""
+        batch_info = self.running_jobs[batch_id]
+        results_dir = Path(batch_info['results_dir'])
+        predictions_dir = results_dir / 'predictions'
+        
+        # Object counts per input image from the combined results file
+        counts = {}
+        results_file = predictions_dir / 'test_results.txt'
+        if results_file.exists():
+            current_image = None
+            with open(results_file, 'r') as f:
+                for line in f:
+                    if 'Input image:' in line:
+                        current_image = os.path.basename(line.split(':', 1)[1].strip())
+                    elif current_image and ('Objects detected:' in line or 'Detected objects:' in line):
+                        try:
+                            counts[current_image] = int(line.split(':')[1].strip())
+                        except (ValueError, IndexError):
+                            counts[current_image] = 0
+        
+        prediction_files = list(predictions_dir.glob('prediction_*.png')) if predictions_dir.exists() else []
+        
+        for child_id in batch_info['child_jobs']:
+            child = self.running_jobs.get(child_id)
+            if child is None:
+                continue
+            
+            staged_name = child['staged_name']
+            stem = child['result_stem']
+            child_results_file = predictions_dir / f'test_results_{stem}.txt'
+            if not child_results_file.exists():
+                child_results_file = results_file
+            
+            child['results'] = {
+                'prediction_images': [str(f.relative_to(results_dir.parent))
+                                      for f in prediction_files if stem in f.name],
+                'results_file': str(child_results_file) if child_results_file.exists() else None,
+                'detected_objects': counts.get(staged_name, 0),
+                'processing_time': batch_info['results'].get('processing_time')
+            }
+            spot_table = self._write_spot_table(child_id, child, results_dir, stem, results_dir / 'input' / staged_name)
+            if spot_table is not None:
+                child['results']['spot_table'] = spot_table
+                child['results']['detected_objects'] = spot_table['spots']
+            if self.cache is not None and child.get('cache_key'):
+                self.cache.put(child['cache_key'], dict(child, status='completed'))
+    
+    def _stitch_tiles(self, job_id):
+        """Merge the tile outputs of a tiled run; returns an error message on failure"""
+        job_info = self.running_jobs[job_id]
+        if self.tiler is None:
+            return 'Tiled run finished but tiling is disabled'
+        try:
+            summary = self.tiler.stitch(
+                job_info['results_dir'],
+                job_info['tiling'],
+                job_info['image_path'],
+                job_info['result_stem'],
+                job_info.get('score_threshold', 0.8),
+                job_info.get('mask_threshold', 0.8)
+            )
+        except Exception as e:
+            print(f"[{job_id}] Tile stitching failed: {e}")
+            return f"Tile stitching failed: {e}"
+        
+        print(f"[{job_id}] Stitched {summary['tiles']} tiles: {summary['detected_objects']} objects")
+        return None
     
-    def _parse_progress_from_output(self, line):
-        """Parse progress from Nextflow output"""
-        progress = 0
+    def _build_metrics(self, job_id, stage_timings, task_metrics=None, report_path=None):
+        """Collect stage timings, process-tree resources and trace/report metrics"""
+        job_info = self.running_jobs[job_id]
         
-        if 'executor' in line.lower():
-            progress = 10
-        elif 'process' in line.lower() and 'running' in line.lower():
-            progress = 30
-        elif 'process' in line.lower() and 'completed' in line.lower():
-            progress = 80
-        elif 'workflow completed' in line.lower():
-            progress = 100
+        def seconds_between(start_key, end_key):
+            if not job_info.get(start_key) or not job_info.get(end_key):
+                return None
+            start = datetime.fromisoformat(job_info[start_key])
+            end = datetime.fromisoformat(job_info[end_key])
+            return (end - start).total_seconds()
         
-        return progress
+        timings = {
+            'upload': job_info.get('upload_seconds'),
+            'prepare': job_info.get('prepare_seconds'),
+            'queue_wait': seconds_between('submit_time', 'start_time'),
+            'pipeline': seconds_between('start_time', 'end_time'),
+        }
+        timings.update(stage_timings)
+        total = seconds_between('submit_time', 'end_time')
+        if total is not None:
+            timings['total'] = total + (job_info.get('upload_seconds') or 0) + (job_info.get('prepare_seconds') or 0)
+        
+        metrics = {
+            'timings': {k: round(v, 3) for k, v in timings.items() if v is not None},
+            'resources': self.profiler.stop_job(job_id) or {},
+            'tasks': summarize_tasks(task_metrics or [])
+        }
+        if report_path is not None and Path(report_path).exists():
+            metrics['report'] = parse_report(report_path)
+        return metrics
+    
+    def get_metrics_summary(self, limit=500):
+        """Percentiles of stage timings and resources over recent completed jobs"""
+        records = self.job_store.find(status='completed', limit=limit)
+        records = [r for r in records if r.get('metrics') and not r.get('cached')]
+        return {
+            'jobs': len(records),
+            'metrics': aggregate_metrics(records)
+        }
+    
+    def _update_progress(self, job_id, tracker):
+        """Publish task counts and progress from a trace tracker"""
+        job_info = self.running_jobs[job_id]
+        job_info['tasks'] = tracker.summary()
+        job_info['progress'] = max(job_info.get('progress', 0), tracker.progress())
+        self._notify(job_id)
     
     def get_job_status(self, job_id):
         """Get current status of a job"""
         
-        if job_id not in self.running_jobs:
-            return {'status': 'not_found'}
-        
-        job_info = self.running_jobs[job_id]
+        job_info = self.running_jobs.get(job_id)
+        if job_info is None:
+            record = self.job_store.get(job_id)
+            if record is None:
+                return {'status': 'not_found'}
+            record.pop('command_args', None)
+            return record
         
         # Return a JSON-serializable copy
-        return self._make_json_serializable(job_info)
+        status = self._make_json_serializable(job_info)
+        if status['status'] == 'queued':
+            status['queue_position'] = self.scheduler.queue_position(job_id)
+        return status
     
+    def get_job_log(self, job_id, offset=None, limit=64 * 1024, tail=None):
+        """Read a page of a job's log starting at a byte offset, or its last lines"""
+        if tail is not None:
+            return {'job_id': job_id, 'lines': self.logs.tail(job_id, tail)}
+        
+        page = self.logs.read(job_id, offset or 0, limit)
+        if page is None:
+            return None
+        page['job_id'] = job_id
+        return page
+    
+    def list_jobs(self, status=None, batch_id=None, limit=None):
+        """List job records from the job store"""
+        records = self.job_store.find(status=status, batch_id=batch_id, limit=limit)
+        for record in records:
+            record.pop('command_args', None)
+        return records
+    
+    def get_active_artifacts(self):
+        """Paths used by unfinished jobs, and the earliest submit time among them"""
+        records = [self._make_json_serializable(j) for j in list(self.running_jobs.values())
+                   if j.get('status') in ACTIVE_STATUSES]
+        try:
+            # Jobs owned by other processes sharing the store
+            records += self.job_store.find(status=ACTIVE_STATUSES)
+        except Exception as e:
+            print(f"[jobs] Job store error: {e}")
+
+        paths = set()
+        since = None
+        for record in records:
+            prepared = record.get('input') or {}
+            paths.update(p for p in (record.get('results_dir'), record.get('image_path'),
+                                     prepared.get('path'), prepared.get('thumbnail')) if p)
+            submitted = record.get('submit_time') or record.get('start_time')
+            if submitted:
+                submitted = datetime.fromisoformat(submitted).timestamp()
+                since = submitted if since is None else min(since, submitted)
+        return {'paths': paths, 'since': since}
+
+    def get_completed_results_dir(self, job_id):
+        """Results directory of a completed job whose artifacts still exist, without copying its record"""
+        job_info = self.running_jobs.get(job_id)
+        if job_info is None:
+            job_info = self.job_store.get(job_id)
+        if job_info is None or job_info.get('status') != 'completed' or job_info.get('artifacts_purged'):
+            return None
+        return job_info.get('results_dir')
+
+    def mark_artifacts_purged(self, job_id):
+        """Flag a finished job (and a batch's images) whose results were deleted"""
+        records = [self.job_store.get(job_id)] + self.job_store.find(batch_id=job_id)
+        for record in records:
+            if record is None or record.get('status') not in TERMINAL_STATUSES:
+                continue
+            record['artifacts_purged'] = datetime.now().isoformat()
+            self.job_store.save(record)
+
+    def spot_table_sources(self, job_ids=None):
+        """Completed single-image jobs whose spot tables can be rebuilt from stored detections"""
+        if job_ids is None:
+            records = self.job_store.find(status='completed')
+        else:
+            records = [self.get_job_status(job_id) for job_id in job_ids]
+
+        sources, seen = [], set()
+        for record in records:
+            if (record.get('status') != 'completed' or record.get('child_jobs')
+                    or record.get('artifacts_purged') or not record.get('results_dir')):
+                continue
+            results_dir = record['results_dir']
+            stem = record.get('result_stem') or Path(record['image_path']).stem
+            # Cache hits share the results of the job they were served from
+            if (results_dir, stem) in seen:
+                continue
+            if not (Path(results_dir) / 'predictions' / f'detections_{stem}.npz').exists():
+                continue
+            image_path = record['image_path']
+            if record.get('staged_name') and not os.path.exists(image_path):
+                image_path = str(Path(results_dir) / 'input' / record['staged_name'])
+            seen.add((results_dir, stem))
+            sources.append({
+                'job_id': record['job_id'],
+                'results_dir': results_dir,
+                'stem': stem,
+                'image_path': image_path,
+                'score_threshold': record.get('score_threshold', 0.8),
+                'mask_threshold': record.get('mask_threshold', 0.8),
+                'tiling': record.get('tiling')
+            })
+        return sources
+
+    def update_spot_tables(self, summaries):
+        """Store rebuilt spot table summaries {job_id: summary} on the finished job records"""
+        for job_id, summary in summaries.items():
+            record = self.job_store.get(job_id)
+            if record is None or record.get('status') != 'completed':
+                continue
+            results = record.setdefault('results', {})
+            results['spot_table'] = summary
+            results['detected_objects'] = summary['spots']
+            self.job_store.save(record)
+
     def _make_json_serializable(self, job_info):
         """Create a JSON-serializable copy of job_info"""
         
         serializable_info = {}
         
         for key, value in job_info.items():
-            if key == 'process':
-                continue  # Skip the Popen process object
+            if key in ('process', 'command_args', 'worker', 'launch_slot'):
+                continue  # Skip process/worker handles and raw argv
             elif isinstance(value, (str, int, float, bool, list, dict)) or value is None:
                 serializable_info[key] = value
             else:
@@ -235,18 +1017,26 @@ class NextflowPipelineManager:
         }
         
         try:
-            # Find prediction images
             predictions_dir = results_dir / 'predictions'
+            stem = job_info.get('result_stem')
             if predictions_dir.exists():
-                prediction_files = list(predictions_dir.glob('prediction_*.png'))
+                overlay = predictions_dir / f'prediction_{stem}.png'
+                prediction_files = [overlay] if stem and overlay.exists() else list(predictions_dir.glob('prediction_*.png'))
                 results['prediction_images'] = [str(f.relative_to(results_dir.parent)) for f in prediction_files]
                 
-                # Parse results file
                 results_file = predictions_dir / 'test_results.txt'
                 if results_file.exists():
                     results['results_file'] = str(results_file)
-                    
-                    # Extract detected objects count
+                
+                # Per-spot table from the raw detections; the text summary
+                # is only scraped for pipelines that do not store them
+                spot_table = None
+                if stem and not job_info.get('child_jobs'):
+                    spot_table = self._write_spot_table(job_id, job_info, results_dir, stem, job_info['image_path'])
+                if spot_table is not None:
+                    results['spot_table'] = spot_table
+                    results['detected_objects'] = spot_table['spots']
+                elif results_file.exists():
                     with open(results_file, 'r') as f:
                         content = f.read()
                         for line in content.split('\n'):
@@ -272,6 +1062,22 @@ class NextflowPipelineManager:
         
         return results
     
+    def _write_spot_table(self, job_id, job_info, results_dir, stem, image_path):
+        """Build the structured spot table of one image; None if unavailable"""
+        if self.spot_tables is None:
+            return None
+        try:
+            return self.spot_tables.write(
+                results_dir, stem, image_path,
+                job_info.get('score_threshold', 0.8), job_info.get('mask_threshold', 0.8),
+                tiling=job_info.get('tiling')
+            )
+        except FileNotFoundError:
+            return None  # Pipeline run without --save_detections
+        except Exception as e:
+            print(f"[{job_id}] Spot table error: {e}")
+            return None
+    
     def cancel_job(self, job_id):
         """Cancel a running job"""
         
@@ -280,17 +1086,30 @@ class NextflowPipelineManager:
         
         job_info = self.running_jobs[job_id]
         
+        # Images of a batch share one run, so cancel the whole batch; images
+        # that already finished (or came from the cache) leave the batch alone
+        if job_info.get('batch_id') and job_info['batch_id'] in self.running_jobs:
+            if job_info['status'] not in ACTIVE_STATUSES:
+                return False
+            return self.cancel_job(job_info['batch_id'])
+        
+        if job_info['status'] == 'preparing':
+            job_info['status'] = 'cancelled'
+            job_info['end_time'] = datetime.now().isoformat()
+            self._notify(job_id)
+            return True
+        
+        if job_info['status'] == 'queued' and self.scheduler.remove(job_id):
+            job_info['status'] = 'cancelled'
+            job_info['end_time'] = datetime.now().isoformat()
+            self._notify(job_id)
+            return True
+        
         if job_info['status'] == 'running' and job_info.get('process'):
             try:
                 process = job_info['process']
                 if process and process.poll() is None:
-                    try:
-                        parent = psutil.Process(process.pid)
-                        for child in parent.children(recursive=True):
-                            child.kill()
-                        parent.kill()
-                    except psutil.NoSuchProcess:
-                        pass
+                    self._kill_process_tree(process.pid)
                 
                 job_info['status'] = 'cancelled'
                 job_info['end_time'] = datetime.now().isoformat()
@@ -301,22 +1120,56 @@ class NextflowPipelineManager:
                 job_info['status'] = 'failed'
                 return False
         
+        # Re-attached after a restart: only the recorded pid is known, and
+        # it may have been reused since, so check it is still Nextflow
+        if job_info['status'] == 'running' and job_info.get('recovered') and job_info.get('pid'):
+            pid = job_info['pid']
+            job_info['status'] = 'cancelled'
+            job_info['end_time'] = datetime.now().isoformat()
+            if self._is_nextflow_pid(pid):
+                self._kill_process_tree(pid)
+            self._notify(job_id)
+            return True
+        
         return False
     
+    def _kill_process_tree(self, pid):
+        """Kill a process and all of its descendants"""
+        try:
+            parent = psutil.Process(pid)
+            for child in parent.children(recursive=True):
+                child.kill()
+            parent.kill()
+        except psutil.NoSuchProcess:
+            pass
+    
+    def _sample_resources(self):
+        """Read host CPU and memory usage"""
+        return {
+            'cpu_percent': psutil.cpu_percent(),
+            'memory_percent': psutil.virtual_memory().percent
+        }
+    
     def get_system_status(self):
         """Get system resource usage"""
         try:
-            return {
-                'cpu_percent': psutil.cpu_percent(),
-                'memory_percent': psutil.virtual_memory().percent,
+            status = self._sample_resources()
+            scheduler_stats = self.scheduler.get_stats()
+            status.update({
                 'disk_usage': psutil.disk_usage('/').percent,
-                'active_jobs': len([j for j in self.running_jobs.values() if j['status'] == 'running'])
-            }
+                'active_jobs': scheduler_stats['active'],
+                'queued_jobs': scheduler_stats['queued'],
+                'max_concurrent_runs': scheduler_stats['max_concurrent']
+            })
+            if self.launch_dirs is not None:
+                status['launch_dirs'] = self.launch_dirs.get_stats()
+            return status
         except Exception as e:
             return {
                 'cpu_percent': 0,
                 'memory_percent': 0,
                 'disk_usage': 0,
                 'active_jobs': 0,
+                'queued_jobs': 0,
                 'error': str(e)
             }
\ No newline at end of file
@@ -0,0 +1,172 @@
+import re
+import json
+import math
+import threading
+
+import psutil
+
+REPORT_DATA_RE = re.compile(r'window\.data\s*=\s*(\{.*?\});?\s*</script>', re.DOTALL)
+
+
+class ProcessTreeSampler:
+    """Accumulates CPU time, peak RSS and I/O of a process and its descendants.
+
+    The first reading is the baseline: a long-lived process (a warm worker
+    serving many jobs) has counters that include earlier work, so only
+    what was used since then is reported.
+    """
+
+    def __init__(self, pid):
+        self.pid = pid
+        self._per_process = {}
+        self._baseline = None
+        self.peak_rss = 0
+        self.samples = 0
+
+    def sample(self):
+        """Take one reading of the whole process tree"""
+        try:
+            root = psutil.Process(self.pid)
+            processes = [root] + root.children(recursive=True)
+        except psutil.NoSuchProcess:
+            return False
+
+        rss = 0
+        for proc in processes:
+            try:
+                with proc.oneshot():
+                    cpu = proc.cpu_times()
+                    rss += proc.memory_info().rss
+                    try:
+                        io = proc.io_counters()
+                        read_bytes, write_bytes = io.read_bytes, io.write_bytes
+                    except (psutil.AccessDenied, AttributeError):
+                        read_bytes = write_bytes = 0
+            except (psutil.NoSuchProcess, psutil.AccessDenied):
+                continue
+
+            # Counters are cumulative per process, so keep the latest value per pid;
+            # exited children keep their last reading
+            self._per_process[proc.pid] = (cpu.user + cpu.system, read_bytes, write_bytes)
+
+        if self._baseline is None:
+            self._baseline = dict(self._per_process)
+        self.peak_rss = max(self.peak_rss, rss)
+        self.samples += 1
+        return True
+
+    def totals(self):
+        baseline = self._baseline or {}
+        values = [
+            [max(0, value - start) for value, start in zip(reading, baseline.get(pid, (0, 0, 0)))]
+            for pid, reading in self._per_process.items()
+        ]
+        return {
+            'cpu_seconds': round(sum(v[0] for v in values), 3),
+            'peak_rss': self.peak_rss,
+            'read_bytes': sum(v[1] for v in values),
+            'write_bytes': sum(v[2] for v in values),
+            'samples': self.samples
+        }
+
+
+class JobProfiler:
+    """Samples the process trees of all running jobs from a single thread"""
+
+    def __init__(self, interval=2.0):
+        self.interval = interval
+        self._samplers = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+
+        self._thread = threading.Thread(target=self._sample_loop, daemon=True)
+        self._thread.start()
+
+    def start_job(self, job_id, pid):
+        sampler = ProcessTreeSampler(pid)
+        sampler.sample()
+        with self._lock:
+            self._samplers[job_id] = sampler
+
+    def stop_job(self, job_id):
+        """Stop sampling a job and return its resource totals"""
+        with self._lock:
+            sampler = self._samplers.pop(job_id, None)
+        return sampler.totals() if sampler is not None else None
+
+    def current(self, job_id):
+        with self._lock:
+            sampler = self._samplers.get(job_id)
+        return sampler.totals() if sampler is not None else None
+
+    def _sample_loop(self):
+        while True:
+            self._wakeup.wait(self.interval)
+            with self._lock:
+                samplers = list(self._samplers.values())
+            for sampler in samplers:
+                sampler.sample()
+
+
+def parse_report(report_path):
+    """Extract per-process summary statistics from a Nextflow report.html"""
+    try:
+        with open(report_path, 'r', encoding='utf-8', errors='replace') as f:
+            match = REPORT_DATA_RE.search(f.read())
+        if not match:
+            return None
+        data = json.loads(match.group(1))
+    except (OSError, ValueError):
+        return None
+
+    summary = data.get('summary') or []
+    processes = {}
+    for entry in summary:
+        name = entry.get('process')
+        if not name:
+            continue
+        processes[name] = {
+            key: entry.get(key)
+            for key in ('cpu', 'mem', 'time', 'reads', 'writes', 'cpuUsage', 'memUsage', 'timeUsage')
+            if entry.get(key) is not None
+        }
+    return processes
+
+
+def summarize_tasks(task_metrics):
+    """Aggregate per-task trace metrics for a job"""
+    realtimes = [t['realtime'] for t in task_metrics if t.get('realtime') is not None]
+    peaks = [t['peak_rss'] for t in task_metrics if t.get('peak_rss') is not None]
+    return {
+        'task_count': len(task_metrics),
+        'task_realtime_seconds': round(sum(realtimes), 3) if realtimes else None,
+        'task_peak_rss': max(peaks) if peaks else None
+    }
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return None
+    rank = max(1, math.ceil(pct / 100.0 * len(sorted_values)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def aggregate_metrics(records, percentiles=(50, 90, 99)):
+    """Percentiles of stage timings and resource usage across job records"""
+    series = {}
+    for record in records:
+        metrics = record.get('metrics') or {}
+        for group in ('timings', 'resources', 'tasks'):
+            for key, value in (metrics.get(group) or {}).items():
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    series.setdefault(f'{group}.{key}', []).append(value)
+
+    result = {}
+    for name, values in sorted(series.items()):
+        values.sort()
+        entry = {'count': len(values), 'mean': sum(values) / len(values), 'max': values[-1]}
+        for pct in percentiles:
+            entry[f'p{pct}'] = percentile(values, pct)
+        result[name] = entry
+    return result
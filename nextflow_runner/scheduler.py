@@ -0,0 +1,116 @@
+import heapq
+import itertools
+import threading
+
+
+class JobScheduler:
+    """Bounded priority scheduler for pipeline runs.
+
+    Jobs wait in a priority queue (higher priority first, FIFO within a
+    priority) and are started on their own worker thread once a slot is
+    free and the host has enough headroom according to ``resource_probe``.
+    """
+
+    def __init__(self, max_concurrent=2, max_memory_percent=85.0, max_cpu_percent=95.0,
+                 resource_probe=None, poll_interval=2.0):
+        self.max_concurrent = max(1, int(max_concurrent))
+        self.max_memory_percent = max_memory_percent
+        self.max_cpu_percent = max_cpu_percent
+        self.resource_probe = resource_probe
+        self.poll_interval = poll_interval
+
+        self._queue = []
+        self._queued = {}
+        self._active = set()
+        self._counter = itertools.count()
+        self._condition = threading.Condition()
+
+        self._dispatcher = threading.Thread(target=self._dispatch_loop, daemon=True)
+        self._dispatcher.start()
+
+    def submit(self, job_id, run_fn, priority=0):
+        """Queue run_fn(job_id) for execution"""
+        with self._condition:
+            entry = [-priority, next(self._counter), job_id, run_fn]
+            self._queued[job_id] = entry
+            heapq.heappush(self._queue, entry)
+            self._condition.notify_all()
+
+    def remove(self, job_id):
+        """Remove a job that has not started yet"""
+        with self._condition:
+            entry = self._queued.pop(job_id, None)
+            if entry is None:
+                return False
+            # Lazy deletion: mark the heap entry as dead
+            entry[2] = None
+            return True
+
+    def queue_position(self, job_id):
+        """Return the 1-based queue position of a waiting job, or None"""
+        with self._condition:
+            entry = self._queued.get(job_id)
+            if entry is None:
+                return None
+            key = (entry[0], entry[1])
+            return 1 + sum(1 for other in self._queued.values() if (other[0], other[1]) < key)
+
+    def get_stats(self):
+        """Return queue depth and active slot usage"""
+        with self._condition:
+            return {
+                'queued': len(self._queued),
+                'active': len(self._active),
+                'max_concurrent': self.max_concurrent
+            }
+
+    def _has_headroom(self):
+        """Admission control based on current host CPU/memory readings"""
+        if not self._active or self.resource_probe is None:
+            return True
+        try:
+            readings = self.resource_probe()
+        except Exception:
+            return True
+        return readings.get('memory_percent', 0) < self.max_memory_percent and \
+            readings.get('cpu_percent', 0) < self.max_cpu_percent
+
+    def _next_entry(self):
+        """Pop the highest priority live entry, or None if the queue is empty"""
+        while self._queue:
+            entry = heapq.heappop(self._queue)
+            if entry[2] is not None:
+                return entry
+        return None
+
+    def _dispatch_loop(self):
+        """Start queued jobs whenever a slot and enough resources are available"""
+        while True:
+            with self._condition:
+                while not self._queued or len(self._active) >= self.max_concurrent:
+                    self._condition.wait()
+
+                if not self._has_headroom():
+                    self._condition.wait(self.poll_interval)
+                    continue
+
+                entry = self._next_entry()
+                if entry is None:
+                    continue
+                _, _, job_id, run_fn = entry
+                del self._queued[job_id]
+                self._active.add(job_id)
+
+            worker = threading.Thread(target=self._run_worker, args=(job_id, run_fn), daemon=True)
+            worker.start()
+
+    def _run_worker(self, job_id, run_fn):
+        """Run a job on its worker thread and release the slot when done"""
+        try:
+            run_fn(job_id)
+        except Exception as e:
+            print(f"[{job_id}] Scheduler worker error: {e}")
+        finally:
+            with self._condition:
+                self._active.discard(job_id)
+                self._condition.notify_all()
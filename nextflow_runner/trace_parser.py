@@ -0,0 +1,183 @@
+import os
+import re
+
+from utils.result_parser import PROCESS_NAME_RE, TASK_COUNT_RE
+
+# Console lines such as "[e3/5a1b2c] process > TEST_MODEL (1) [100%] 1 of 1 ✔"
+CONSOLE_PROGRESS_RE = re.compile(PROCESS_NAME_RE.pattern + r'.*?' + TASK_COUNT_RE.pattern)
+SUBMITTED_RE = re.compile(r'Submitted ' + PROCESS_NAME_RE.pattern)
+
+DURATION_RE = re.compile(r'([\d.]+)\s*(ms|s|m|h|d)')
+DURATION_UNITS = {'ms': 0.001, 's': 1, 'm': 60, 'h': 3600, 'd': 86400}
+SIZE_UNITS = {'B': 1, 'KB': 1024, 'MB': 1024 ** 2, 'GB': 1024 ** 3, 'TB': 1024 ** 4}
+
+DONE_STATUSES = ('COMPLETED', 'CACHED')
+FAILED_STATUSES = ('FAILED', 'ABORTED')
+
+
+def parse_duration(value):
+    """Convert a Nextflow duration such as '1m 2s' or '350ms' to seconds"""
+    if not value or value == '-':
+        return None
+    matches = DURATION_RE.findall(value)
+    if not matches:
+        return None
+    return sum(float(amount) * DURATION_UNITS[unit] for amount, unit in matches)
+
+
+def parse_size(value):
+    """Convert a Nextflow memory value such as '123.4 MB' to bytes"""
+    if not value or value == '-':
+        return None
+    parts = value.split()
+    try:
+        if len(parts) == 2:
+            return int(float(parts[0]) * SIZE_UNITS.get(parts[1].upper(), 1))
+        return int(float(parts[0]))
+    except ValueError:
+        return None
+
+
+def parse_percent(value):
+    if not value or value == '-':
+        return None
+    try:
+        return float(value.rstrip('%'))
+    except ValueError:
+        return None
+
+
+def parse_trace_record(columns, fields):
+    """Turn one tab-separated trace row into a typed task record"""
+    row = dict(zip(columns, fields))
+    name = row.get('name', '')
+    return {
+        'task_id': row.get('task_id'),
+        'name': name,
+        'process': name.split(' (')[0],
+        'status': row.get('status'),
+        'exit': row.get('exit'),
+        'duration': parse_duration(row.get('duration')),
+        'realtime': parse_duration(row.get('realtime')),
+        'cpu_percent': parse_percent(row.get('%cpu')),
+        'peak_rss': parse_size(row.get('peak_rss')),
+        'peak_vmem': parse_size(row.get('peak_vmem')),
+        'rchar': parse_size(row.get('rchar')),
+        'wchar': parse_size(row.get('wchar'))
+    }
+
+
+class NextflowProgressTracker:
+    """Incrementally tracks task progress from console output and trace.txt.
+
+    The trace file gets one row per finished task, so it is the source of
+    per-task metrics and completion counts; console progress lines supply
+    the expected number of tasks per process.
+    """
+
+    def __init__(self, trace_path):
+        self.trace_path = str(trace_path)
+        self._offset = 0
+        self._partial = ''
+        self._columns = None
+        self.tasks = {}
+        self.expected = {}
+        self.submitted = {}
+
+    def feed_line(self, line):
+        """Parse one console line; returns True if the counts changed"""
+        if 'process >' not in line:
+            return False
+
+        match = CONSOLE_PROGRESS_RE.search(line)
+        if match:
+            name, total = match.group(1), int(match.group(3))
+            if self.expected.get(name) != total:
+                self.expected[name] = total
+                return True
+            return False
+
+        match = SUBMITTED_RE.search(line)
+        if match:
+            name = match.group(1)
+            self.submitted[name] = self.submitted.get(name, 0) + 1
+            return True
+        return False
+
+    def poll_trace(self):
+        """Read rows appended to the trace file since the last call"""
+        try:
+            if os.path.getsize(self.trace_path) <= self._offset:
+                return False
+            with open(self.trace_path, 'r', encoding='utf-8', errors='replace') as f:
+                f.seek(self._offset)
+                data = f.read()
+                self._offset = f.tell()
+        except OSError:
+            return False
+
+        data = self._partial + data
+        lines = data.split('\n')
+        self._partial = lines.pop()  # incomplete last line, if any
+
+        changed = False
+        for line in lines:
+            if not line:
+                continue
+            fields = line.split('\t')
+            if self._columns is None:
+                self._columns = fields
+                continue
+            record = parse_trace_record(self._columns, fields)
+            self.tasks[record['task_id'] or record['name']] = record
+            changed = True
+        return changed
+
+    def process_status(self):
+        """Per-process task counts and state"""
+        processes = {}
+        for name in set(self.expected) | set(self.submitted):
+            processes[name] = {'completed': 0, 'failed': 0,
+                               'total': max(self.expected.get(name, 0), self.submitted.get(name, 0))}
+        for task in self.tasks.values():
+            entry = processes.setdefault(task['process'], {'completed': 0, 'failed': 0, 'total': 0})
+            if task['status'] in DONE_STATUSES:
+                entry['completed'] += 1
+            elif task['status'] in FAILED_STATUSES:
+                entry['failed'] += 1
+
+        for entry in processes.values():
+            entry['total'] = max(entry['total'], entry['completed'] + entry['failed'])
+            if entry['failed']:
+                entry['status'] = 'failed'
+            elif entry['total'] and entry['completed'] >= entry['total']:
+                entry['status'] = 'completed'
+            else:
+                entry['status'] = 'running'
+        return processes
+
+    def summary(self):
+        """Task counts, per-process status and per-task metrics"""
+        processes = self.process_status()
+        completed = sum(p['completed'] for p in processes.values())
+        failed = sum(p['failed'] for p in processes.values())
+        total = sum(p['total'] for p in processes.values())
+        return {
+            'completed': completed,
+            'failed': failed,
+            'total': total,
+            'processes': processes,
+            'task_metrics': [
+                {key: task[key] for key in ('name', 'status', 'realtime', 'cpu_percent', 'peak_rss')}
+                for task in self.tasks.values()
+            ]
+        }
+
+    def progress(self):
+        """Percent of known tasks finished; 100 is reserved for workflow completion"""
+        processes = self.process_status()
+        total = sum(p['total'] for p in processes.values())
+        if not total:
+            return 0
+        done = sum(p['completed'] + p['failed'] for p in processes.values())
+        return min(99, int(done * 100 / total))
@@ -0,0 +1,313 @@
+import os
+import time
+import queue
+import threading
+import multiprocessing
+from pathlib import Path
+from datetime import datetime
+
+from .pipeline_manager import NextflowPipelineManager
+
+
+def _worker_main(conn, model_path, num_classes, num_threads):
+    """Entry point of the worker process: load the model once, then serve requests"""
+    try:
+        import torch
+        from torchvision.models.detection import maskrcnn_resnet50_fpn
+
+        torch.set_num_threads(num_threads)
+        model = maskrcnn_resnet50_fpn(weights=None, weights_backbone=None, num_classes=num_classes)
+        state = torch.load(model_path, map_location='cpu')
+        if isinstance(state, dict) and 'model_state_dict' in state:
+            state = state['model_state_dict']
+        model.load_state_dict(state)
+        model.eval()
+    except Exception as e:
+        conn.send({'status': 'failed', 'error': f'Model load failed: {e}'})
+        return
+
+    conn.send({'status': 'ready'})
+
+    while True:
+        try:
+            request = conn.recv()
+        except EOFError:
+            break
+        if request is None:
+            break
+
+        try:
+            conn.send(_predict(model, request))
+        except Exception as e:
+            conn.send({'status': 'failed', 'error': str(e)})
+
+
+def _predict(model, request):
+    """Run one image through the model and write pipeline-compatible outputs"""
+    import torch
+    from PIL import Image
+    from torchvision.transforms.functional import to_tensor
+    from utils.detections import DetectionSet, detections_path, save_detections
+
+    start = time.time()
+    image_path = request['image_path']
+    image = Image.open(image_path).convert('RGB')
+
+    with torch.no_grad():
+        output = model([to_tensor(image)])[0]
+
+    # Same layout the Nextflow pipeline publishes under --outdir; raw
+    # detections are kept so the job can be re-thresholded later
+    stem = Path(image_path).stem
+    raw_path = save_detections(
+        detections_path(request['output_dir'], stem),
+        output['scores'].numpy(),
+        output['boxes'].numpy(),
+        output['labels'].numpy(),
+        output['masks'][:, 0].numpy(),
+        min_score=model.roi_heads.score_thresh
+    )
+
+    detections = DetectionSet.load(raw_path)
+    detected = detections.apply(request['score_threshold'], request['mask_threshold'])['detected_objects']
+    overlay = detections.render_overlay(image, request['score_threshold'], request['mask_threshold'])
+    predictions_dir = Path(request['output_dir']) / 'predictions'
+    overlay.save(predictions_dir / f'prediction_{stem}.png')
+
+    elapsed = time.time() - start
+    with open(predictions_dir / 'test_results.txt', 'w') as f:
+        f.write(f"Input image: {image_path}\n")
+        f.write(f"Detected objects: {detected}\n")
+        f.write(f"Processing time: {elapsed:.2f}s\n")
+
+    return {'status': 'completed', 'detected_objects': detected, 'elapsed': elapsed}
+
+
+class WarmWorker:
+    """Long-lived CPU inference process with the model loaded once"""
+
+    def __init__(self, model_path, num_classes=2, num_threads=None, startup_timeout=300, model_digest=None):
+        self.model_path = model_path
+        self.model_digest = model_digest
+        self.num_classes = num_classes
+        self.num_threads = num_threads or max(1, (os.cpu_count() or 2) // 2)
+        self.startup_timeout = startup_timeout
+        self.process = None
+        self.conn = None
+
+    def start(self):
+        """Spawn the worker process and wait until the model is loaded"""
+        # spawn re-imports the parent's main module in the child, so app.py
+        # and worker.py only build their services under __main__
+        ctx = multiprocessing.get_context('spawn')
+        self.conn, child_conn = ctx.Pipe()
+        self.process = ctx.Process(
+            target=_worker_main,
+            args=(child_conn, self.model_path, self.num_classes, self.num_threads),
+            daemon=True
+        )
+        self.process.start()
+        child_conn.close()
+
+        if not self.conn.poll(self.startup_timeout):
+            self.kill()
+            raise RuntimeError('Warm worker did not become ready in time')
+
+        reply = self.conn.recv()
+        if reply.get('status') != 'ready':
+            self.kill()
+            raise RuntimeError(reply.get('error', 'Warm worker failed to start'))
+
+    def is_alive(self):
+        return self.process is not None and self.process.is_alive()
+
+    def predict(self, request):
+        """Send a request to the worker and block until it replies"""
+        try:
+            self.conn.send(request)
+            return self.conn.recv()
+        except (EOFError, OSError, AttributeError):
+            return {'status': 'failed', 'error': 'Warm worker exited'}
+
+    def stop(self):
+        """Ask the worker to exit cleanly"""
+        if self.is_alive():
+            try:
+                self.conn.send(None)
+            except OSError:
+                pass
+            self.process.join(timeout=5)
+        self.kill()
+
+    def kill(self):
+        """Terminate the worker process immediately"""
+        if self.process is not None and self.process.is_alive():
+            self.process.kill()
+            self.process.join()
+        if self.conn is not None:
+            self.conn.close()
+        self.process = None
+        self.conn = None
+
+
+class WarmWorkerPipelineManager(NextflowPipelineManager):
+    """Pipeline manager that runs single images on warm inference workers.
+
+    Scheduling, caching and job records are shared with
+    NextflowPipelineManager; only the execution of single-image jobs
+    changes. Batch runs, and single images whenever no worker can be
+    started, fall back to Nextflow.
+    """
+
+    def __init__(self, *args, num_workers=1, worker_threads=None, **kwargs):
+        # Set up the pool first: the base class may resubmit recovered jobs
+        self.num_workers = max(1, int(num_workers))
+        self.worker_threads = worker_threads
+        self._idle_workers = queue.Queue()
+        self._worker_count = 0
+        self._worker_lock = threading.Lock()
+        self._worker_error = None
+        super().__init__(*args, **kwargs)
+
+    def _acquire_worker(self, model_path, num_classes, model_digest=None):
+        """Take an idle worker for model_path, starting one if below the limit.
+
+        Workers are matched on the model digest too, so a model file
+        replaced in place is reloaded rather than served from stale weights.
+        """
+        with self._worker_lock:
+            if self._idle_workers.empty() and self._worker_count < self.num_workers:
+                worker = WarmWorker(model_path, num_classes, self.worker_threads, model_digest=model_digest)
+                self._worker_count += 1
+                try:
+                    worker.start()
+                except Exception as e:
+                    self._worker_count -= 1
+                    self._worker_error = str(e)
+                    print(f"[warm] Worker start failed, falling back to Nextflow: {e}")
+                    return None
+                return worker
+
+        worker = self._idle_workers.get()
+        if (worker.model_path != model_path or worker.model_digest != model_digest
+                or worker.num_classes != num_classes or not worker.is_alive()):
+            worker.stop()
+            worker = WarmWorker(model_path, num_classes, self.worker_threads, model_digest=model_digest)
+            try:
+                worker.start()
+            except Exception as e:
+                with self._worker_lock:
+                    self._worker_count -= 1
+                self._worker_error = str(e)
+                return None
+        return worker
+
+    def _release_worker(self, worker):
+        """Return a worker to the idle pool, dropping it if it died"""
+        if worker.is_alive():
+            self._idle_workers.put(worker)
+        else:
+            worker.kill()
+            with self._worker_lock:
+                self._worker_count -= 1
+
+    def _run_job(self, job_id):
+        """Run a single-image job on a warm worker, or fall back to Nextflow"""
+
+        job_info = self.running_jobs.get(job_id)
+        if job_info is None or job_info['status'] != 'queued':
+            return
+
+        if job_info.get('child_jobs'):
+            return super()._run_job(job_id)
+
+        worker = self._acquire_worker(job_info['model_path'], job_info.get('num_classes', 2),
+                                      job_info.get('model_digest'))
+        if worker is None:
+            job_info['backend'] = 'nextflow'
+            return super()._run_job(job_id)
+
+        job_info['backend'] = 'warm'
+        job_info['worker'] = worker
+        job_info['start_time'] = datetime.now().isoformat()
+        job_info['status'] = 'running'
+        job_info['pid'] = worker.process.pid
+        job_info['progress'] = 10
+        self.profiler.start_job(job_id, worker.process.pid)
+        self._notify(job_id)
+
+        # Tiled scans run tile by tile on the same worker, then get stitched
+        if job_info.get('tiling'):
+            tiles_dir = Path(job_info['results_dir']) / 'tiles' / 'input'
+            images = [str(tiles_dir / f"{tile['stem']}.png") for tile in job_info['tiling']['tiles']]
+        else:
+            images = [os.path.abspath(job_info['image_path'])]
+
+        inference_seconds = 0.0
+        try:
+            for index, image_path in enumerate(images):
+                reply = worker.predict({
+                    'image_path': image_path,
+                    'output_dir': job_info['results_dir'],
+                    'score_threshold': job_info.get('score_threshold', 0.8),
+                    'mask_threshold': job_info.get('mask_threshold', 0.8)
+                })
+                inference_seconds += reply.get('elapsed') or 0.0
+                if reply.get('status') != 'completed' or job_info['status'] == 'cancelled':
+                    break
+                if len(images) > 1:
+                    job_info['progress'] = 10 + int(85 * (index + 1) / len(images))
+                    self._notify(job_id)
+        finally:
+            job_info.pop('worker', None)
+            self._release_worker(worker)
+
+        if reply.get('status') == 'completed' and job_info.get('tiling') and job_info['status'] != 'cancelled':
+            stitch_error = self._stitch_tiles(job_id)
+            if stitch_error:
+                reply = {'status': 'failed', 'error': stitch_error}
+
+        job_info['end_time'] = datetime.now().isoformat()
+        job_info['metrics'] = self._build_metrics(job_id, {'inference': inference_seconds})
+
+        if job_info['status'] == 'cancelled':
+            print(f"[{job_id}] Job cancelled")
+        elif reply.get('status') == 'completed':
+            job_info['status'] = 'completed'
+            job_info['progress'] = 100
+            job_info['results'] = self._parse_results(job_id)
+            if self.cache is not None and job_info.get('cache_key'):
+                self.cache.put(job_info['cache_key'], job_info)
+            print(f"[{job_id}] Job completed on warm worker")
+        else:
+            job_info['status'] = 'failed'
+            job_info['error'] = reply.get('error', 'Warm worker failed')
+            print(f"[{job_id}] Warm worker error: {job_info['error']}")
+
+        self._notify(job_id)
+
+    def cancel_job(self, job_id):
+        """Cancel a job, killing its warm worker if it is mid-inference"""
+
+        job_info = self.running_jobs.get(job_id)
+        if job_info is not None and job_info.get('worker') is not None:
+            job_info['status'] = 'cancelled'
+            job_info['end_time'] = datetime.now().isoformat()
+            job_info['worker'].kill()
+            return True
+
+        return super().cancel_job(job_id)
+
+    def get_system_status(self):
+        """Get system resource usage including warm worker state"""
+        status = super().get_system_status()
+        status['backend'] = 'warm'
+        status['warm_workers'] = self._worker_count
+        if self._worker_error:
+            status['warm_worker_error'] = self._worker_error
+        return status
+
+    def shutdown(self):
+        """Stop all idle warm workers"""
+        while not self._idle_workers.empty():
+            self._idle_workers.get().stop()
@@ -0,0 +1,315 @@
+import time
+import socket
+import threading
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+
+import psutil
+
+from .pipeline_manager import NextflowPipelineManager, ACTIVE_STATUSES, TERMINAL_STATUSES
+
+SYNC_INTERVAL = 1.0
+HEARTBEAT_INTERVAL = 5.0
+
+
+class RemoteScheduler:
+    """Stands in for JobScheduler on the web app: jobs go to the broker instead of local threads"""
+
+    def __init__(self, broker):
+        self.broker = broker
+        self.remote_jobs = set()
+        self._unsent = {}
+        self._lock = threading.Lock()
+
+    def submit(self, job_id, run_fn, priority=0):
+        # Held back until flush(): workers read the job from the store, so
+        # the record must be saved before any worker can receive it
+        with self._lock:
+            self.remote_jobs.add(job_id)
+            self._unsent[job_id] = priority
+
+    def flush(self, job_id):
+        """Send a submitted job to the broker once its record is in the store"""
+        with self._lock:
+            if job_id not in self._unsent:
+                return
+            priority = self._unsent.pop(job_id)
+        self.broker.enqueue(job_id, priority)
+
+    def remove(self, job_id):
+        return self.broker.remove(job_id)
+
+    def queue_position(self, job_id):
+        return self.broker.queue_position(job_id)
+
+    def get_stats(self):
+        workers = self.broker.workers()
+        return {
+            'active': sum(w.get('active', 0) for w in workers),
+            'queued': self.broker.queued_count(),
+            'max_concurrent': sum(w.get('concurrency', 0) for w in workers)
+        }
+
+
+class DistributedPipelineManager(NextflowPipelineManager):
+    """Web-side pipeline manager that hands execution to the worker tier.
+
+    Jobs are prepared, cached and recorded exactly as by
+    NextflowPipelineManager, then queued on a broker instead of being
+    run in this process. Workers (worker.py) run them and write state
+    and progress to the shared job store; a sync thread here follows the
+    store and forwards changes to the usual listeners (SocketIO, metrics).
+    """
+
+    def __init__(self, *args, broker=None, sync_interval=SYNC_INTERVAL, **kwargs):
+        self.broker = broker
+        self.sync_interval = sync_interval
+        self._seen = {}
+        self._followed = set()
+        super().__init__(*args, **kwargs)
+        self.scheduler = RemoteScheduler(broker)
+
+        self._sync_thread = threading.Thread(target=self._sync_loop, daemon=True)
+        self._sync_thread.start()
+
+    def _notify(self, job_id):
+        super()._notify(job_id)
+        if isinstance(self.scheduler, RemoteScheduler):
+            self.scheduler.flush(job_id)
+
+    def _recover_jobs(self):
+        """Follow unfinished jobs again; running them is up to the workers"""
+        try:
+            records = self.job_store.find(status=('queued', 'starting', 'running'))
+        except Exception as e:
+            print(f"[jobs] Job store recovery error: {e}")
+            return
+        for record in records:
+            self.running_jobs[record['job_id']] = record
+        self._followed = {record['job_id'] for record in records}
+
+    def _remote_ids(self):
+        """Jobs handed to workers, the images of a batch before the batch itself"""
+        with self.scheduler._lock:
+            self.scheduler.remote_jobs.update(self._followed)
+            self._followed = set()
+            remote = list(self.scheduler.remote_jobs)
+        children = [child_id for job_id in remote
+                    for child_id in (self.running_jobs.get(job_id) or {}).get('child_jobs', [])]
+        return children + remote
+
+    def _sync_loop(self):
+        while True:
+            time.sleep(self.sync_interval)
+            try:
+                self._sync()
+            except Exception as e:
+                print(f"[workers] Sync error: {e}")
+
+    def _sync(self):
+        """Copy job records updated by workers into running_jobs and notify listeners"""
+        for job_id in self._remote_ids():
+            record = self.job_store.get(job_id)
+            if record is None:
+                continue
+            record.pop('command_args', None)
+            record.pop('updated', None)
+            if record == self._seen.get(job_id):
+                continue
+            self._seen[job_id] = record
+            if job_id in self.running_jobs:
+                self.running_jobs[job_id] = record
+
+            job_info = self.get_job_status(job_id)
+            for callback in self._listeners:
+                try:
+                    callback(job_id, job_info)
+                except Exception as e:
+                    print(f"[{job_id}] Listener error: {e}")
+
+            if record.get('status') in TERMINAL_STATUSES:
+                self.running_jobs.pop(job_id, None)
+                self._seen.pop(job_id, None)
+                with self.scheduler._lock:
+                    self.scheduler.remote_jobs.discard(job_id)
+
+    def cancel_job(self, job_id):
+        """Cancel a job, asking its worker to stop it once it left the queue"""
+        if super().cancel_job(job_id):
+            return True
+        job_info = self.running_jobs.get(job_id)
+        if job_info is None or job_info['status'] not in ACTIVE_STATUSES:
+            return False
+        self.broker.revoke(job_id)
+        print(f"[{job_id}] Cancellation sent to worker")
+        return True
+
+    def get_system_status(self):
+        status = super().get_system_status()
+        status['workers'] = self.broker.workers()
+        status['broker'] = self.broker.describe()
+        return status
+
+
+class JobWorker:
+    """Runs jobs delivered by a broker on a local pipeline manager.
+
+    The manager (Nextflow or warm backend) executes each job exactly as
+    it would in the web app and persists state to the shared job store.
+    concurrency bounds the jobs running at once; prefetch is how many
+    more this worker may claim ahead so it never idles between jobs.
+    Prefetched jobs stay 'queued' and can still be cancelled.
+    """
+
+    def __init__(self, manager, broker, concurrency=2, prefetch=1, poll_interval=1.0):
+        self.manager = manager
+        self.broker = broker
+        self.worker_id = manager.owner
+        self.concurrency = max(1, int(concurrency))
+        self.prefetch = max(0, int(prefetch))
+        self.poll_interval = poll_interval
+        self._active = set()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._last_heartbeat = 0
+
+    def _owner_alive(self, owner):
+        """Whether the worker that owns a job record still runs"""
+        if not owner:
+            return False
+        if owner in {w['worker_id'] for w in self.broker.workers()}:
+            return True
+        host, _, pid = owner.partition(':')
+        return host == socket.gethostname() and pid.isdigit() and psutil.pid_exists(int(pid))
+
+    def _take_over(self, record):
+        """Reset a redelivered job whose worker died mid-run so it runs again here"""
+        job_id, owner = record['job_id'], record.get('owner')
+        if owner == self.worker_id or self._owner_alive(owner):
+            return record
+        # Only one of several workers receiving it may reset it
+        if not self.manager.job_store.claim(job_id, owner, self.worker_id):
+            return record
+        print(f"[{job_id}] Worker {owner} died while running it; running it again")
+        for key in ('pid', 'start_time', 'error', 'return_code'):
+            record.pop(key, None)
+        record.update(status='queued', progress=0, owner=self.worker_id, redelivered=True)
+        return record
+
+    def _adopt(self, job_id):
+        """Load a delivered job (and a batch's images) from the store; False to skip it"""
+        record = self.manager.job_store.get(job_id)
+        if record is not None and record.get('status') in ('starting', 'running'):
+            record = self._take_over(record)
+        if record is None or record.get('status') != 'queued':
+            print(f"[{job_id}] Skipping delivered job in state {record.get('status') if record else 'missing'}")
+            return False
+
+        for child in self.manager.job_store.find(batch_id=job_id):
+            self.manager.running_jobs[child['job_id']] = child
+        record['worker_node'] = self.worker_id
+        self.manager.running_jobs[job_id] = record
+
+        if self.broker.is_revoked(job_id):
+            record['status'] = 'cancelled'
+            record['end_time'] = datetime.now().isoformat()
+            self.manager._notify(job_id)
+            return False
+        self.manager._notify(job_id)
+        return True
+
+    def execute(self, job_id):
+        """Run one delivered job to completion on the calling thread"""
+        if not self.broker.begin(job_id, self.worker_id):
+            return
+        with self._lock:
+            self._active.add(job_id)
+        try:
+            if self._adopt(job_id):
+                print(f"[{job_id}] Running on worker {self.worker_id}")
+                self.manager._run_job(job_id)
+        except Exception as e:
+            print(f"[{job_id}] Worker error: {e}")
+            job_info = self.manager.running_jobs.get(job_id)
+            if job_info is not None and job_info.get('status') not in TERMINAL_STATUSES:
+                job_info['status'] = 'failed'
+                job_info['error'] = f'Worker error: {e}'
+                job_info['end_time'] = datetime.now().isoformat()
+                self.manager._notify(job_id)
+        finally:
+            with self._lock:
+                self._active.discard(job_id)
+            self.broker.ack(job_id)
+
+    def _check_revoked(self):
+        """Cancel local jobs the web app asked to stop"""
+        with self._lock:
+            active = list(self._active)
+        for job_id in active:
+            job_info = self.manager.running_jobs.get(job_id)
+            if job_info is not None and job_info['status'] in ACTIVE_STATUSES and self.broker.is_revoked(job_id):
+                print(f"[{job_id}] Cancelled by request")
+                self.manager.cancel_job(job_id)
+
+    def _heartbeat(self, force=False):
+        if not force and time.time() - self._last_heartbeat < HEARTBEAT_INTERVAL:
+            return
+        self._last_heartbeat = time.time()
+        with self._lock:
+            active = len(self._active)
+        self.broker.heartbeat(self.worker_id, {
+            'concurrency': self.concurrency,
+            'prefetch': self.prefetch,
+            'active': active
+        })
+
+    def _housekeeping_loop(self):
+        """Heartbeats and revocation checks for brokers that deliver on their own threads"""
+        while not self._stop.wait(self.poll_interval):
+            try:
+                self._heartbeat()
+                self._check_revoked()
+            except Exception as e:
+                print(f"[workers] Housekeeping error: {e}")
+
+    def start_housekeeping(self):
+        self._heartbeat(force=True)
+        threading.Thread(target=self._housekeeping_loop, daemon=True).start()
+
+    def run_forever(self):
+        """Claim and run jobs from a polling broker until stop() is called"""
+        print(f"[workers] Worker {self.worker_id} started "
+              f"(concurrency {self.concurrency}, prefetch {self.prefetch})")
+        self.start_housekeeping()
+        self._requeue_stale()
+
+        executor = ThreadPoolExecutor(max_workers=self.concurrency)
+        inflight = set()
+        last_requeue = time.time()
+        try:
+            while not self._stop.is_set():
+                inflight = {future for future in inflight if not future.done()}
+                # Extra submissions wait in the executor's queue: that is the prefetch
+                while len(inflight) < self.concurrency + self.prefetch:
+                    job_id = self.broker.claim(self.worker_id)
+                    if job_id is None:
+                        break
+                    inflight.add(executor.submit(self.execute, job_id))
+                if time.time() - last_requeue > HEARTBEAT_INTERVAL * 6:
+                    last_requeue = time.time()
+                    self._requeue_stale()
+                self._stop.wait(self.poll_interval)
+        finally:
+            executor.shutdown(wait=True)
+
+    def _requeue_stale(self):
+        try:
+            requeued = self.broker.requeue_stale()
+        except Exception as e:
+            print(f"[workers] Requeue error: {e}")
+            return
+        if requeued:
+            print(f"[workers] Requeued {len(requeued)} jobs of dead workers")
+
+    def stop(self):
+        self._stop.set()
@@ -73,6 +73,14 @@ function updateJobProgress(data) {
         let icon = 'fa-spinner fa-spin';
         
         switch(data.status) {
+            case 'preparing':
+                badgeClass = 'bg-info';
+                icon = 'fa-cog fa-spin';
+                break;
+            case 'queued':
+                badgeClass = 'bg-secondary';
+                icon = 'fa-hourglass-half';
+                break;
             case 'completed':
                 badgeClass = 'bg-success';
                 icon = 'fa-check';
@@ -95,6 +103,11 @@ function updateJobProgress(data) {
         progressText.textContent = `${data.progress}% complete`;
     }
     
+    const queuePosition = document.getElementById('queuePosition');
+    if (queuePosition && data.queue_position) {
+        queuePosition.textContent = data.queue_position;
+    }
+    
     // Redirect to results if completed
     if (data.status === 'completed') {
         setTimeout(() => {
@@ -106,7 +119,7 @@ function updateJobProgress(data) {
 // File upload validation
 function validateFile(file) {
     const allowedTypes = ['image/png', 'image/jpeg', 'image/jpg', 'image/bmp', 'image/tiff'];
-    const maxSize = 16 * 1024 * 1024; // 16MB
+    const maxSize = 2 * 1024 * 1024 * 1024; // 2GB, via chunked uploads
     
     if (!allowedTypes.includes(file.type)) {
         showAlert('Please select a valid image file (PNG, JPG, JPEG, BMP, TIFF)', 'danger');
@@ -114,7 +127,7 @@ function validateFile(file) {
     }
     
     if (file.size > maxSize) {
-        showAlert('File size must be less than 16MB', 'danger');
+        showAlert('File size must be less than 2GB', 'danger');
         return false;
     }
     
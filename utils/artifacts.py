@@ -0,0 +1,182 @@
+import os
+import hashlib
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+from flask import send_file
+from PIL import Image
+
+Image.MAX_IMAGE_PIXELS = None
+
+DERIVATIVE_FORMATS = {
+    'webp': ('WEBP', 'image/webp'),
+    'png': ('PNG', 'image/png'),
+    'jpeg': ('JPEG', 'image/jpeg')
+}
+# Result files rewritten in place after a job completes (spot tables are
+# recomputed and upgraded), so they must be revalidated
+MUTABLE_PREFIXES = ('spots_',)
+
+
+def content_etag(path, chunk_size=1024 * 1024):
+    """Strong ETag of a file: a digest of its content"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()[:32]
+
+
+class ArtifactServer:
+    """Serves the immutable artifacts of completed jobs and their image derivatives.
+
+    A completed job's files never change, so responses carry strong
+    content ETags and a long-lived immutable Cache-Control; conditional
+    and Range requests are answered by Werkzeug (304 / 206). Files named
+    with a MUTABLE_PREFIXES prefix are sent no-cache instead, so clients
+    revalidate them by ETag on every use. Job
+    directories and ETags are remembered in small LRUs, so repeated
+    requests neither copy job records nor re-hash files.
+
+    Derivatives (downscaled previews, WebP) are generated once per source
+    ETag, size and format under derivative_dir/<job_id>/ and evicted
+    least-recently-used by the disk janitor.
+    """
+
+    def __init__(self, results_dir_fn, derivative_dir, sizes=(320, 640, 1280), max_age=365 * 24 * 3600,
+                 max_entries=4096, on_access=None):
+        self.results_dir_fn = results_dir_fn
+        self.derivative_dir = Path(derivative_dir)
+        self.derivative_dir.mkdir(parents=True, exist_ok=True)
+        self.sizes = tuple(sorted(int(size) for size in sizes))
+        self.max_age = max_age
+        self.max_entries = max_entries
+        self.on_access = on_access
+        self._job_dirs = OrderedDict()
+        self._etags = OrderedDict()
+        self._locks = {}
+        self._lock = threading.Lock()
+        self.derivatives_built = 0
+
+    def _remember(self, cache, key, value):
+        with self._lock:
+            cache[key] = value
+            cache.move_to_end(key)
+            while len(cache) > self.max_entries:
+                cache.popitem(last=False)
+
+    def forget(self, job_id):
+        """Drop what is known about a job whose results were deleted"""
+        with self._lock:
+            self._job_dirs.pop(job_id, None)
+
+    def resolve(self, job_id, filename):
+        """Path of a completed job's prediction file, or None"""
+        with self._lock:
+            results_dir = self._job_dirs.get(job_id)
+            if results_dir is not None:
+                self._job_dirs.move_to_end(job_id)
+        if results_dir is None:
+            results_dir = self.results_dir_fn(job_id)
+            if results_dir is None:
+                return None
+            self._remember(self._job_dirs, job_id, results_dir)
+
+        predictions = Path(results_dir) / 'predictions'
+        file_path = predictions / filename
+        if file_path.parent != predictions or not file_path.is_file():
+            return None
+        return file_path
+
+    def etag(self, path):
+        """Content ETag of path, hashed once per size and mtime"""
+        stat = os.stat(path)
+        key = (str(path), stat.st_size, stat.st_mtime_ns)
+        with self._lock:
+            etag = self._etags.get(key)
+            if etag is not None:
+                self._etags.move_to_end(key)
+                return etag
+        etag = content_etag(path)
+        self._remember(self._etags, key, etag)
+        return etag
+
+    def send(self, path, etag=None, mimetype=None, as_attachment=False, download_name=None, immutable=None):
+        """Conditional, Range-capable response for a result file.
+
+        immutable defaults to whether the file name marks it as never rewritten.
+        """
+        if immutable is None:
+            immutable = not Path(path).name.startswith(MUTABLE_PREFIXES)
+        if self.on_access is not None:
+            self.on_access(path)
+        response = send_file(
+            os.path.abspath(path),
+            mimetype=mimetype,
+            as_attachment=as_attachment,
+            download_name=download_name,
+            conditional=True,
+            etag=etag or self.etag(path),
+            max_age=self.max_age if immutable else None
+        )
+        response.headers.setdefault('Accept-Ranges', 'bytes')
+        response.cache_control.public = True
+        if immutable:
+            response.cache_control.immutable = True
+        else:
+            response.cache_control.no_cache = True
+        return response
+
+    def derivative_size(self, size):
+        """Smallest configured size covering the requested one (the largest if none does)"""
+        for candidate in self.sizes:
+            if candidate >= size:
+                return candidate
+        return self.sizes[-1]
+
+    def derivative(self, job_id, path, size, fmt='webp'):
+        """Path and ETag of a downscaled copy of an image, generated on first use"""
+        if fmt not in DERIVATIVE_FORMATS:
+            raise ValueError(f'Unsupported format: {fmt}')
+        size = self.derivative_size(size)
+        source_etag = self.etag(path)
+        etag = f'{source_etag}-{size}-{fmt}'
+        target = self.derivative_dir / job_id / f'{Path(path).stem}.{etag}.{fmt}'
+        if target.exists():
+            return target, etag
+
+        with self._lock:
+            lock = self._locks.setdefault(str(target), threading.Lock())
+        with lock:
+            # Another request may have built it while we waited
+            if not target.exists():
+                self._build(path, target, size, fmt)
+        with self._lock:
+            self._locks.pop(str(target), None)
+        return target, etag
+
+    def _build(self, source, target, size, fmt):
+        pil_format = DERIVATIVE_FORMATS[fmt][0]
+        target.parent.mkdir(parents=True, exist_ok=True)
+        with Image.open(source) as image:
+            image.draft('RGB', (size, size))
+            image.thumbnail((size, size))
+            if fmt == 'jpeg' or image.mode not in ('RGB', 'RGBA', 'L'):
+                image = image.convert('RGBA' if fmt != 'jpeg' and 'A' in image.getbands() else 'RGB')
+            tmp_path = target.with_name(target.name + f'.{os.getpid()}.{threading.get_ident()}.tmp')
+            if fmt == 'png':
+                image.save(tmp_path, format=pil_format, optimize=True)
+            else:
+                image.save(tmp_path, format=pil_format, quality=85)
+        os.replace(tmp_path, target)
+        self.derivatives_built += 1
+
+    def get_stats(self):
+        with self._lock:
+            return {
+                'sizes': list(self.sizes),
+                'known_jobs': len(self._job_dirs),
+                'known_etags': len(self._etags),
+                'derivatives_built': self.derivatives_built
+            }
@@ -0,0 +1,219 @@
+import os
+import json
+import time
+import uuid
+import hashlib
+import threading
+from pathlib import Path
+
+from utils.file_handler import HASH_CHUNK_SIZE
+
+
+class UploadError(Exception):
+    """Rejected chunked upload operation, carrying an HTTP status code"""
+
+    def __init__(self, message, status_code=400, offset=None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.offset = offset
+
+
+class ChunkedUploadManager:
+    """Resumable uploads streamed straight to disk.
+
+    Each session is a ``<id>.part`` file plus a small ``<id>.json`` state
+    file in a staging directory on the same filesystem as the upload
+    store. Chunks must arrive in order; the SHA-256 digest is updated as
+    bytes are written, so finalizing needs no second pass over the file
+    and ends in an atomic rename into the FileHandler store. A process
+    that has not seen every chunk (after a restart, or because another
+    web worker received some) rebuilds the digest of the received prefix.
+    """
+
+    def __init__(self, file_handler, staging_dir=None, max_upload_bytes=2 * 1024 ** 3,
+                 chunk_size=8 * 1024 * 1024, session_ttl_hours=24):
+        self.file_handler = file_handler
+        self.staging_dir = Path(staging_dir) if staging_dir else file_handler.upload_folder / '.chunked'
+        self.staging_dir.mkdir(parents=True, exist_ok=True)
+        self.max_upload_bytes = max_upload_bytes
+        self.chunk_size = chunk_size
+        self.session_ttl_hours = session_ttl_hours
+        self._hashers = {}
+        self._locks = {}
+        self._lock = threading.Lock()
+
+    def _state_path(self, upload_id):
+        return self.staging_dir / f'{upload_id}.json'
+
+    def _part_path(self, upload_id):
+        return self.staging_dir / f'{upload_id}.part'
+
+    def _session_lock(self, upload_id):
+        with self._lock:
+            return self._locks.setdefault(upload_id, threading.Lock())
+
+    def _load(self, upload_id):
+        try:
+            uuid.UUID(upload_id)
+            with open(self._state_path(upload_id), 'r') as f:
+                return json.load(f)
+        except (ValueError, OSError):
+            raise UploadError('Upload session not found', 404)
+
+    def _save(self, session):
+        path = self._state_path(session['upload_id'])
+        tmp_path = path.with_suffix('.json.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump(session, f)
+        os.replace(tmp_path, path)
+
+    def _public(self, session):
+        return {
+            'upload_id': session['upload_id'],
+            'filename': session['filename'],
+            'size': session['size'],
+            'offset': session['received'],
+            'chunk_size': self.chunk_size,
+            'complete': session['received'] == session['size']
+        }
+
+    def create(self, filename, size, sha256=None, params=None):
+        """Start an upload session for a file of known size"""
+        if size <= 0:
+            raise UploadError('Upload size must be positive')
+        if size > self.max_upload_bytes:
+            raise UploadError(f'File too large (max {self.max_upload_bytes} bytes)', 413)
+
+        upload_id = str(uuid.uuid4())
+        session = {
+            'upload_id': upload_id,
+            'filename': filename,
+            'size': size,
+            'received': 0,
+            'sha256': sha256.lower() if sha256 else None,
+            'params': params or {},
+            'created': time.time(),
+            'updated': time.time()
+        }
+        self._part_path(upload_id).touch()
+        self._hashers[upload_id] = (hashlib.sha256(), 0)
+        self._save(session)
+        return self._public(session)
+
+    def status(self, upload_id):
+        """Current offset of a session, for clients resuming an upload"""
+        return self._public(self._load(upload_id))
+
+    def _hasher(self, session):
+        """Digest of the bytes received so far.
+
+        The digest kept in memory is only used if it covers exactly the
+        received bytes; otherwise it is rebuilt from the .part file.
+        """
+        hasher, covered = self._hashers.get(session['upload_id'], (None, None))
+        if covered != session['received']:
+            hasher = hashlib.sha256()
+            remaining = session['received']
+            with open(self._part_path(session['upload_id']), 'rb') as f:
+                while remaining:
+                    chunk = f.read(min(HASH_CHUNK_SIZE, remaining))
+                    if not chunk:
+                        break
+                    hasher.update(chunk)
+                    remaining -= len(chunk)
+            self._hashers[session['upload_id']] = (hasher, session['received'])
+        return hasher
+
+    def append(self, upload_id, offset, stream, length=None):
+        """Stream one chunk from a readable binary stream at the given offset"""
+        with self._session_lock(upload_id):
+            session = self._load(upload_id)
+            if offset != session['received']:
+                raise UploadError('Chunk offset does not match received bytes', 409, session['received'])
+
+            remaining = session['size'] - offset
+            if length is not None and length > remaining:
+                raise UploadError('Chunk extends past the declared file size', 400, session['received'])
+
+            hasher = self._hasher(session)
+            written = 0
+            try:
+                with open(self._part_path(upload_id), 'r+b') as out:
+                    # Drop any bytes of an earlier interrupted chunk past the offset
+                    out.truncate(offset)
+                    out.seek(offset)
+                    while True:
+                        piece = stream.read(min(HASH_CHUNK_SIZE, remaining - written + 1))
+                        if not piece:
+                            break
+                        if written + len(piece) > remaining:
+                            raise UploadError('Chunk extends past the declared file size', 400, offset)
+                        out.write(piece)
+                        hasher.update(piece)
+                        written += len(piece)
+            except UploadError:
+                # Reject the whole chunk; the digest is rebuilt from the kept prefix
+                self._hashers.pop(upload_id, None)
+                written = 0
+                raise
+            finally:
+                # Bytes that did arrive before a disconnect count towards resuming
+                if written and session['received'] != offset + written:
+                    self._hashers[upload_id] = (hasher, offset + written)
+                    session['received'] = offset + written
+                    session['updated'] = time.time()
+                    self._save(session)
+
+            return self._public(session)
+
+    def finalize(self, upload_id):
+        """Verify a fully received upload and move it into the upload store.
+
+        Returns (session, file_path, content_hash, is_duplicate).
+        """
+        with self._session_lock(upload_id):
+            session = self._load(upload_id)
+            if session['received'] != session['size']:
+                raise UploadError('Upload is incomplete', 409, session['received'])
+
+            content_hash = self._hasher(session).hexdigest()
+            if session['sha256'] and session['sha256'] != content_hash:
+                self._discard(upload_id)
+                raise UploadError('Content hash mismatch; upload discarded', 422)
+
+            file_path, content_hash, is_duplicate = self.file_handler.store_path(
+                str(self._part_path(upload_id)), session['filename'], content_hash=content_hash
+            )
+            self._discard(upload_id)
+            return session, file_path, content_hash, is_duplicate
+
+    def abort(self, upload_id):
+        """Cancel a session and delete its partial data"""
+        with self._session_lock(upload_id):
+            self._load(upload_id)
+            self._discard(upload_id)
+
+    def _discard(self, upload_id):
+        for path in (self._part_path(upload_id), self._state_path(upload_id)):
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                pass
+        self._hashers.pop(upload_id, None)
+        with self._lock:
+            self._locks.pop(upload_id, None)
+
+    def cleanup_stale(self):
+        """Remove sessions that have not received data within the TTL"""
+        cutoff = time.time() - self.session_ttl_hours * 3600
+        removed = []
+        for state_path in self.staging_dir.glob('*.json'):
+            try:
+                with open(state_path, 'r') as f:
+                    session = json.load(f)
+            except (OSError, ValueError):
+                continue
+            if session.get('updated', 0) < cutoff:
+                self._discard(session['upload_id'])
+                removed.append(session['upload_id'])
+        return removed
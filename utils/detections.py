@@ -0,0 +1,281 @@
+import os
+import json
+import time
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+
+from utils.png_bands import save_png_bands, tile_bands
+
+# Soft mask probabilities are stored quantized to 0..255
+MASK_SCALE = 255
+
+
+def detections_path(results_dir, stem):
+    """Location of the raw detections of one input image"""
+    return Path(results_dir) / 'predictions' / f'detections_{stem}.npz'
+
+
+def save_detections(path, scores, boxes, labels, masks, min_score=0.0):
+    """Persist raw (unthresholded) detections in a compact array format.
+
+    masks is an (N, H, W) array of soft mask probabilities. Each mask is
+    cropped to the region where it is non-zero and quantized to uint8;
+    all crops are concatenated into one flat array with per-detection
+    offsets, so thresholding later is a single vectorized comparison.
+    """
+    masks = np.asarray(masks, dtype=np.float32)
+    count = len(scores)
+    height, width = masks.shape[-2:] if masks.ndim >= 2 else (0, 0)
+    masks = masks.reshape(count, height, width)
+
+    quantized = np.rint(np.clip(masks, 0.0, 1.0) * MASK_SCALE).astype(np.uint8)
+    rows_any = quantized.any(axis=2)
+    cols_any = quantized.any(axis=1)
+    has_pixels = rows_any.any(axis=1)
+
+    # Crop boxes (x0, y0, x1, y1) of the non-zero region of every mask
+    crop_boxes = np.zeros((count, 4), dtype=np.int32)
+    crop_boxes[:, 0] = cols_any.argmax(axis=1)
+    crop_boxes[:, 1] = rows_any.argmax(axis=1)
+    crop_boxes[:, 2] = width - cols_any[:, ::-1].argmax(axis=1)
+    crop_boxes[:, 3] = height - rows_any[:, ::-1].argmax(axis=1)
+    crop_boxes[~has_pixels] = 0
+
+    crops = [quantized[i, y0:y1, x0:x1] for i, (x0, y0, x1, y1) in enumerate(crop_boxes)]
+    return save_packed_detections(path, scores, boxes, labels, crop_boxes, crops, (height, width), min_score)
+
+
+def writer_tmp_path(path):
+    """Temporary sibling of path private to this process and thread"""
+    path = Path(path)
+    return path.with_name(path.name + f'.{os.getpid()}.{threading.get_ident()}.tmp')
+
+
+def save_packed_detections(path, scores, boxes, labels, mask_boxes, crops, image_size, min_score=0.0):
+    """Write detections whose masks are already cropped to mask_boxes.
+
+    crops holds one quantized uint8 array per detection, shaped like its
+    (x0, y0, x1, y1) mask box.
+    """
+    sizes = np.array([crop.size for crop in crops], dtype=np.int64)
+    offsets = np.concatenate([[0], np.cumsum(sizes)]).astype(np.int64)
+    mask_data = np.concatenate([crop.ravel() for crop in crops]) if crops else np.zeros(0, dtype=np.uint8)
+
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = writer_tmp_path(path)
+    with open(tmp_path, 'wb') as f:
+        np.savez_compressed(
+            f,
+            scores=np.asarray(scores, dtype=np.float32).reshape(-1),
+            boxes=np.asarray(boxes, dtype=np.float32).reshape(-1, 4),
+            labels=np.asarray(labels, dtype=np.int16).reshape(-1),
+            mask_boxes=np.asarray(mask_boxes, dtype=np.int32).reshape(-1, 4),
+            mask_offsets=offsets,
+            mask_data=mask_data.astype(np.uint8),
+            image_size=np.array(image_size, dtype=np.int32),
+            min_score=np.float32(min_score)
+        )
+    os.replace(tmp_path, path)
+    return str(path)
+
+
+class DetectionSet:
+    """Raw detections of one image, re-thresholdable with vectorized NumPy"""
+
+    def __init__(self, scores, boxes, labels, mask_boxes, mask_offsets, mask_data, image_size, min_score=0.0):
+        self.scores = scores
+        self.boxes = boxes
+        self.labels = labels
+        self.mask_boxes = mask_boxes
+        self.mask_offsets = mask_offsets
+        self.mask_data = mask_data
+        self.height, self.width = (int(v) for v in image_size)
+        self.min_score = float(min_score)
+        self._pixel_index = None
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls(**{key: data[key] for key in data.files})
+
+    def __len__(self):
+        return len(self.scores)
+
+    def crop(self, index):
+        """Quantized soft mask of one detection, shaped like its mask box"""
+        x0, y0, x1, y1 = (int(v) for v in self.mask_boxes[index])
+        start, end = self.mask_offsets[index], self.mask_offsets[index + 1]
+        return self.mask_data[start:end].reshape(max(y1 - y0, 0), max(x1 - x0, 0))
+
+    def _pixels(self):
+        """Detection index, row and column of every stored mask pixel"""
+        if self._pixel_index is None:
+            widths = (self.mask_boxes[:, 2] - self.mask_boxes[:, 0]).astype(np.int64)
+            sizes = np.diff(self.mask_offsets)
+            detection = np.repeat(np.arange(len(self), dtype=np.int32), sizes)
+            local = np.arange(len(self.mask_data), dtype=np.int64) - np.repeat(self.mask_offsets[:-1], sizes)
+            row_width = np.maximum(widths[detection], 1)
+            rows = self.mask_boxes[detection, 1] + local // row_width
+            cols = self.mask_boxes[detection, 0] + local % row_width
+            self._pixel_index = (detection, rows.astype(np.int32), cols.astype(np.int32))
+        return self._pixel_index
+
+    def _selected_pixels(self, keep, mask_threshold):
+        """Mask pixels above mask_threshold that belong to kept detections"""
+        detection, rows, cols = self._pixels()
+        selected = (self.mask_data > mask_threshold * MASK_SCALE) & keep[detection]
+        return detection[selected], rows[selected], cols[selected]
+
+    def apply(self, score_threshold, mask_threshold):
+        """Counts, boxes, scores and mask areas at the given thresholds"""
+        keep = self.scores >= score_threshold
+        detection, _, _ = self._selected_pixels(keep, mask_threshold)
+        areas = np.bincount(detection, minlength=len(self))
+        indices = np.flatnonzero(keep)
+        return {
+            'detected_objects': int(keep.sum()),
+            'indices': indices,
+            'scores': self.scores[indices],
+            'boxes': self.boxes[indices],
+            'labels': self.labels[indices],
+            'areas': areas[indices]
+        }
+
+    def label_image(self, score_threshold, mask_threshold):
+        """(H, W) map of the kept detection covering each pixel, -1 for background"""
+        labels = np.full((self.height, self.width), -1, dtype=np.int32)
+        detection, rows, cols = self._selected_pixels(self.scores >= score_threshold, mask_threshold)
+        labels[rows, cols] = detection
+        return labels
+
+    def render_overlay(self, image, score_threshold, mask_threshold):
+        """Blend one color per kept detection into image (a PIL image)"""
+        overlay = np.array(image.convert('RGB'), dtype=np.uint8)
+        if overlay.shape[:2] != (self.height, self.width):
+            raise ValueError(f'Detections are for a {self.width}x{self.height} image, got {image.width}x{image.height}')
+        for _ in self.overlay_bands([(0, overlay)], score_threshold, mask_threshold):
+            pass
+        return Image.fromarray(overlay)
+
+    def overlay_bands(self, bands, score_threshold, mask_threshold):
+        """Blend kept detections into (y0, RGB array) bands of the image, in place.
+
+        Yields each band once it is colored, so an overlay of any size can
+        be rendered and written one band at a time.
+        """
+        # Only covered pixels are touched, so large scans need no full-size
+        # float or label buffers. Colors depend only on the detection
+        # index, so they are stable across thresholds.
+        detection, rows, cols = self._selected_pixels(self.scores >= score_threshold, mask_threshold)
+        colors = np.random.default_rng(0).integers(64, 256, size=(max(len(self), 1), 3)).astype(np.uint16)
+        order = np.argsort(rows, kind='stable')
+        sorted_rows = rows[order]
+        for y0, band in bands:
+            start, end = np.searchsorted(sorted_rows, [y0, y0 + len(band)])
+            selected = order[start:end]
+            band_rows, band_cols = rows[selected] - y0, cols[selected]
+            band[band_rows, band_cols] = ((band[band_rows, band_cols] + colors[detection[selected]]) // 2).astype(np.uint8)
+            yield band
+
+
+class Rethresholder:
+    """Applies new thresholds to stored detections and caches every variant on disk.
+
+    Loaded detection sets are kept in a small LRU so repeated slider moves
+    on the same job only pay for the vectorized thresholding.
+    """
+
+    def __init__(self, max_loaded=32):
+        self.max_loaded = max_loaded
+        self._loaded = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _get_set(self, path):
+        mtime = os.path.getmtime(path)
+        with self._lock:
+            entry = self._loaded.get(path)
+            if entry is not None and entry[0] == mtime:
+                self._loaded.move_to_end(path)
+                return entry[1]
+
+        detections = DetectionSet.load(path)
+        with self._lock:
+            self._loaded[path] = (mtime, detections)
+            self._loaded.move_to_end(path)
+            while len(self._loaded) > self.max_loaded:
+                self._loaded.popitem(last=False)
+        return detections
+
+    def rethreshold(self, results_dir, stem, image_path, score_threshold, mask_threshold, tiling=None):
+        """Return counts and an overlay for one image at new thresholds.
+
+        Raises FileNotFoundError if the run stored no raw detections and
+        ValueError for thresholds the stored detections cannot answer.
+        For a tiled job (tiling is its tile plan) the overlay is drawn
+        from the tiles instead of decoding the whole scan.
+        """
+        start = time.perf_counter()
+        if not (0.0 <= score_threshold <= 1.0 and 0.0 <= mask_threshold <= 1.0):
+            raise ValueError('Thresholds must be between 0 and 1')
+
+        path = detections_path(results_dir, stem)
+        if not path.exists():
+            raise FileNotFoundError(f'No raw detections stored for {stem}')
+
+        predictions_dir = path.parent
+        variant = f'rethreshold_{stem}_s{score_threshold:.3f}_m{mask_threshold:.3f}'
+        summary_path = predictions_dir / f'{variant}.json'
+        overlay_path = predictions_dir / f'{variant}.png'
+
+        if summary_path.exists() and overlay_path.exists():
+            try:
+                with open(summary_path, 'r') as f:
+                    summary = json.load(f)
+                summary['cached'] = True
+                summary['elapsed_ms'] = round((time.perf_counter() - start) * 1000, 2)
+                return summary
+            except (OSError, ValueError):
+                pass  # Rebuild a damaged variant below
+
+        detections = self._get_set(str(path))
+        if score_threshold < detections.min_score:
+            raise ValueError(f'Detections were only stored down to score {detections.min_score:.3f}')
+
+        result = detections.apply(score_threshold, mask_threshold)
+        tmp_path = writer_tmp_path(overlay_path)
+        tiles_dir = Path(results_dir) / 'tiles' / 'input'
+        if tiling and tiles_dir.is_dir():
+            # Tiled scans are rendered band by band from their tiles
+            bands = tile_bands(tiling['tiles'], tiles_dir, detections.width)
+            save_png_bands(tmp_path, detections.width, detections.height,
+                           detections.overlay_bands(bands, score_threshold, mask_threshold))
+        else:
+            with Image.open(image_path) as image:
+                overlay = detections.render_overlay(image, score_threshold, mask_threshold)
+            overlay.save(tmp_path, format='PNG', compress_level=1)
+        os.replace(tmp_path, overlay_path)
+
+        summary = {
+            'score_threshold': score_threshold,
+            'mask_threshold': mask_threshold,
+            'detected_objects': result['detected_objects'],
+            'overlay': overlay_path.name,
+            'detections': [
+                {'score': round(float(score), 4), 'box': [round(float(v), 1) for v in box],
+                 'label': int(label), 'area': int(area)}
+                for score, box, label, area in zip(result['scores'], result['boxes'], result['labels'], result['areas'])
+            ]
+        }
+        tmp_path = writer_tmp_path(summary_path)
+        with open(tmp_path, 'w') as f:
+            json.dump(summary, f)
+        os.replace(tmp_path, summary_path)
+
+        summary['cached'] = False
+        summary['elapsed_ms'] = round((time.perf_counter() - start) * 1000, 2)
+        return summary
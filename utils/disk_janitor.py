@@ -0,0 +1,351 @@
+import os
+import json
+import time
+import multiprocessing
+import shutil
+import threading
+from pathlib import Path
+from datetime import datetime
+
+
+def tree_size(path):
+    """Apparent size in bytes of a file or directory tree, without following symlinks"""
+    try:
+        stat = os.lstat(path)
+    except OSError:
+        return 0
+    if not os.path.isdir(path) or os.path.islink(path):
+        return stat.st_size
+
+    total = 0
+    stack = [str(path)]
+    while stack:
+        try:
+            with os.scandir(stack.pop()) as entries:
+                for entry in entries:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            stack.append(entry.path)
+                        else:
+                            total += entry.stat(follow_symlinks=False).st_size
+                    except OSError:
+                        continue
+        except OSError:
+            continue
+    return total
+
+
+def _signature(path):
+    """Newest mtime of an entry and its immediate subdirectories, in ns.
+
+    Files written anywhere directly below the entry or one of its first-level
+    subdirectories (e.g. predictions/) change it, so unchanged entries are not
+    walked again.
+    """
+    newest = os.lstat(path).st_mtime_ns
+    if os.path.isdir(path) and not os.path.islink(path):
+        with os.scandir(path) as entries:
+            for entry in entries:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        newest = max(newest, entry.stat(follow_symlinks=False).st_mtime_ns)
+                except OSError:
+                    continue
+    return newest
+
+
+class DiskArea:
+    """A directory whose entries matching pattern are accounted and evicted as units"""
+
+    def __init__(self, name, root, pattern='*', max_bytes=None, max_age_hours=None, on_remove=None,
+                 keep_during_runs=False):
+        self.name = name
+        self.root = Path(os.path.abspath(root))
+        self.pattern = pattern
+        self.depth = len(pattern.split('/'))
+        self.max_bytes = max_bytes
+        self.max_age_hours = max_age_hours
+        self.on_remove = on_remove
+        self.keep_during_runs = keep_during_runs
+        self.removed = 0
+        self.freed_bytes = 0
+
+    def entry_key(self, path):
+        """Key of the entry containing path, or None if path is outside the area"""
+        try:
+            rel = Path(os.path.abspath(path)).relative_to(self.root)
+        except ValueError:
+            return None
+        if len(rel.parts) < self.depth:
+            return None
+        return str(self.root.joinpath(*rel.parts[:self.depth]))
+
+
+class DiskJanitor:
+    """Background enforcement of age and size quotas on disk artifacts.
+
+    Each area (ingest outputs, per-job results, the Nextflow work dir) is
+    swept for entries past max_age_hours, then for least recently used
+    entries until the area is back under max_bytes. Sizes are kept in a
+    persistent index and an entry is only walked again when its signature
+    changes, so a sweep costs a directory listing plus a few stats per
+    entry. Uploads are evicted through the FileHandler's own content index.
+
+    Artifacts of unfinished jobs, of cached results hit within
+    recent_hit_seconds, and anything modified within min_age_seconds are
+    never removed. Colder cached results are evicted like everything else,
+    after their cache entries are dropped so they are not served. Areas
+    added with keep_during_runs (the work dir, whose task directories
+    cannot be attributed to a job) also keep everything modified since the
+    oldest unfinished job was submitted.
+    """
+
+    def __init__(self, pipeline_manager, file_handler=None, result_cache=None, index_path='disk_index.json',
+                 interval=300, min_interval=30, min_age_seconds=600, recent_hit_seconds=24 * 3600,
+                 upload_max_bytes=None, upload_max_age_hours=None):
+        self.pipeline_manager = pipeline_manager
+        self.file_handler = file_handler
+        self.result_cache = result_cache
+        self.index_path = Path(index_path)
+        self.interval = interval
+        self.min_interval = min_interval
+        self.min_age_seconds = min_age_seconds
+        self.recent_hit_seconds = recent_hit_seconds
+        self.upload_max_bytes = upload_max_bytes
+        self.upload_max_age_hours = upload_max_age_hours
+        self.uploads_removed = 0
+        self.areas = {}
+        self.last_sweep = None
+        self.last_sweep_seconds = None
+        self.last_measured = 0
+        self._index = self._load_index()
+        self._access = {}
+        self._lock = threading.Lock()
+        self._sweep_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+
+    def add_area(self, name, root, pattern='*', max_bytes=None, max_age_hours=None, on_remove=None,
+                 keep_during_runs=False):
+        """Track entries of root matching pattern; on_remove(path) runs after each deletion"""
+        area = DiskArea(name, root, pattern, max_bytes, max_age_hours, on_remove, keep_during_runs)
+        self.areas[name] = area
+        return area
+
+    def start(self):
+        # Unfinished jobs are only known to the serving process's pipeline
+        # manager; a pool child would see none and delete their artifacts
+        if multiprocessing.parent_process() is not None:
+            print("[disk] Not starting the janitor in a pool worker process")
+            return
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._sweep_loop, daemon=True)
+            self._thread.start()
+
+    def request_sweep(self):
+        """Ask the background thread for a sweep soon, e.g. after a large upload"""
+        self._wakeup.set()
+
+    def touch(self, path):
+        """Record an access to the entry containing path, for LRU eviction"""
+        now = time.time()
+        for area in self.areas.values():
+            key = area.entry_key(path)
+            if key is not None:
+                with self._lock:
+                    self._access[key] = now
+                return
+
+    def _load_index(self):
+        if not self.index_path.exists():
+            return {}
+        try:
+            with open(self.index_path, 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"[disk] Ignoring unreadable disk index: {e}")
+            return {}
+
+    def _save_index(self):
+        tmp_path = self.index_path.with_name(self.index_path.name + '.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump(self._index, f)
+        os.replace(tmp_path, self.index_path)
+
+    def _sweep_loop(self):
+        while True:
+            try:
+                self.sweep()
+            except Exception as e:
+                print(f"[disk] Sweep error: {e}")
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+            # Coalesce bursts of requested sweeps
+            time.sleep(max(0.0, self.min_interval - (time.time() - (self.last_sweep or 0))))
+
+    def _protected(self):
+        """Absolute paths in use by unfinished or recently hit cached jobs, and the oldest active submit time"""
+        active = self.pipeline_manager.get_active_artifacts()
+        paths = set(active['paths'])
+        if self.result_cache is not None:
+            paths.update(self.result_cache.referenced_paths(accessed_since=time.time() - self.recent_hit_seconds))
+        return {os.path.abspath(p) for p in paths if p}, active['since']
+
+    def _uncache(self, path):
+        """Stop the result cache serving artifacts that are about to be deleted"""
+        if self.result_cache is not None:
+            self.result_cache.invalidate_paths([path])
+
+    def _scan(self, area):
+        """Refresh the size index of one area; only changed entries are walked"""
+        previous = self._index.get(area.name, {})
+        entries = {}
+        measured = 0
+        for path in area.root.glob(area.pattern):
+            key = str(path)
+            try:
+                signature = _signature(key)
+            except OSError:
+                continue
+            entry = previous.get(key)
+            if entry is None or entry['signature'] != signature:
+                measured += 1
+                entry = {
+                    'size': tree_size(key),
+                    'signature': signature,
+                    'last_access': (entry or {}).get('last_access', 0)
+                }
+            modified = signature / 1e9
+            with self._lock:
+                accessed = self._access.pop(key, 0)
+            entry['modified'] = modified
+            entry['last_access'] = max(entry['last_access'], modified, accessed)
+            entries[key] = entry
+        self._index[area.name] = entries
+        return measured
+
+    def _remove(self, area, key):
+        try:
+            if os.path.isdir(key) and not os.path.islink(key):
+                shutil.rmtree(key)
+            else:
+                os.unlink(key)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            print(f"[disk] Could not remove {key}: {e}")
+            return False
+
+        if area.on_remove is not None:
+            try:
+                area.on_remove(key)
+            except Exception as e:
+                print(f"[disk] Removal hook error for {key}: {e}")
+        return True
+
+    def _evict(self, area, protected, active_since, now):
+        entries = self._index.get(area.name, {})
+        total = sum(entry['size'] for entry in entries.values())
+        if area.max_bytes is None and area.max_age_hours is None:
+            return []
+
+        removed = []
+        for key, entry in sorted(entries.items(), key=lambda item: item[1]['last_access']):
+            expired = area.max_age_hours is not None and now - entry['modified'] > area.max_age_hours * 3600
+            over_quota = area.max_bytes is not None and total > area.max_bytes
+            if not (expired or over_quota):
+                continue
+            if key in protected or now - entry['modified'] < self.min_age_seconds:
+                continue
+            if area.keep_during_runs and active_since is not None and entry['modified'] >= active_since:
+                continue
+            self._uncache(key)
+            if self._remove(area, key):
+                total -= entry['size']
+                area.removed += 1
+                area.freed_bytes += entry['size']
+                removed.append(key)
+
+        if removed:
+            removed_keys = set(removed)
+            self._index[area.name] = {k: e for k, e in entries.items() if k not in removed_keys}
+        if area.max_bytes is not None and total > area.max_bytes:
+            print(f"[disk] {area.name} still over quota ({total} > {area.max_bytes} bytes); "
+                  "remaining entries are in use or recently used")
+        return removed
+
+    def sweep(self):
+        """Refresh usage and apply the age/size policies of every area"""
+        with self._sweep_lock:
+            start = time.time()
+            protected, active_since = self._protected()
+
+            if self.file_handler is not None and (self.upload_max_bytes or self.upload_max_age_hours):
+                upload_folder = os.path.abspath(self.file_handler.upload_folder)
+                in_use = {os.path.basename(p) for p in protected if os.path.dirname(p) == upload_folder}
+                removed_uploads = self.file_handler.evict(
+                    max_total_bytes=self.upload_max_bytes,
+                    max_age_hours=self.upload_max_age_hours,
+                    protected=in_use,
+                    before_remove=self._uncache
+                )
+                self.uploads_removed += len(removed_uploads)
+                if removed_uploads:
+                    print(f"[disk] Evicted {len(removed_uploads)} uploads")
+
+            measured = 0
+            for area in self.areas.values():
+                measured += self._scan(area)
+                removed = self._evict(area, protected, active_since, start)
+                if removed:
+                    print(f"[disk] Removed {len(removed)} entries from {area.name}")
+
+            self._save_index()
+            self.last_sweep = time.time()
+            self.last_sweep_seconds = round(self.last_sweep - start, 3)
+            self.last_measured = measured
+
+    def usage(self):
+        """Accounted bytes per area, from the index (no disk access)"""
+        usage = {name: sum(e['size'] for e in self._index.get(name, {}).values()) for name in self.areas}
+        if self.file_handler is not None:
+            usage['uploads'] = self.file_handler.get_usage()['total_bytes']
+        return usage
+
+    def get_stats(self):
+        """Per-area usage and quotas plus filesystem totals"""
+        areas = {}
+        for name, area in self.areas.items():
+            entries = self._index.get(name, {})
+            areas[name] = {
+                'root': str(area.root),
+                'entries': len(entries),
+                'bytes': sum(e['size'] for e in entries.values()),
+                'max_bytes': area.max_bytes,
+                'max_age_hours': area.max_age_hours,
+                'removed': area.removed,
+                'freed_bytes': area.freed_bytes
+            }
+        if self.file_handler is not None:
+            uploads = self.file_handler.get_usage()
+            areas['uploads'] = {
+                'root': str(os.path.abspath(self.file_handler.upload_folder)),
+                'entries': uploads['files'],
+                'bytes': uploads['total_bytes'],
+                'max_bytes': self.upload_max_bytes,
+                'max_age_hours': self.upload_max_age_hours,
+                'removed': self.uploads_removed
+            }
+
+        stats = {
+            'areas': areas,
+            'last_sweep': datetime.fromtimestamp(self.last_sweep).isoformat() if self.last_sweep else None,
+            'last_sweep_seconds': self.last_sweep_seconds,
+            'last_measured_entries': self.last_measured
+        }
+        try:
+            disk = shutil.disk_usage(self.pipeline_manager.pipeline_dir)
+            stats['filesystem'] = {'total': disk.total, 'used': disk.used, 'free': disk.free}
+        except OSError:
+            pass
+        return stats
@@ -0,0 +1,110 @@
+import os
+import time
+import zipfile
+from pathlib import Path
+
+# Formats that are compressed already; deflating them again only costs CPU
+STORED_SUFFIXES = {'.png', '.jpg', '.jpeg', '.webp', '.gz', '.zip', '.npz'}
+# Internal binary formats replaced by a CSV in exports
+SKIPPED_SUFFIXES = {'.npz', '.tmp'}
+JOB_FILES = ('trace.txt', 'report.html')
+
+
+class _StreamSink:
+    """Write-only file object collecting what ZipFile writes until it is drained.
+
+    It has no seek() or tell(), so ZipFile writes each entry with a
+    trailing data descriptor instead of going back to patch its header.
+    """
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def _zip_info(name, mtime=None):
+    info = zipfile.ZipInfo(name, date_time=time.localtime(mtime or time.time())[:6])
+    info.compress_type = zipfile.ZIP_STORED if Path(name).suffix.lower() in STORED_SUFFIXES else zipfile.ZIP_DEFLATED
+    info.external_attr = 0o644 << 16
+    return info
+
+
+def stream_zip(entries, chunk_size=256 * 1024):
+    """Yield a ZIP archive of entries as it is written.
+
+    entries yields (name, source) pairs where source is a file path or
+    an iterable of bytes. Files are copied chunk by chunk and every chunk
+    is handed on before the next is read, so memory stays constant
+    whatever the archive size and nothing is written to disk. Files that
+    disappear before they are read are left out.
+    """
+    for data in _write_zip(entries, chunk_size):
+        if data:
+            yield data
+
+
+def _write_zip(entries, chunk_size):
+    sink = _StreamSink()
+    with zipfile.ZipFile(sink, 'w', compresslevel=6, allowZip64=True) as archive:
+        for name, source in entries:
+            if isinstance(source, (str, os.PathLike)):
+                try:
+                    f = open(source, 'rb')
+                except FileNotFoundError:
+                    continue
+                with f:
+                    info = _zip_info(name, os.fstat(f.fileno()).st_mtime)
+                    with archive.open(info, 'w', force_zip64=True) as dest:
+                        for chunk in iter(lambda: f.read(chunk_size), b''):
+                            dest.write(chunk)
+                            yield sink.drain()
+            else:
+                with archive.open(_zip_info(name), 'w', force_zip64=True) as dest:
+                    for chunk in source:
+                        dest.write(chunk)
+                        yield sink.drain()
+            yield sink.drain()
+    yield sink.drain()
+
+
+def job_entries(job_info, stems, spot_csv=None):
+    """Archive entries of one completed job under <job_id>/.
+
+    A batch image only shares the files of its batch directory named after
+    its own stem; the Nextflow trace and report are always included.
+    spot_csv(stem) returns the CSV chunks of a spot table, or None.
+    """
+    prefix = job_info['job_id']
+    results_dir = Path(job_info['results_dir'])
+    for name in JOB_FILES:
+        yield f'{prefix}/{name}', results_dir / name
+
+    predictions = results_dir / 'predictions'
+    own_files_only = bool(job_info.get('batch_id'))
+    try:
+        names = sorted(os.listdir(predictions))
+    except FileNotFoundError:
+        names = []
+    for name in names:
+        if Path(name).suffix.lower() in SKIPPED_SUFFIXES:
+            continue
+        if own_files_only and not any(Path(name).stem.endswith('_' + stem) for stem in stems):
+            continue
+        yield f'{prefix}/predictions/{name}', predictions / name
+
+    if spot_csv is not None:
+        for stem in stems:
+            chunks = spot_csv(stem)
+            if chunks is not None:
+                yield f'{prefix}/spots/spots_{stem}.csv', chunks
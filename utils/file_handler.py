@@ -1,37 +1,208 @@
 import os
+import json
+import time
 import shutil
+import hashlib
+import tempfile
+import threading
 from pathlib import Path
 from werkzeug.utils import secure_filename
 
+HASH_CHUNK_SIZE = 1024 * 1024
+
 class FileHandler:
     def __init__(self, upload_folder):
         self.upload_folder = Path(upload_folder)
         self.upload_folder.mkdir(exist_ok=True)
-    
+        self.index_path = self.upload_folder / '.content_index.json'
+        self._lock = threading.Lock()
+        self._index = self._load_index()
+
+    @staticmethod
+    def hash_file(file_path):
+        """Compute the SHA-256 digest of a file on disk"""
+        digest = hashlib.sha256()
+        with open(file_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def _load_index(self):
+        """Load the content hash index for the upload store"""
+        if not self.index_path.exists():
+            return {}
+        try:
+            with open(self.index_path, 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _save_index(self):
+        """Atomically persist the content hash index"""
+        tmp_path = self.index_path.with_suffix('.json.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump(self._index, f)
+        os.replace(tmp_path, self.index_path)
+
     def save_file(self, file, filename=None):
         """Save uploaded file"""
         if filename is None:
             filename = secure_filename(file.filename)
-        
+
         file_path = self.upload_folder / filename
         file.save(str(file_path))
         return str(file_path)
-    
+
+    def save_file_deduped(self, file, filename=None):
+        """Save uploaded file, reusing an existing copy with identical content.
+
+        Returns (file_path, content_hash, is_duplicate).
+        """
+        if filename is None:
+            filename = secure_filename(file.filename)
+
+        fd, tmp_path = tempfile.mkstemp(dir=str(self.upload_folder), prefix='.upload_')
+        os.close(fd)
+        try:
+            file.save(tmp_path)
+            return self.store_path(tmp_path, filename)
+        finally:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+
+    def save_fileobj_deduped(self, fileobj, filename):
+        """Save a readable binary stream (e.g. a zip member) with deduplication.
+
+        Returns (file_path, content_hash, is_duplicate).
+        """
+        fd, tmp_path = tempfile.mkstemp(dir=str(self.upload_folder), prefix='.upload_')
+        digest = hashlib.sha256()
+        try:
+            with os.fdopen(fd, 'wb') as out:
+                for chunk in iter(lambda: fileobj.read(HASH_CHUNK_SIZE), b''):
+                    digest.update(chunk)
+                    out.write(chunk)
+            return self.store_path(tmp_path, filename, content_hash=digest.hexdigest())
+        finally:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+
+    def store_path(self, tmp_path, filename, content_hash=None):
+        """Move a fully written file into the store, deduplicating by content.
+
+        Returns (file_path, content_hash, is_duplicate).
+        """
+        if content_hash is None:
+            content_hash = self.hash_file(tmp_path)
+
+        with self._lock:
+            entry = self._index.get(content_hash)
+            if entry is not None:
+                existing_path = self.upload_folder / entry['filename']
+                if existing_path.exists():
+                    entry['last_access'] = time.time()
+                    self._save_index()
+                    os.unlink(tmp_path)
+                    return str(existing_path), content_hash, True
+
+            file_path = self._claim_name(tmp_path, filename, content_hash)
+            self._index[content_hash] = {
+                'filename': file_path.name,
+                'size': file_path.stat().st_size,
+                'created': time.time(),
+                'last_access': time.time()
+            }
+            self._save_index()
+
+        return str(file_path), content_hash, False
+
+    def _claim_name(self, tmp_path, filename, content_hash):
+        """Move tmp_path into the store under filename without replacing another file.
+
+        Names only carry a second-resolution timestamp, so different content
+        can arrive under the same name; it is then stored under a name
+        qualified by its hash, which is unique to the content.
+        """
+        file_path = self.upload_folder / filename
+        try:
+            # Unlike a rename, a link never replaces an existing file (also across processes)
+            os.link(tmp_path, file_path)
+            os.unlink(tmp_path)
+            return file_path
+        except FileExistsError:
+            pass
+        except OSError:
+            if not file_path.exists():
+                os.replace(tmp_path, file_path)
+                return file_path
+
+        stem, suffix = os.path.splitext(filename)
+        file_path = self.upload_folder / f'{stem}_{content_hash[:16]}{suffix}'
+        os.replace(tmp_path, file_path)
+        return file_path
+
+    def get_content_hash(self, file_path):
+        """Return the indexed hash for a stored file, hashing it if unknown"""
+        name = Path(file_path).name
+        with self._lock:
+            for content_hash, entry in self._index.items():
+                if entry['filename'] == name:
+                    return content_hash
+        return self.hash_file(file_path)
+
     def delete_file(self, filename):
         """Delete a file"""
         file_path = self.upload_folder / filename
+        with self._lock:
+            for content_hash, entry in list(self._index.items()):
+                if entry['filename'] == filename:
+                    del self._index[content_hash]
+                    self._save_index()
         if file_path.exists():
             file_path.unlink()
             return True
         return False
-    
-    def cleanup_old_files(self, max_age_hours=24):
-        """Clean up old uploaded files"""
-        import time
-        current_time = time.time()
-        
-        for file_path in self.upload_folder.iterdir():
-            if file_path.is_file():
-                file_age = current_time - file_path.stat().st_mtime
-                if file_age > (max_age_hours * 3600):
-                    file_path.unlink()
\ No newline at end of file
+
+    def get_usage(self):
+        """Return the number of indexed files and their total size"""
+        with self._lock:
+            return {
+                'files': len(self._index),
+                'total_bytes': sum(entry['size'] for entry in self._index.values())
+            }
+
+    def evict(self, max_total_bytes=None, max_age_hours=None, protected=(), before_remove=None):
+        """Evict indexed uploads unused for max_age_hours, then least recently used until under size limit.
+
+        Filenames in protected (inputs of unfinished or recently used jobs)
+        are kept. before_remove(path) runs before each file is deleted.
+        """
+        now = time.time()
+        removed = []
+
+        with self._lock:
+            entries = sorted(self._index.items(), key=lambda item: item[1]['last_access'])
+            total_bytes = sum(entry['size'] for _, entry in entries)
+
+            for content_hash, entry in entries:
+                too_old = max_age_hours is not None and \
+                    now - entry['last_access'] > max_age_hours * 3600
+                too_big = max_total_bytes is not None and total_bytes > max_total_bytes
+                if not (too_old or too_big) or entry['filename'] in protected:
+                    continue
+
+                file_path = self.upload_folder / entry['filename']
+                if before_remove is not None:
+                    before_remove(file_path)
+                try:
+                    file_path.unlink()
+                except FileNotFoundError:
+                    pass
+                total_bytes -= entry['size']
+                del self._index[content_hash]
+                removed.append(entry['filename'])
+
+            if removed:
+                self._save_index()
+
+        return removed
@@ -0,0 +1,351 @@
+import os
+import sys
+import json
+import time
+import errno
+import fcntl
+import select
+import struct
+import threading
+import ctypes
+import ctypes.util
+from datetime import datetime
+from pathlib import Path
+
+from werkzeug.utils import secure_filename
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+EVENT_HEADER = struct.Struct('iIII')
+
+# Settled submissions remembered for deduplication by content
+MAX_REMEMBERED_HASHES = 100000
+
+
+class Inotify:
+    """Minimal inotify binding (Linux, via libc) used to wake the watcher early"""
+
+    def __init__(self):
+        self._libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        self.fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        self._watched = {}
+
+    @classmethod
+    def create(cls):
+        """An Inotify instance, or None where inotify is unavailable"""
+        if not sys.platform.startswith('linux'):
+            return None
+        try:
+            return cls()
+        except (OSError, AttributeError) as e:
+            print(f"[hot-folder] inotify unavailable, polling only: {e}")
+            return None
+
+    def watch(self, directory):
+        directory = str(directory)
+        if directory in self._watched:
+            return
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(directory), WATCH_MASK)
+        if wd < 0:
+            # Out of watches, or a filesystem without inotify: polling still covers it
+            print(f"[hot-folder] Cannot watch {directory}: {os.strerror(ctypes.get_errno())}")
+            return
+        self._watched[directory] = wd
+
+    def wait(self, timeout):
+        """Block up to timeout seconds; True if anything changed in a watched directory"""
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return False
+        while True:
+            try:
+                data = os.read(self.fd, 64 * 1024)
+            except OSError as e:
+                if e.errno == errno.EAGAIN:
+                    return True
+                raise
+            if not data:
+                return True
+            offset = 0
+            while offset < len(data):
+                wd, mask, cookie, length = EVENT_HEADER.unpack_from(data, offset)
+                offset += EVENT_HEADER.size + length
+                if mask & IN_Q_OVERFLOW:
+                    print("[hot-folder] inotify queue overflow, rescanning")
+
+    def close(self):
+        os.close(self.fd)
+
+
+class HotFolderWatcher:
+    """Picks up images a scanner writes into watched directories and submits them.
+
+    Every scan lists the directories (recursively if requested); inotify,
+    where available, only makes scans happen as soon as something changes.
+    Network shares do not deliver inotify events for remote writers, so
+    the poll_interval scan is what guarantees files are found.
+
+    A file is complete once its size and mtime have not changed for
+    settle_seconds. It is then copied into the upload store, which hashes
+    it; content already submitted from the hot folder is not run again.
+    Complete files are handed to submit_fn in micro-batches of up to
+    batch_size, and only while queue_depth_fn() is below max_queued, so a
+    busy pipeline holds new files back instead of queueing them all.
+
+    Processed files are recorded in a JSON checkpoint by path, size and
+    mtime, so a restart neither reprocesses them nor misses files that
+    arrived while it was down. An exclusive lock on the checkpoint lets
+    only one process (of several web workers) watch at a time.
+    """
+
+    def __init__(self, directories, submit_fn, file_handler, checkpoint_path, queue_depth_fn=None,
+                 extensions=('png', 'jpg', 'jpeg', 'bmp', 'tiff'), recursive=True, settle_seconds=10,
+                 poll_interval=15, batch_size=16, max_queued=4):
+        self.directories = [Path(os.path.abspath(d)) for d in directories]
+        self.submit_fn = submit_fn
+        self.file_handler = file_handler
+        self.checkpoint_path = Path(checkpoint_path)
+        self.queue_depth_fn = queue_depth_fn
+        self.extensions = {ext.lower().lstrip('.') for ext in extensions}
+        self.recursive = recursive
+        self.settle_seconds = settle_seconds
+        self.poll_interval = poll_interval
+        self.batch_size = max(1, int(batch_size))
+        self.max_queued = max_queued
+        self.inotify = None
+        self.submitted = 0
+        self.duplicates = 0
+        self.rejected = 0
+        self.last_scan = None
+        self.throttled = False
+        self._pending = {}
+        self._ready = 0
+        self._incomplete_scan = False
+        self._lock_file = None
+        self._stop = threading.Event()
+        self._thread = None
+        self._checkpoint = self._load_checkpoint()
+
+    def _load_checkpoint(self):
+        if not self.checkpoint_path.exists():
+            return {'files': {}, 'hashes': {}}
+        try:
+            with open(self.checkpoint_path, 'r') as f:
+                checkpoint = json.load(f)
+            checkpoint.setdefault('files', {})
+            checkpoint.setdefault('hashes', {})
+            return checkpoint
+        except (OSError, ValueError) as e:
+            print(f"[hot-folder] Ignoring unreadable checkpoint: {e}")
+            return {'files': {}, 'hashes': {}}
+
+    def _save_checkpoint(self):
+        hashes = self._checkpoint['hashes']
+        while len(hashes) > MAX_REMEMBERED_HASHES:
+            del hashes[next(iter(hashes))]
+        tmp_path = self.checkpoint_path.with_name(self.checkpoint_path.name + '.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump(self._checkpoint, f)
+        os.replace(tmp_path, self.checkpoint_path)
+
+    def _acquire(self):
+        """Take the watcher lock; False while another process holds it"""
+        if self._lock_file is not None:
+            return True
+        lock_file = open(self.checkpoint_path.with_name(self.checkpoint_path.name + '.lock'), 'a')
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return False
+        self._lock_file = lock_file
+        # Another process may have watched until now
+        self._checkpoint = self._load_checkpoint()
+        print(f"[hot-folder] Watching {', '.join(map(str, self.directories))} "
+              f"({'inotify + polling' if self.inotify else 'polling'})")
+        return True
+
+    def start(self):
+        if self._thread is None:
+            self.inotify = Inotify.create()
+            self._thread = threading.Thread(target=self._loop, daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _loop(self):
+        while not self._stop.is_set():
+            if not self._acquire():
+                self._stop.wait(self.poll_interval)
+                continue
+            try:
+                self.scan()
+            except Exception as e:
+                print(f"[hot-folder] Scan error: {e}")
+
+            # Come back sooner while files are settling or waiting for capacity
+            timeout = self.poll_interval
+            if self._pending:
+                timeout = min(timeout, max(1.0, self.settle_seconds / 2))
+            if self.inotify is not None:
+                if self.inotify.wait(timeout):
+                    # Coalesce the burst of events of one file being written
+                    self._stop.wait(0.5)
+            else:
+                self._stop.wait(timeout)
+
+    def _candidates(self):
+        """(path, stat) of the image files in the watched directories"""
+        for root in self.directories:
+            stack = [root]
+            while stack:
+                directory = stack.pop()
+                if self.inotify is not None:
+                    self.inotify.watch(directory)
+                try:
+                    with os.scandir(directory) as entries:
+                        for entry in entries:
+                            if entry.name.startswith('.'):
+                                continue
+                            try:
+                                if entry.is_dir(follow_symlinks=False):
+                                    if self.recursive:
+                                        stack.append(Path(entry.path))
+                                    continue
+                                if entry.name.rsplit('.', 1)[-1].lower() not in self.extensions:
+                                    continue
+                                yield entry.path, entry.stat()
+                            except OSError:
+                                continue
+                except OSError as e:
+                    self._incomplete_scan = True
+                    print(f"[hot-folder] Cannot list {directory}: {e}")
+
+    def scan(self):
+        """Find complete new files and submit as many as the pipeline has room for"""
+        now = time.time()
+        files = self._checkpoint['files']
+        seen = set()
+        ready = []
+        self._incomplete_scan = False
+        for path, stat in self._candidates():
+            seen.add(path)
+            signature = [stat.st_size, stat.st_mtime_ns]
+            record = files.get(path)
+            if record is not None and record['signature'] == signature:
+                continue
+
+            pending = self._pending.get(path)
+            if pending is None or pending['signature'] != signature:
+                self._pending[path] = {'signature': signature, 'since': now}
+                continue
+            if now - pending['since'] >= self.settle_seconds and now - stat.st_mtime >= self.settle_seconds:
+                ready.append(path)
+
+        # Forget files that were deleted or moved away (not those of a
+        # share that is just unreachable)
+        self._pending = {path: p for path, p in self._pending.items() if path in seen}
+        gone = [] if self._incomplete_scan else [path for path in files if path not in seen]
+        for path in gone:
+            del files[path]
+
+        ready.sort(key=lambda path: self._pending[path]['signature'][1])
+        self._ready = len(ready)
+        submitted = False
+        while ready:
+            if self.max_queued and self.queue_depth_fn is not None and self.queue_depth_fn() >= self.max_queued:
+                if not self.throttled:
+                    print(f"[hot-folder] Pipeline busy, holding {len(ready)} files")
+                self.throttled = True
+                break
+            self.throttled = False
+            batch, ready = ready[:self.batch_size], ready[self.batch_size:]
+            self._submit(batch)
+            submitted = True
+        self._ready = len(ready)
+
+        if submitted or gone:
+            self._save_checkpoint()
+        self.last_scan = datetime.now().isoformat()
+
+    def _stored_name(self, path):
+        """Upload store name of a file: its path below the watched directory, flattened.
+
+        Scanners write the same basename into different subfolders.
+        """
+        for root in self.directories:
+            if path.startswith(str(root) + os.sep):
+                return secure_filename(os.path.relpath(path, root).replace(os.sep, '_'))
+        return secure_filename(os.path.basename(path))
+
+    def _submit(self, paths):
+        """Store one micro-batch of files and submit the new content"""
+        files = self._checkpoint['files']
+        hashes = self._checkpoint['hashes']
+        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+        items, sources = [], []
+        for path in paths:
+            signature = self._pending[path]['signature']
+            try:
+                with open(path, 'rb') as f:
+                    stored_path, image_hash, _ = self.file_handler.save_fileobj_deduped(
+                        f, f"{timestamp}_{self._stored_name(path)}"
+                    )
+            except OSError as e:
+                print(f"[hot-folder] Cannot read {path}, will retry: {e}")
+                continue
+            self._pending.pop(path)
+
+            record = {'signature': signature, 'hash': image_hash, 'time': datetime.now().isoformat()}
+            files[path] = record
+            if image_hash in hashes:
+                record.update(status='duplicate', job_id=hashes[image_hash])
+                self.duplicates += 1
+                continue
+            hashes[image_hash] = None
+            items.append((stored_path, image_hash))
+            sources.append(path)
+
+        if not items:
+            return
+        try:
+            results = self.submit_fn(items)
+        except Exception as e:
+            print(f"[hot-folder] Submission failed, will retry: {e}")
+            for path, (stored_path, image_hash) in zip(sources, items):
+                del files[path]
+                hashes.pop(image_hash, None)
+            return
+
+        for path, (stored_path, image_hash), result in zip(sources, items, results):
+            record = files[path]
+            if result.get('error'):
+                record.update(status='rejected', error=result['error'])
+                hashes.pop(image_hash, None)
+                self.rejected += 1
+            else:
+                record.update(status='submitted', job_id=result['job_id'])
+                hashes[image_hash] = result['job_id']
+                self.submitted += 1
+        print(f"[hot-folder] Submitted {len(items)} files")
+
+    def get_stats(self):
+        return {
+            'directories': [str(d) for d in self.directories],
+            'backend': 'inotify' if self.inotify is not None else 'polling',
+            'active': self._lock_file is not None,
+            'pending': len(self._pending) - self._ready,
+            'ready': self._ready,
+            'throttled': self.throttled,
+            'submitted': self.submitted,
+            'duplicates': self.duplicates,
+            'rejected': self.rejected,
+            'tracked_files': len(self._checkpoint['files']),
+            'last_scan': self.last_scan
+        }
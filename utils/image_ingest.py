@@ -0,0 +1,190 @@
+import os
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from PIL import Image, ImageOps
+
+from utils.tiling import split_image
+
+# Gel scans routinely exceed Pillow's decompression bomb limit
+Image.MAX_IMAGE_PIXELS = None
+
+SUPPORTED_FORMATS = {'PNG', 'JPEG', 'BMP', 'TIFF', 'MPO'}
+# Modes the pipeline reads as-is; anything else is normalized
+PASSTHROUGH_MODES = {'RGB', 'L'}
+PASSTHROUGH_FORMATS = {'PNG', 'JPEG'}
+
+
+class ImageRejected(ValueError):
+    """Upload that is not a decodable image in a supported format"""
+
+
+class IngestBusy(RuntimeError):
+    """The ingest pool already has as many images queued as it accepts"""
+
+
+def probe_image(image_path, max_pixels=None):
+    """Read only the image header; raises ImageRejected for unusable files.
+
+    Cheap enough to run on the request thread, so uploads with a wrong
+    format, a bogus header or absurd dimensions are rejected immediately.
+    """
+    try:
+        with Image.open(image_path) as image:
+            image_format, size, mode = image.format, image.size, image.mode
+    except (OSError, ValueError, SyntaxError) as e:
+        raise ImageRejected(f'Not a readable image: {e}')
+
+    if image_format not in SUPPORTED_FORMATS:
+        raise ImageRejected(f'Unsupported image format: {image_format}')
+    if size[0] <= 0 or size[1] <= 0:
+        raise ImageRejected('Image has no pixels')
+    if max_pixels and size[0] * size[1] > max_pixels:
+        raise ImageRejected(f'Image too large: {size[0]}x{size[1]}')
+    return {'format': image_format, 'width': size[0], 'height': size[1], 'mode': mode}
+
+
+def _to_8bit(image):
+    """Scale high bit-depth grayscale to 8 bits, keeping intensities proportional"""
+    import numpy as np
+
+    pixels = np.asarray(image)
+    peak = float(pixels.max()) if pixels.size else 0.0
+    if peak <= 255:
+        return Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8), mode='L')
+    return Image.fromarray((pixels.astype(np.float32) * (255.0 / peak)).round().astype(np.uint8), mode='L')
+
+
+def normalize_image(image):
+    """Apply EXIF orientation and convert to 8-bit L or RGB"""
+    image = ImageOps.exif_transpose(image)
+
+    if image.mode in ('I;16', 'I;16B', 'I;16L', 'I', 'F'):
+        return _to_8bit(image)
+    if image.mode == '1':
+        return image.convert('L')
+    if image.mode in ('RGBA', 'LA', 'PA') or (image.mode == 'P' and 'transparency' in image.info):
+        rgba = image.convert('RGBA')
+        background = Image.new('RGB', rgba.size, (255, 255, 255))
+        background.paste(rgba, mask=rgba.getchannel('A'))
+        return background
+    if image.mode not in PASSTHROUGH_MODES:
+        return image.convert('RGB')
+    return image
+
+
+def ingest_image(source_path, output_dir, thumbnail_dir, name, thumbnail_size=256):
+    """Decode, verify and normalize one image; runs in a pool worker process.
+
+    Returns a dict with the path to submit (the original when it is
+    already a plain 8-bit PNG/JPEG with no rotation, otherwise a
+    normalized PNG) and a JPEG thumbnail. Outputs are named by ``name``
+    (the content hash), so a re-upload reuses earlier work.
+    """
+    output_path = Path(output_dir) / f'{name}.png'
+    thumbnail_path = Path(thumbnail_dir) / f'{name}.jpg'
+
+    try:
+        # verify() checks structure without decoding; load() catches truncated data
+        with Image.open(source_path) as image:
+            image.verify()
+        with Image.open(source_path) as image:
+            image.load()
+            info = {'format': image.format, 'width': image.width, 'height': image.height, 'mode': image.mode}
+            orientation = image.getexif().get(0x0112, 1)
+            normalized = normalize_image(image)
+
+            needs_normalizing = (
+                image.format not in PASSTHROUGH_FORMATS
+                or image.mode not in PASSTHROUGH_MODES
+                or orientation not in (0, 1)
+            )
+            if not needs_normalizing:
+                path = str(source_path)
+            elif output_path.exists():
+                path = str(output_path)
+            else:
+                output_path.parent.mkdir(parents=True, exist_ok=True)
+                tmp_path = output_path.with_name(output_path.name + f'.{os.getpid()}.tmp')
+                normalized.save(tmp_path, format='PNG', compress_level=1)
+                os.replace(tmp_path, output_path)
+                path = str(output_path)
+
+            if not thumbnail_path.exists():
+                thumbnail_path.parent.mkdir(parents=True, exist_ok=True)
+                thumbnail = normalized.copy()
+                thumbnail.thumbnail((thumbnail_size, thumbnail_size))
+                tmp_path = thumbnail_path.with_name(thumbnail_path.name + f'.{os.getpid()}.tmp')
+                thumbnail.convert('RGB').save(tmp_path, format='JPEG', quality=85)
+                os.replace(tmp_path, thumbnail_path)
+    except Exception as e:
+        return {'ok': False, 'error': f'Invalid image: {e}'}
+
+    info.update({
+        'ok': True,
+        'path': path,
+        'normalized': path != str(source_path),
+        'output_mode': normalized.mode,
+        'thumbnail': str(thumbnail_path)
+    })
+    return info
+
+
+class ImageIngestor:
+    """Bounded process pool that validates and normalizes uploads off the request thread.
+
+    At most max_pending images are queued or being ingested; further
+    submissions raise IngestBusy instead of growing the pool's queue
+    without limit. Tile splits of already accepted jobs are not limited.
+    """
+
+    def __init__(self, output_dir, thumbnail_dir, max_workers=2, thumbnail_size=256, max_pending=None):
+        self.output_dir = Path(output_dir)
+        self.thumbnail_dir = Path(thumbnail_dir)
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        self.thumbnail_dir.mkdir(parents=True, exist_ok=True)
+        self.thumbnail_size = thumbnail_size
+        self.max_pending = max_pending
+        self.pending = 0
+        self._lock = threading.Lock()
+        # Spawned workers do not inherit the web server's threads and sockets
+        self._pool = ProcessPoolExecutor(
+            max_workers=max_workers,
+            mp_context=multiprocessing.get_context('spawn')
+        )
+
+    def submit(self, source_path, name):
+        """Queue an image for ingestion; returns a Future of the ingest result.
+
+        Raises IngestBusy when max_pending images are already waiting.
+        """
+        with self._lock:
+            if self.max_pending and self.pending >= self.max_pending:
+                raise IngestBusy(f'Image ingest is busy ({self.pending} images queued), retry later')
+            self.pending += 1
+        try:
+            future = self._pool.submit(
+                ingest_image, str(source_path), str(self.output_dir), str(self.thumbnail_dir),
+                name, self.thumbnail_size
+            )
+        except Exception:
+            self._done()
+            raise
+        future.add_done_callback(lambda _: self._done())
+        return future
+
+    def _done(self):
+        with self._lock:
+            self.pending -= 1
+
+    def split_tiles(self, image_path, tiles_dir, tile_size, overlap):
+        """Split a large scan into tiles in a worker process; returns a Future of the plan"""
+        return self._pool.submit(split_image, str(image_path), str(tiles_dir), tile_size, overlap)
+
+    def thumbnail_path(self, name):
+        return self.thumbnail_dir / f'{name}.jpg'
+
+    def shutdown(self):
+        self._pool.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,272 @@
+import math
+import threading
+from datetime import datetime
+
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800, 3600)
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def _format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    if value == -math.inf:
+        return '-Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=None):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.extend(f'{name}="{_escape(value)}"' for name, value in extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class _Metric:
+    metric_type = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.metric_type}']
+        lines.extend(self._render_samples())
+        return lines
+
+
+class Counter(_Metric):
+    """Monotonically increasing value"""
+    metric_type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        if amount < 0:
+            raise ValueError('Counters can only increase')
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def _render_samples(self):
+        with self._lock:
+            items = list(self._values.items())
+        if not items and not self.labelnames:
+            items = [((), 0)]
+        return [f'{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}'
+                for key, value in items]
+
+
+class Gauge(_Metric):
+    """Value that can go up and down, or is read from a callback at scrape time"""
+    metric_type = 'gauge'
+
+    def __init__(self, name, documentation, labelnames=(), callback=None):
+        super().__init__(name, documentation, labelnames)
+        self.callback = callback
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def value(self, **labels):
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def _render_samples(self):
+        if self.callback is not None:
+            try:
+                value = self.callback()
+            except Exception:
+                return []
+            if isinstance(value, dict):
+                items = [((str(label),), v) for label, v in value.items()]
+            else:
+                items = [((), value)]
+        else:
+            with self._lock:
+                items = list(self._values.items())
+            if not items and not self.labelnames:
+                items = [((), 0)]
+        return [f'{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}'
+                for key, value in items]
+
+
+class Histogram(_Metric):
+    """Bucketed distribution of observations"""
+    metric_type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            # Store per-bucket counts; they are made cumulative at render time
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[0][index] += 1
+                    break
+            state[1] += value
+            state[2] += 1
+
+    def count(self, **labels):
+        with self._lock:
+            state = self._values.get(self._key(labels))
+            return state[2] if state else 0
+
+    def _render_samples(self):
+        with self._lock:
+            items = [(key, (list(state[0]), state[1], state[2])) for key, state in self._values.items()]
+
+        lines = []
+        for key, (bucket_counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, bucket_counts):
+                cumulative += bucket_count
+                labels = _format_labels(self.labelnames, key, [('le', _format_value(bound))])
+                lines.append(f'{self.name}_bucket{labels} {cumulative}')
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f'{self.name}_sum{labels} {_format_value(total)}')
+            lines.append(f'{self.name}_count{labels} {count}')
+        return lines
+
+
+class MetricsRegistry:
+    """In-process collection of metrics rendered in Prometheus text format"""
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric):
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Metric already registered: {metric.name}")
+            self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=(), callback=None):
+        return self._register(Gauge(name, documentation, labelnames, callback))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def get(self, name):
+        return self._metrics.get(name)
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+class PipelineMetrics:
+    """Prometheus instrumentation of the web tier and pipeline manager"""
+
+    TERMINAL_STATUSES = ('completed', 'failed', 'cancelled')
+
+    def __init__(self, registry=None):
+        self.registry = registry if registry is not None else MetricsRegistry()
+        r = self.registry
+
+        self.http_requests = r.counter(
+            'gel_http_requests_total', 'HTTP requests by endpoint and status code',
+            ('endpoint', 'method', 'status'))
+        self.http_latency = r.histogram(
+            'gel_http_request_duration_seconds', 'HTTP request latency by endpoint', ('endpoint',),
+            buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10))
+        self.upload_bytes = r.counter('gel_upload_bytes_total', 'Bytes received in image uploads')
+        self.uploads = r.counter('gel_uploads_total', 'Uploaded images by deduplication outcome', ('outcome',))
+
+        self.jobs = r.counter('gel_jobs_total', 'Job state transitions by status', ('status',))
+        self.cache_lookups = r.counter('gel_cache_lookups_total', 'Result cache lookups by outcome', ('outcome',))
+        self.queue_wait = r.histogram('gel_job_queue_wait_seconds', 'Time jobs spent queued')
+        self.stage_latency = r.histogram(
+            'gel_job_stage_seconds', 'Per-stage latency of finished jobs', ('stage',))
+        self.socketio_clients = r.gauge('gel_socketio_connected_clients', 'Connected SocketIO clients')
+
+        self._job_states = {}
+        self._job_states_lock = threading.Lock()
+
+    def instrument_pipeline(self, pipeline_manager):
+        """Count state transitions and expose live pipeline gauges"""
+        pipeline_manager.add_listener(self.on_job_update)
+
+        def scheduler_stat(key):
+            return lambda: pipeline_manager.scheduler.get_stats()[key]
+
+        self.registry.gauge('gel_active_processes', 'Pipeline runs currently executing',
+                            callback=scheduler_stat('active'))
+        self.registry.gauge('gel_queued_jobs', 'Pipeline runs waiting in the scheduler queue',
+                            callback=scheduler_stat('queued'))
+
+    def on_job_update(self, job_id, job_info):
+        """Pipeline manager listener: record each status change once"""
+        status = job_info.get('status')
+        with self._job_states_lock:
+            if self._job_states.get(job_id) == status:
+                return
+            previous = self._job_states.get(job_id)
+            if status in self.TERMINAL_STATUSES:
+                self._job_states.pop(job_id, None)
+            else:
+                self._job_states[job_id] = status
+
+        if previous is None and job_info.get('cached'):
+            self.cache_lookups.inc(outcome='hit')
+        elif previous is None and job_info.get('cache_key'):
+            self.cache_lookups.inc(outcome='miss')
+
+        self.jobs.inc(status=status)
+
+        timings = (job_info.get('metrics') or {}).get('timings') or {}
+        if status == 'running' and job_info.get('submit_time') and job_info.get('start_time'):
+            wait = (datetime.fromisoformat(job_info['start_time']) -
+                    datetime.fromisoformat(job_info['submit_time'])).total_seconds()
+            self.queue_wait.observe(max(0.0, wait))
+        if status in self.TERMINAL_STATUSES:
+            for stage, seconds in timings.items():
+                if isinstance(seconds, (int, float)):
+                    self.stage_latency.observe(seconds, stage=stage)
+
+    def observe_request(self, endpoint, method, status_code, seconds):
+        self.http_requests.inc(endpoint=endpoint or 'unknown', method=method, status=status_code)
+        self.http_latency.observe(seconds, endpoint=endpoint or 'unknown')
+
+    def render(self):
+        return self.registry.render()
@@ -0,0 +1,75 @@
+import zlib
+import struct
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+# PNG filter type applied to every row: difference to the pixel on the left
+FILTER_SUB = 1
+
+
+def _write_chunk(f, chunk_type, data):
+    f.write(struct.pack('>I', len(data)))
+    f.write(chunk_type)
+    f.write(data)
+    f.write(struct.pack('>I', zlib.crc32(chunk_type + data) & 0xffffffff))
+
+
+def save_png_bands(path, width, height, bands, compress_level=1):
+    """Write an 8-bit RGB PNG from horizontal bands, top to bottom.
+
+    bands yields (h, width, 3) uint8 arrays that together cover height
+    rows. Each band is filtered and compressed as it arrives, so only one
+    band is ever held in memory whatever the image size.
+    """
+    compressor = zlib.compressobj(compress_level)
+    rows = 0
+    with open(path, 'wb') as f:
+        f.write(PNG_SIGNATURE)
+        _write_chunk(f, b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0))
+        for band in bands:
+            band = np.asarray(band, dtype=np.uint8)
+            if band.shape[1:] != (width, 3):
+                raise ValueError(f'Band of shape {band.shape} does not match a {width} pixel wide RGB image')
+            flat = band.reshape(len(band), -1)
+            filtered = np.empty((len(band), flat.shape[1] + 1), dtype=np.uint8)
+            filtered[:, 0] = FILTER_SUB
+            filtered[:, 1:4] = flat[:, :3]
+            np.subtract(flat[:, 3:], flat[:, :-3], out=filtered[:, 4:])
+            data = compressor.compress(filtered.tobytes())
+            if data:
+                _write_chunk(f, b'IDAT', data)
+            rows += len(band)
+        if rows != height:
+            raise ValueError(f'Bands cover {rows} rows of a {height} row image')
+        _write_chunk(f, b'IDAT', compressor.flush())
+        _write_chunk(f, b'IEND', b'')
+    return str(path)
+
+
+def tile_bands(tiles, tiles_dir, width):
+    """Reassemble an image from overlapping tiles as (y0, RGB band) pairs.
+
+    tiles are {'stem', 'box'} dicts as planned by utils.tiling; a band is
+    one row of tiles minus the rows the previous band already covered,
+    so only a tile's height of the image is decoded at a time.
+    """
+    tiles_dir = Path(tiles_dir)
+    rows = {}
+    for tile in tiles:
+        rows.setdefault(tile['box'][1], []).append(tile)
+
+    covered = 0
+    for y0 in sorted(rows):
+        y1 = max(tile['box'][3] for tile in rows[y0])
+        if y1 <= covered:
+            continue
+        band = np.zeros((y1 - y0, width, 3), dtype=np.uint8)
+        for tile in rows[y0]:
+            x0, _, x1, tile_y1 = tile['box']
+            with Image.open(tiles_dir / f"{tile['stem']}.png") as image:
+                band[:tile_y1 - y0, x0:x1] = np.asarray(image.convert('RGB'))
+        yield covered, band[covered - y0:]
+        covered = y1
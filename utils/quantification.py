@@ -0,0 +1,126 @@
+import numpy as np
+
+# Pixels around each spot box sampled for its local background
+BACKGROUND_MARGIN = 5
+
+
+def _group_median(groups, values, count):
+    """Lower median of values per group id in [0, count); NaN for empty groups"""
+    medians = np.full(count, np.nan)
+    if len(values) == 0:
+        return medians
+    order = np.lexsort((values, groups))
+    sizes = np.bincount(groups, minlength=count)
+    starts = np.concatenate([[0], np.cumsum(sizes)[:-1]])
+    present = sizes > 0
+    medians[present] = values[order][starts[present] + (sizes[present] - 1) // 2]
+    return medians
+
+
+def _box_pixels(boxes):
+    """Pixel coordinates of integer (x0, y0, x1, y1) boxes as (box, rows, cols)"""
+    widths = boxes[:, 2] - boxes[:, 0]
+    heights = boxes[:, 3] - boxes[:, 1]
+    sizes = np.maximum(widths, 0) * np.maximum(heights, 0)
+    box = np.repeat(np.arange(len(boxes)), sizes)
+    local = np.arange(sizes.sum()) - np.repeat(np.cumsum(sizes) - sizes, sizes)
+    rows = boxes[box, 1] + local // widths[box]
+    cols = boxes[box, 0] + local % widths[box]
+    return box, rows, cols
+
+
+def background_pixels(image_size, boxes, mask_rows, mask_cols, margin=BACKGROUND_MARGIN):
+    """Pixels around each box not covered by any spot mask, as (box, rows, cols).
+
+    Each box is grown by margin pixels and clipped to the (width, height)
+    image; the pixels gathered for all boxes are tested against the
+    sorted linear index of covered pixels, so no image-sized buffer is
+    allocated.
+    """
+    width, height = image_size
+    grown = np.empty((len(boxes), 4), dtype=np.int64)
+    grown[:, 0] = np.clip(np.floor(boxes[:, 0]) - margin, 0, width)
+    grown[:, 1] = np.clip(np.floor(boxes[:, 1]) - margin, 0, height)
+    grown[:, 2] = np.clip(np.ceil(boxes[:, 2]) + margin, 0, width)
+    grown[:, 3] = np.clip(np.ceil(boxes[:, 3]) + margin, 0, height)
+
+    box, rows, cols = _box_pixels(grown)
+    covered = np.unique(mask_rows.astype(np.int64) * width + mask_cols)
+    uncovered = ~np.isin(rows * width + cols, covered, assume_unique=False)
+    return box[uncovered], rows[uncovered], cols[uncovered]
+
+
+def assign_lanes(centroid_x, box_widths, lane_gap=None):
+    """Number spots into lanes (1 = leftmost) by gaps between their x centroids.
+
+    Consecutive spots in x order start a new lane when they are more than
+    lane_gap apart, by default the median spot width.
+    """
+    lanes = np.zeros(len(centroid_x), dtype=np.int32)
+    if len(centroid_x) == 0:
+        return lanes
+    if lane_gap is None:
+        lane_gap = max(float(np.median(box_widths)), 1.0)
+    order = np.argsort(centroid_x, kind='stable')
+    breaks = np.diff(centroid_x[order]) > lane_gap
+    lanes[order] = 1 + np.concatenate([[0], np.cumsum(breaks)])
+    return lanes
+
+
+def quantify_spots(sample, image_size, detection, rows, cols, kept, boxes, margin=BACKGROUND_MARGIN,
+                   lane_gap=None):
+    """Densitometry of the kept detections from their mask pixels.
+
+    detection/rows/cols list every mask pixel above threshold with the
+    index of its detection; kept are the detection indices to report and
+    boxes their (x0, y0, x1, y1) boxes. sample(rows, cols) returns the
+    grey values at those pixels and is called once, for the mask pixels
+    and the local background around each box, so the image never has to
+    be decoded as a whole. All measurements are bincounts and sorts over
+    those pixels, with no per-spot Python loop.
+
+    Net intensity is the integrated intensity above the local background
+    (below it for gels with dark spots on a light background, detected
+    from the spot and background medians), so it is positive either way.
+    """
+    background_box, background_rows, background_cols = background_pixels(image_size, boxes, rows, cols, margin)
+    values = np.asarray(sample(np.concatenate([rows, background_rows]),
+                               np.concatenate([cols, background_cols])), dtype=np.float64)
+
+    count = int(kept.max()) + 1 if len(kept) else 0
+    area = np.bincount(detection, minlength=count)[kept]
+    sum_x = np.bincount(detection, weights=cols, minlength=count)[kept]
+    sum_y = np.bincount(detection, weights=rows, minlength=count)[kept]
+    intensity = np.bincount(detection, weights=values[:len(rows)], minlength=count)[kept]
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        # Spots with no pixels above the mask threshold fall back to the box center
+        centroid_x = np.where(area > 0, sum_x / area, (boxes[:, 0] + boxes[:, 2]) / 2)
+        centroid_y = np.where(area > 0, sum_y / area, (boxes[:, 1] + boxes[:, 3]) / 2)
+        mean_intensity = np.where(area > 0, intensity / area, 0.0)
+
+    # Median of the uncovered pixels around each box; NaN where there are none
+    background = _group_median(background_box, values[len(rows):], len(boxes))
+    if np.isnan(background).all():
+        background[:] = 0.0
+    else:
+        background = np.where(np.isnan(background), np.nanmedian(background), background)
+
+    measured = area > 0
+    dark_spots = bool(measured.any() and
+                      np.median(mean_intensity[measured]) < np.median(background[measured]))
+    net_intensity = intensity - background * area
+    if dark_spots:
+        net_intensity = -net_intensity
+
+    return {
+        'area': area.astype(np.int64),
+        'centroid_x': centroid_x.astype(np.float32),
+        'centroid_y': centroid_y.astype(np.float32),
+        'intensity': intensity,
+        'mean_intensity': mean_intensity.astype(np.float32),
+        'background': background.astype(np.float32),
+        'net_intensity': net_intensity,
+        'lane': assign_lanes(centroid_x, boxes[:, 2] - boxes[:, 0], lane_gap),
+        'dark_spots': np.array(dark_spots)
+    }
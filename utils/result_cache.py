@@ -0,0 +1,142 @@
+import os
+import json
+import hashlib
+import threading
+from pathlib import Path
+from datetime import datetime
+
+
+class ResultCache:
+    """Persistent prediction cache keyed by image content, thresholds and model"""
+
+    def __init__(self, cache_dir):
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.index_path = self.cache_dir / 'index.json'
+        self._lock = threading.Lock()
+        self._entries = self._load_index()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(image_hash, score_threshold, mask_threshold, num_classes, model_digest):
+        """Build a stable cache key from the prediction inputs"""
+        key_data = json.dumps({
+            'image': image_hash,
+            'score_threshold': round(float(score_threshold), 6),
+            'mask_threshold': round(float(mask_threshold), 6),
+            'num_classes': int(num_classes),
+            'model': model_digest
+        }, sort_keys=True)
+        return hashlib.sha256(key_data.encode('utf-8')).hexdigest()
+
+    def _load_index(self):
+        """Load the cache index from disk"""
+        if not self.index_path.exists():
+            return {}
+        try:
+            with open(self.index_path, 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"[cache] Ignoring unreadable cache index: {e}")
+            return {}
+
+    def _save_index(self):
+        """Atomically write the cache index to disk"""
+        tmp_path = self.index_path.with_suffix('.json.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump(self._entries, f)
+        os.replace(tmp_path, self.index_path)
+
+    def get(self, key):
+        """Return the cached entry for key, or None if missing or stale"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            # Results directory may have been removed underneath us
+            if not Path(entry['results_dir']).exists():
+                del self._entries[key]
+                self._save_index()
+                self.misses += 1
+                return None
+
+            entry['last_access'] = datetime.now().isoformat()
+            self.hits += 1
+            return dict(entry)
+
+    def put(self, key, job_info):
+        """Store a completed job's artifacts under key"""
+        with self._lock:
+            self._entries[key] = {
+                'job_id': job_info['job_id'],
+                'results_dir': job_info['results_dir'],
+                'results': job_info.get('results', {}),
+                'image_path': job_info.get('image_path'),
+                'result_stem': job_info.get('result_stem'),
+                'model_path': job_info.get('model_path'),
+                'created': datetime.now().isoformat(),
+                'last_access': datetime.now().isoformat()
+            }
+            self._save_index()
+
+    def invalidate(self, key):
+        """Drop a single cache entry"""
+        with self._lock:
+            if self._entries.pop(key, None) is not None:
+                self._save_index()
+                return True
+            return False
+
+    def cached_results_dirs(self):
+        """Return the set of results directories referenced by the cache"""
+        with self._lock:
+            return {entry['results_dir'] for entry in self._entries.values()}
+
+    @staticmethod
+    def _entry_paths(entry):
+        paths = [entry['results_dir']]
+        if entry.get('image_path'):
+            paths.append(entry['image_path'])
+        return paths
+
+    def referenced_paths(self, accessed_since=None):
+        """Return the results directories and input images the cache points at.
+
+        With accessed_since (a Unix time), only entries hit or stored since then count.
+        """
+        with self._lock:
+            paths = set()
+            for entry in self._entries.values():
+                if accessed_since is not None and \
+                        datetime.fromisoformat(entry['last_access']).timestamp() < accessed_since:
+                    continue
+                paths.update(self._entry_paths(entry))
+            return paths
+
+    def invalidate_paths(self, paths):
+        """Drop every entry whose results directory or input image is in paths"""
+        paths = {os.path.abspath(p) for p in paths}
+        with self._lock:
+            stale = [
+                key for key, entry in self._entries.items()
+                if any(os.path.abspath(p) in paths for p in self._entry_paths(entry))
+            ]
+            for key in stale:
+                del self._entries[key]
+            if stale:
+                self._save_index()
+            return len(stale)
+    
+    def get_stats(self):
+        """Return cache hit/miss counters"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': (self.hits / lookups) if lookups else 0.0
+            }
@@ -2,6 +2,11 @@ import json
 import re
 from pathlib import Path
 
+# Nextflow console progress: "[ab/123456] process > NAME (1) [100%] 1 of 1 ✔"
+# (or the older "... | 1 of 1" form)
+PROCESS_NAME_RE = re.compile(r'process > ([\w:.-]+)')
+TASK_COUNT_RE = re.compile(r'[|\]]\s*(\d+)\s*of\s*(\d+)')
+
 class ResultParser:
     def __init__(self):
         pass
@@ -18,9 +23,8 @@ class ResultParser:
         lines = log_content.split('\n')
         for line in lines:
             # Look for process completion patterns
-            if '|' in line and 'of' in line:
-                # Example: [ab/123456] PROCESS_NAME (1) | 1 of 1 ✓
-                match = re.search(r'\|\s*(\d+)\s*of\s*(\d+)', line)
+            if 'of' in line:
+                match = TASK_COUNT_RE.search(line)
                 if match:
                     completed = int(match.group(1))
                     total = int(match.group(2))
@@ -29,7 +33,7 @@ class ResultParser:
             
             # Look for current process
             if 'process >' in line:
-                match = re.search(r'process > (\w+)', line)
+                match = PROCESS_NAME_RE.search(line)
                 if match:
                     progress_info['current_process'] = match.group(1)
             
@@ -0,0 +1,213 @@
+import numpy as np
+
+# Strongest spots per gel used to vote for the initial translation
+VOTING_SPOTS = 300
+# Search radii of the affine refinement passes, in multiples of the match radius
+ALIGN_RADII = (4, 2, 1, 1)
+# Affine fits outside this per-axis scale range are treated as mismatches
+MAX_SCALE_CHANGE = 1.25
+
+
+class SpotIndex:
+    """Uniform grid over spot centroids for vectorized radius-bounded nearest neighbor queries"""
+
+    def __init__(self, points, cell_size):
+        self.points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        self.cell_size = float(cell_size)
+        cells = np.floor(self.points / self.cell_size).astype(np.int64)
+        self.origin = cells.min(axis=0) if len(cells) else np.zeros(2, dtype=np.int64)
+        cells -= self.origin
+        self.shape = cells.max(axis=0) + 1 if len(cells) else np.ones(2, dtype=np.int64)
+        keys = cells[:, 1] * self.shape[0] + cells[:, 0]
+        self.order = np.argsort(keys, kind='stable')
+        self.keys = keys[self.order]
+
+    def __len__(self):
+        return len(self.points)
+
+    def nearest(self, queries, max_distance):
+        """Index of and distance to the nearest point within max_distance of each query (-1/inf if none)"""
+        queries = np.asarray(queries, dtype=np.float64).reshape(-1, 2)
+        nearest = np.full(len(queries), -1, dtype=np.int64)
+        distance = np.full(len(queries), np.inf)
+        if len(self) == 0 or len(queries) == 0:
+            return nearest, distance
+
+        reach = int(min(np.ceil(max_distance / self.cell_size), self.shape.max()))
+        steps = np.arange(-reach, reach + 1)
+        offsets = np.stack(np.meshgrid(steps, steps), axis=-1).reshape(-1, 2)
+
+        # Candidate cells of every query, then the index ranges they cover
+        cells = np.floor(queries / self.cell_size).astype(np.int64) - self.origin
+        cells = cells[:, None, :] + offsets[None, :, :]
+        inside = ((cells >= 0) & (cells < self.shape)).all(axis=2)
+        keys = (cells[..., 1] * self.shape[0] + cells[..., 0]).ravel()
+        starts = np.searchsorted(self.keys, keys, side='left')
+        ends = np.where(inside.ravel(), np.searchsorted(self.keys, keys, side='right'), starts)
+
+        counts = ends - starts
+        query = np.repeat(np.arange(len(keys)) // len(offsets), counts)
+        position = np.repeat(starts - np.cumsum(counts) + counts, counts) + np.arange(counts.sum())
+        candidate = self.order[position]
+        squared = ((self.points[candidate] - queries[query]) ** 2).sum(axis=1)
+
+        within = squared <= max_distance ** 2
+        query, candidate, squared = query[within], candidate[within], squared[within]
+        order = np.lexsort((squared, query))
+        first = np.unique(query[order], return_index=True)[1]
+        best = order[first]
+        nearest[query[best]] = candidate[best]
+        distance[query[best]] = np.sqrt(squared[best])
+        return nearest, distance
+
+
+def _apply(transform, points):
+    return points @ transform[:, :2].T + transform[:, 2]
+
+
+def _estimate_translation(reference, target, bin_size):
+    """Most common offset between the strongest spots of two gels"""
+    differences = (reference[:, None, :] - target[None, :, :]).reshape(-1, 2)
+    bins = np.floor(differences / bin_size).astype(np.int64)
+    keys, counts = np.unique(bins, axis=0, return_counts=True)
+    # Votes of the winning bin and its 8 neighbors, so an offset on a bin edge is not split
+    best = keys[np.argmax(counts)]
+    near = (np.abs(bins - best) <= 1).all(axis=1)
+    return np.median(differences[near], axis=0)
+
+
+def _mutual_pairs(reference_index, target_index, transform, radius):
+    """Pairs (reference, target) that are each other's nearest neighbor once aligned"""
+    aligned = _apply(transform, target_index.points)
+    to_reference, distance = reference_index.nearest(aligned, radius)
+
+    full = np.vstack([transform, [0.0, 0.0, 1.0]])
+    inverse = np.linalg.inv(full)[:2]
+    to_target, _ = target_index.nearest(_apply(inverse, reference_index.points), radius)
+
+    target = np.flatnonzero(to_reference >= 0)
+    reference = to_reference[target]
+    mutual = to_target[reference] == target
+    return reference[mutual], target[mutual], distance[target[mutual]]
+
+
+def align_gels(reference_index, target_index, reference_strength, target_strength, radius,
+               initial=None):
+    """Affine transform mapping target centroids onto reference centroids.
+
+    Starts from initial (e.g. the ratio of image sizes), votes for a
+    translation between the strongest spots, then refines an affine fit
+    on mutual nearest neighbors. Falls back to the translation when the
+    fit is degenerate or implausibly scaled.
+    """
+    transform = np.array(initial if initial is not None else [[1.0, 0.0, 0.0], [0.0, 1.0, 0.0]])
+    if len(reference_index) == 0 or len(target_index) == 0:
+        return transform
+    base_scale = np.linalg.norm(transform[:, :2], axis=0)
+
+    strongest_reference = reference_index.points[np.argsort(-reference_strength)[:VOTING_SPOTS]]
+    strongest_target = target_index.points[np.argsort(-target_strength)[:VOTING_SPOTS]]
+    transform[:, 2] += _estimate_translation(strongest_reference, _apply(transform, strongest_target), radius)
+
+    # Coarse to fine: wide search radii tolerate the rotation/scale the
+    # translation vote cannot capture, the fine passes reject neighbors
+    for search in ALIGN_RADII:
+        reference, target, _ = _mutual_pairs(reference_index, target_index, transform, radius * search)
+        if len(reference) < 6:
+            break
+        source = np.hstack([target_index.points[target], np.ones((len(target), 1))])
+        destination = reference_index.points[reference]
+        fitted, _, rank, _ = np.linalg.lstsq(source, destination, rcond=None)
+        # Refit without the worst pairs so stray matches do not skew the fit
+        residual = np.linalg.norm(source @ fitted - destination, axis=1)
+        inliers = residual <= max(np.median(residual) * 3, 1.0)
+        if inliers.sum() >= 6:
+            fitted, _, rank, _ = np.linalg.lstsq(source[inliers], destination[inliers], rcond=None)
+        fitted = fitted.T
+        scale = np.linalg.norm(fitted[:, :2], axis=0) / base_scale
+        if rank < 3 or (scale > MAX_SCALE_CHANGE).any() or (scale < 1 / MAX_SCALE_CHANGE).any():
+            break
+        transform = fitted
+    return transform
+
+
+def match_spot_tables(reference, target, radius=None, align=True):
+    """Match the spots of target against reference (both SpotTable).
+
+    Spots are matched one-to-one as mutual nearest neighbors within
+    radius pixels after alignment; radius defaults to the reference's
+    median spot width. Returns the transform, matched pairs with raw and
+    normalized (share of total matched volume) net intensity ratios, and
+    the ids of reference spots missing from target and of new spots.
+    """
+    reference_index = reference.spatial_index()
+    target_index = target.spatial_index()
+    if radius is None:
+        radius = reference_index.cell_size
+
+    initial = None
+    reference_size = reference.columns['image_size'].astype(np.float64)
+    target_size = target.columns['image_size'].astype(np.float64)
+    if (target_size > 0).all():
+        # image_size is (height, width); scans at another resolution start pre-scaled
+        scale_y, scale_x = reference_size / target_size
+        initial = [[scale_x, 0.0, 0.0], [0.0, scale_y, 0.0]]
+
+    reference_strength = np.abs(reference.columns['net_intensity'])
+    target_strength = np.abs(target.columns['net_intensity'])
+    if align:
+        transform = align_gels(reference_index, target_index, reference_strength, target_strength,
+                               radius, initial)
+    else:
+        transform = np.array(initial or [[1.0, 0.0, 0.0], [0.0, 1.0, 0.0]])
+
+    ref_rows, target_rows, distance = _mutual_pairs(reference_index, target_index, transform, radius)
+    reference_net = reference.columns['net_intensity'][ref_rows]
+    target_net = target.columns['net_intensity'][target_rows]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        ratio = target_net / reference_net
+        normalized = ratio * (reference_net.sum() / target_net.sum())
+
+    missing = np.ones(len(reference), dtype=bool)
+    missing[ref_rows] = False
+    new = np.ones(len(target), dtype=bool)
+    new[target_rows] = False
+
+    def clean(values, digits):
+        return [round(float(v), digits) if np.isfinite(v) else None for v in values]
+
+    return {
+        'transform': [[round(float(v), 6) for v in row] for row in transform],
+        'radius': round(float(radius), 2),
+        'matched': int(len(ref_rows)),
+        'missing': int(missing.sum()),
+        'new': int(new.sum()),
+        'pairs': [
+            {'reference_id': r, 'id': t, 'distance': d, 'ratio': q, 'normalized_ratio': n}
+            for r, t, d, q, n in zip(
+                reference.columns['id'][ref_rows].tolist(),
+                target.columns['id'][target_rows].tolist(),
+                clean(distance, 2), clean(ratio, 4), clean(normalized, 4)
+            )
+        ],
+        'missing_ids': reference.columns['id'][missing].tolist(),
+        'new_ids': target.columns['id'][new].tolist(),
+        '_matched_rows': ref_rows
+    }
+
+
+def compare_gels(reference, targets, radius=None, align=True):
+    """Match several gels against one reference; targets is a list of (key, SpotTable)"""
+    comparisons = []
+    present = np.ones(len(reference), dtype=bool)
+    for key, table in targets:
+        result = match_spot_tables(reference, table, radius, align)
+        seen = np.zeros(len(reference), dtype=bool)
+        seen[result.pop('_matched_rows')] = True
+        present &= seen
+        comparisons.append(dict(result, job_id=key))
+    return {
+        'reference_spots': len(reference),
+        'matched_in_all': int(present.sum()) if comparisons else 0,
+        'comparisons': comparisons
+    }
@@ -0,0 +1,483 @@
+import os
+import time
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from collections import OrderedDict
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+
+from utils.detections import MASK_SCALE, DetectionSet, detections_path, writer_tmp_path
+from utils.quantification import quantify_spots
+from utils.spot_matching import SpotIndex
+
+# Gel scans routinely exceed Pillow's decompression bomb limit
+Image.MAX_IMAGE_PIXELS = None
+
+SORT_KEYS = ('id', 'score', 'area', 'intensity', 'mean_intensity', 'background', 'net_intensity',
+             'lane', 'centroid_x', 'centroid_y')
+MAX_PAGE_SIZE = 1000
+CSV_COLUMNS = ('id', 'label', 'score', 'x0', 'y0', 'x1', 'y1', 'area', 'centroid_x', 'centroid_y',
+               'intensity', 'mean_intensity', 'background', 'net_intensity', 'lane')
+# Bumped when columns change; older tables are rebuilt on first access
+TABLE_VERSION = 2
+
+
+def spots_path(results_dir, stem):
+    """Location of the spot table of one input image"""
+    return Path(results_dir) / 'predictions' / f'spots_{stem}.npz'
+
+
+def _run_lengths(binary, offsets):
+    """Run-length encode each segment of a flat boolean array.
+
+    Segment i is binary[offsets[i]:offsets[i + 1]]. Runs alternate
+    background/foreground and always start with a background run (zero
+    long if the segment starts in the foreground). Returns
+    (rle_offsets, rle_counts) with the runs of segment i at
+    rle_counts[rle_offsets[i]:rle_offsets[i + 1]].
+    """
+    segments = len(offsets) - 1
+    total = len(binary)
+    if total == 0:
+        return np.zeros(segments + 1, dtype=np.int64), np.zeros(0, dtype=np.int32)
+
+    is_start = np.zeros(total, dtype=bool)
+    is_start[offsets[:-1][np.diff(offsets) > 0]] = True
+    segment_start = is_start.copy()
+    is_start[1:] |= binary[1:] != binary[:-1]
+
+    run_starts = np.flatnonzero(is_start)
+    lengths = np.diff(np.append(run_starts, total))
+    segment = np.searchsorted(offsets, run_starts, side='right') - 1
+
+    leading = np.flatnonzero(segment_start[run_starts] & binary[run_starts])
+    lengths = np.insert(lengths, leading, 0)
+    segment = np.insert(segment, leading, segment[leading])
+
+    counts = np.bincount(segment, minlength=segments)
+    rle_offsets = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+    return rle_offsets, lengths.astype(np.int32)
+
+
+def _intensity_image(image):
+    """Grey values to integrate: native for grey modes, luminance otherwise"""
+    if image.mode in ('L', 'I', 'F') or image.mode.startswith('I;16'):
+        return np.asarray(image)
+    return np.asarray(image.convert('L'))
+
+
+def pixel_sampler(image_path, tiling=None, tiles_dir=None):
+    """sample(rows, cols) returning the grey values of an image at those pixels.
+
+    Tiled scans are read from their tiles, one tile at a time and only
+    the tiles holding requested pixels, so memory stays at one tile
+    whatever the scan size. Untiled images are decoded whole; they are
+    below TILING_MIN_PIXELS unless tiling is disabled.
+    """
+    def sample(rows, cols):
+        rows = np.asarray(rows, dtype=np.int64)
+        cols = np.asarray(cols, dtype=np.int64)
+        values = np.zeros(len(rows), dtype=np.float64)
+        if not len(rows):
+            return values
+        if tiling is None:
+            with Image.open(image_path) as image:
+                values[:] = _intensity_image(image)[rows, cols]
+            return values
+
+        # Each pixel is read from the last tile starting at or before it,
+        # which covers it since tiles start at most a tile's size apart
+        tiles = {(tile['box'][0], tile['box'][1]): tile for tile in tiling['tiles']}
+        xs = np.array(sorted({x for x, _ in tiles}))
+        ys = np.array(sorted({y for _, y in tiles}))
+        column = np.searchsorted(xs, cols, side='right') - 1
+        row = np.searchsorted(ys, rows, side='right') - 1
+        cell = row * len(xs) + column
+        order = np.argsort(cell, kind='stable')
+        cells, starts = np.unique(cell[order], return_index=True)
+        for c, start, end in zip(cells, starts, np.append(starts[1:], len(order))):
+            x0, y0 = int(xs[c % len(xs)]), int(ys[c // len(xs)])
+            picked = order[start:end]
+            with Image.open(Path(tiles_dir) / f"{tiles[(x0, y0)]['stem']}.png") as image:
+                values[picked] = _intensity_image(image)[rows[picked] - y0, cols[picked] - x0]
+        return values
+
+    return sample
+
+
+def build_spot_table(detections, sample, image_size, score_threshold, mask_threshold):
+    """Per-spot columns for the detections kept at the given thresholds.
+
+    Measurements come from utils.quantification over the mask pixels
+    above mask_threshold, with grey values read through sample (see
+    pixel_sampler), so the cost is linear in the number of mask pixels
+    rather than spots x image size.
+    """
+    width, height = image_size
+    if (height, width) != (detections.height, detections.width):
+        raise ValueError(f'Detections are for a {detections.width}x{detections.height} image, '
+                         f'got {width}x{height}')
+
+    keep = detections.scores >= score_threshold
+    kept = np.flatnonzero(keep)
+    detection, rows, cols = detections._selected_pixels(keep, mask_threshold)
+    boxes = detections.boxes[kept].astype(np.float32)
+    measurements = quantify_spots(sample, image_size, detection, rows, cols, kept, boxes)
+
+    binary = detections.mask_data > mask_threshold * MASK_SCALE
+    rle_offsets, rle_counts = _run_lengths(binary, detections.mask_offsets)
+    run_counts = np.diff(rle_offsets)[kept]
+    run_selected = np.repeat(keep, np.diff(rle_offsets))
+
+    return {
+        'id': kept.astype(np.int32),
+        'label': detections.labels[kept].astype(np.int16),
+        'score': detections.scores[kept].astype(np.float32),
+        'box': boxes,
+        **measurements,
+        'mask_box': detections.mask_boxes[kept].astype(np.int32),
+        'rle_offsets': np.concatenate([[0], np.cumsum(run_counts)]).astype(np.int64),
+        'rle_counts': rle_counts[run_selected],
+        'image_size': np.array([detections.height, detections.width], dtype=np.int32),
+        'thresholds': np.array([score_threshold, mask_threshold], dtype=np.float32),
+        'version': np.array(TABLE_VERSION)
+    }
+
+
+def save_spot_table(path, table):
+    path = Path(path)
+    tmp_path = writer_tmp_path(path)
+    with open(tmp_path, 'wb') as f:
+        np.savez_compressed(f, **table)
+    os.replace(tmp_path, path)
+    return str(path)
+
+
+def write_spot_table(results_dir, stem, image_path, score_threshold, mask_threshold, tiling=None):
+    """Build the spot table of one image from its stored raw detections.
+
+    tiling is the plan of a tiled job, whose tiles are read instead of
+    the full scan. Returns a summary for the job record; raises
+    FileNotFoundError when the run stored no raw detections.
+    """
+    raw_path = detections_path(results_dir, stem)
+    if not raw_path.exists():
+        raise FileNotFoundError(f'No raw detections stored for {stem}')
+
+    detections = DetectionSet.load(raw_path)
+    if tiling is not None:
+        image_size = tuple(tiling['image_size'])
+        sample = pixel_sampler(image_path, tiling, Path(results_dir) / 'tiles' / 'input')
+    else:
+        with Image.open(image_path) as image:
+            image_size = image.size
+        sample = pixel_sampler(image_path)
+    table = build_spot_table(detections, sample, image_size, score_threshold, mask_threshold)
+    path = save_spot_table(spots_path(results_dir, stem), table)
+    return {
+        'path': path,
+        'spots': int(len(table['id'])),
+        'lanes': int(table['lane'].max()) if len(table['id']) else 0,
+        'total_area': int(table['area'].sum()),
+        'total_net_intensity': round(float(table['net_intensity'].sum()), 2)
+    }
+
+
+class SpotTablePending(RuntimeError):
+    """The spot table is being built in the background; retry later"""
+
+
+def _recompute_one(source):
+    """Pool task: rebuild one spot table, never raising"""
+    try:
+        summary = write_spot_table(source['results_dir'], source['stem'], source['image_path'],
+                                   source['score_threshold'], source['mask_threshold'], source.get('tiling'))
+        return source['job_id'], summary, None
+    except Exception as e:
+        return source['job_id'], None, f'{type(e).__name__}: {e}'
+
+
+class SpotTable:
+    """Columnar spot table of one image with vectorized filtering"""
+
+    def __init__(self, columns):
+        self.columns = columns
+        self._index = None
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls({key: data[key] for key in data.files})
+
+    def __len__(self):
+        return len(self.columns['id'])
+
+    def spatial_index(self):
+        """Grid index over spot centroids, built on first use and kept with the table"""
+        if self._index is None:
+            box = self.columns['box']
+            widths = box[:, 2] - box[:, 0]
+            cell_size = max(float(np.median(widths)), 4.0) if len(widths) else 4.0
+            centroids = np.stack([self.columns['centroid_x'], self.columns['centroid_y']], axis=1)
+            self._index = SpotIndex(centroids, cell_size)
+        return self._index
+
+    @property
+    def version(self):
+        return int(self.columns['version']) if 'version' in self.columns else 1
+
+    def rle(self, index):
+        start, end = self.columns['rle_offsets'][index], self.columns['rle_offsets'][index + 1]
+        x0, y0, x1, y1 = (int(v) for v in self.columns['mask_box'][index])
+        return {
+            'box': [x0, y0, x1, y1],
+            'size': [y1 - y0, x1 - x0],
+            'order': 'row-major',
+            'counts': self.columns['rle_counts'][start:end].tolist()
+        }
+
+    def row(self, index, include_rle=False):
+        c = self.columns
+        spot = {
+            'id': int(c['id'][index]),
+            'label': int(c['label'][index]),
+            'score': round(float(c['score'][index]), 4),
+            'box': [round(float(v), 1) for v in c['box'][index]],
+            'area': int(c['area'][index]),
+            'centroid': [round(float(c['centroid_x'][index]), 2), round(float(c['centroid_y'][index]), 2)],
+            'intensity': round(float(c['intensity'][index]), 2),
+            'mean_intensity': round(float(c['mean_intensity'][index]), 3),
+            'background': round(float(c['background'][index]), 3),
+            'net_intensity': round(float(c['net_intensity'][index]), 2),
+            'lane': int(c['lane'][index])
+        }
+        if include_rle:
+            spot['rle'] = self.rle(index)
+        return spot
+
+    def iter_csv(self, chunk_rows=4096):
+        """The table as CSV (without masks), in chunks of encoded rows"""
+        c = self.columns
+        yield (','.join(CSV_COLUMNS) + '\n').encode('ascii')
+        for start in range(0, len(self), chunk_rows):
+            end = start + chunk_rows
+            box = c['box'][start:end]
+            fields = [c['id'][start:end], c['label'][start:end], c['score'][start:end],
+                      box[:, 0], box[:, 1], box[:, 2], box[:, 3]]
+            fields += [c[name][start:end] for name in CSV_COLUMNS[7:]]
+            fields = [f.astype(np.float64).round(4) if f.dtype.kind == 'f' else f for f in fields]
+            lines = [','.join(map(str, values)) for values in zip(*(f.tolist() for f in fields))]
+            yield ('\n'.join(lines) + '\n').encode('ascii')
+
+    def query(self, min_score=None, max_score=None, min_area=None, max_area=None, label=None,
+              lane=None, region=None, sort='id', descending=False, offset=0, limit=100, include_rle=False):
+        """Filter, sort and page the spots.
+
+        region is an (x0, y0, x1, y1) window matched against spot
+        centroids. Returns (total matching spots, page of spot dicts).
+        """
+        if sort not in SORT_KEYS:
+            raise ValueError(f"Unknown sort key '{sort}' (expected one of {', '.join(SORT_KEYS)})")
+        c = self.columns
+        keep = np.ones(len(self), dtype=bool)
+        if min_score is not None:
+            keep &= c['score'] >= min_score
+        if max_score is not None:
+            keep &= c['score'] <= max_score
+        if min_area is not None:
+            keep &= c['area'] >= min_area
+        if max_area is not None:
+            keep &= c['area'] <= max_area
+        if label is not None:
+            keep &= c['label'] == label
+        if lane is not None:
+            keep &= c['lane'] == lane
+        if region is not None:
+            x0, y0, x1, y1 = region
+            keep &= ((c['centroid_x'] >= x0) & (c['centroid_x'] < x1) &
+                     (c['centroid_y'] >= y0) & (c['centroid_y'] < y1))
+
+        indices = np.flatnonzero(keep)
+        if sort != 'id':
+            indices = indices[np.argsort(c[sort][indices], kind='stable')]
+        if descending:
+            indices = indices[::-1]
+
+        limit = max(0, min(int(limit), MAX_PAGE_SIZE))
+        page = indices[max(0, int(offset)):max(0, int(offset)) + limit]
+        return len(indices), [self.row(i, include_rle) for i in page]
+
+
+class SpotTableStore:
+    """Loads spot tables with a small LRU, building missing ones from raw detections.
+
+    Tables of many jobs can be rebuilt at once (after a change to the
+    quantification, or for jobs that predate spot tables); large sets are
+    spread over a process pool created for that run, small ones are
+    rebuilt inline.
+    """
+
+    def __init__(self, max_loaded=32, recompute_workers=2, min_parallel=8):
+        self.max_loaded = max_loaded
+        self.recompute_workers = recompute_workers
+        self.min_parallel = min_parallel
+        self._loaded = OrderedDict()
+        self._building = {}
+        self._failed = {}
+        self._lock = threading.Lock()
+        self._recompute_thread = None
+        self.recompute_status = None
+
+    def write(self, results_dir, stem, image_path, score_threshold, mask_threshold, tiling=None):
+        """(Re)build the spot table of a finished image; returns its summary"""
+        return write_spot_table(results_dir, stem, image_path, score_threshold, mask_threshold, tiling)
+
+    def get(self, results_dir, stem, image_path, score_threshold, mask_threshold, tiling=None, wait=False):
+        """Spot table of one image; raises FileNotFoundError without raw detections.
+
+        Missing tables (jobs that finished before spot tables existed) and
+        tables of an older version are built on a background thread.
+        Until the build is done this raises SpotTablePending, or blocks
+        when wait is set.
+        """
+        path = spots_path(results_dir, stem)
+        key = str(path)
+        table = self._load(key) if path.exists() else None
+        if table is not None and table.version >= TABLE_VERSION:
+            return table
+
+        with self._lock:
+            error = self._failed.pop(key, None)
+        if error is not None:
+            raise error
+        if table is not None:
+            score_threshold, mask_threshold = (float(v) for v in table.columns['thresholds'])
+        elif not detections_path(results_dir, stem).exists():
+            raise FileNotFoundError(f'No raw detections stored for {stem}')
+
+        build = self._build(key, (results_dir, stem, image_path, score_threshold, mask_threshold, tiling))
+        if not wait:
+            raise SpotTablePending(f'Spot table of {stem} is being built, retry shortly')
+        build.join()
+        with self._lock:
+            error = self._failed.pop(key, None)
+        if error is not None:
+            raise error
+        return self._load(key)
+
+    def _load(self, key):
+        mtime = os.path.getmtime(key)
+        with self._lock:
+            entry = self._loaded.get(key)
+            if entry is not None and entry[0] == mtime:
+                self._loaded.move_to_end(key)
+                return entry[1]
+
+        table = SpotTable.load(key)
+        with self._lock:
+            self._loaded[key] = (mtime, table)
+            self._loaded.move_to_end(key)
+            while len(self._loaded) > self.max_loaded:
+                self._loaded.popitem(last=False)
+        return table
+
+    def _build(self, key, args):
+        """Thread building the table at key, started unless one already runs"""
+        with self._lock:
+            thread = self._building.get(key)
+            if thread is None:
+                thread = threading.Thread(target=self._run_build, args=(key, args), daemon=True)
+                self._building[key] = thread
+                thread.start()
+            return thread
+
+    def _run_build(self, key, args):
+        try:
+            write_spot_table(*args)
+        except Exception as e:
+            print(f"[spots] Building {Path(key).name} failed: {e}")
+            with self._lock:
+                self._failed[key] = e
+        finally:
+            with self._lock:
+                self._building.pop(key, None)
+
+    def recompute(self, sources, progress=None):
+        """Rebuild the spot tables of many images.
+
+        sources are dicts with job_id, results_dir, stem, image_path,
+        score_threshold, mask_threshold and the job's tiling plan, if any. progress(done, total) is
+        called after each image. Returns per-job summaries and errors.
+        """
+        sources = list(sources)
+        summaries, failed = {}, {}
+        done = 0
+
+        def record(job_id, summary, error):
+            nonlocal done
+            done += 1
+            if error:
+                failed[job_id] = error
+            else:
+                summaries[job_id] = summary
+            if progress is not None:
+                progress(done, len(sources))
+
+        if self.recompute_workers > 1 and len(sources) >= self.min_parallel:
+            workers = min(self.recompute_workers, len(sources))
+            # spawn children re-import the caller's main module: app.py and
+            # worker.py keep their setup under __main__, and _recompute_one
+            # needs nothing from them
+            with ProcessPoolExecutor(max_workers=workers,
+                                     mp_context=multiprocessing.get_context('spawn')) as pool:
+                for future in as_completed([pool.submit(_recompute_one, s) for s in sources]):
+                    record(*future.result())
+        else:
+            for source in sources:
+                record(*_recompute_one(source))
+        return {'summaries': summaries, 'failed': failed}
+
+    def start_recompute(self, sources, on_done=None):
+        """Run recompute() in the background; False if a run is already in progress"""
+        with self._lock:
+            if self._recompute_thread is not None and self._recompute_thread.is_alive():
+                return False
+            sources = list(sources)
+            self.recompute_status = {
+                'state': 'running',
+                'total': len(sources),
+                'done': 0,
+                'failed': {},
+                'spots': 0,
+                'started': time.time(),
+                'elapsed': None
+            }
+            self._recompute_thread = threading.Thread(
+                target=self._run_recompute, args=(sources, on_done), daemon=True
+            )
+            self._recompute_thread.start()
+        return True
+
+    def _run_recompute(self, sources, on_done):
+        status = self.recompute_status
+
+        def progress(done, total):
+            status['done'] = done
+
+        try:
+            result = self.recompute(sources, progress)
+            status['failed'] = result['failed']
+            status['spots'] = sum(s['spots'] for s in result['summaries'].values())
+            if on_done is not None:
+                on_done(result['summaries'])
+            status['state'] = 'completed'
+        except Exception as e:
+            status['state'] = 'failed'
+            status['error'] = str(e)
+            print(f"[spots] Recompute failed: {e}")
+        status['elapsed'] = round(time.time() - status['started'], 2)
+        print(f"[spots] Recomputed {status['done'] - len(status['failed'])}/{status['total']} spot tables "
+              f"in {status['elapsed']}s")
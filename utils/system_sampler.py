@@ -0,0 +1,119 @@
+import json
+import time
+import threading
+
+
+class SystemSampler:
+    """Samples host and pipeline status on one background thread.
+
+    sample_fn() returns a status dict; it is called every interval
+    seconds and the result kept, with its timestamp, in a fixed-size ring
+    buffer. Readers get the latest sample in O(1) and time series from
+    the buffer, so the cost of status polling no longer grows with the
+    number of open browsers. The JSON-ready full history is built at
+    most once per sample.
+    """
+
+    def __init__(self, sample_fn, interval=5.0, size=720):
+        self.sample_fn = sample_fn
+        self.interval = interval
+        self.size = max(1, int(size))
+        self._buffer = [None] * self.size
+        self._start = 0
+        self._count = 0
+        self._latest = None
+        self._sequence = 0
+        self._full_history = None
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def start(self):
+        self.sample_now()
+        self._thread = threading.Thread(target=self._loop, daemon=True)
+        self._thread.start()
+
+    def _loop(self):
+        next_run = time.monotonic() + self.interval
+        while True:
+            time.sleep(max(0.0, next_run - time.monotonic()))
+            next_run += self.interval
+            self.sample_now()
+
+    def sample_now(self):
+        """Take a sample and append it to the ring buffer"""
+        started = time.time()
+        try:
+            sample = dict(self.sample_fn())
+        except Exception as e:
+            sample = {'error': str(e)}
+        sample['timestamp'] = round(started, 3)
+        sample['sample_seconds'] = round(time.time() - started, 4)
+
+        with self._lock:
+            index = (self._start + self._count) % self.size
+            self._buffer[index] = sample
+            if self._count < self.size:
+                self._count += 1
+            else:
+                self._start = (self._start + 1) % self.size
+            self._latest = sample
+            self._sequence += 1
+            self._full_history = None
+        return sample
+
+    def latest(self):
+        """Most recent sample, with its age in seconds; None before the first sample"""
+        sample = self._latest
+        if sample is None:
+            return None
+        return dict(sample, sample_age=round(time.time() - sample['timestamp'], 3))
+
+    def _samples_since(self, since):
+        """Buffered samples newer than since, oldest first (binary search on timestamps)"""
+        low, high = 0, self._count
+        while low < high:
+            middle = (low + high) // 2
+            if self._buffer[(self._start + middle) % self.size]['timestamp'] <= since:
+                low = middle + 1
+            else:
+                high = middle
+        return [self._buffer[(self._start + i) % self.size] for i in range(low, self._count)]
+
+    def history(self, since=None, fields=None, limit=None):
+        """Columnar time series of the numeric fields of buffered samples.
+
+        since restricts to samples after a timestamp (for incremental
+        polling), fields to the named series and limit to the newest
+        samples.
+        """
+        with self._lock:
+            samples = self._samples_since(since if since is not None else float('-inf'))
+        if limit:
+            samples = samples[-int(limit):]
+
+        if fields is None:
+            fields = sorted({
+                key for sample in samples for key, value in sample.items()
+                if isinstance(value, (int, float)) and not isinstance(value, bool) and key != 'timestamp'
+            })
+        history = {
+            'interval': self.interval,
+            'capacity': self.size,
+            'count': len(samples),
+            'timestamps': [sample['timestamp'] for sample in samples],
+            'series': {field: [sample.get(field) for sample in samples] for field in fields}
+        }
+        return history
+
+    def history_json(self):
+        """The full history serialized once per sample, for the common unfiltered request"""
+        with self._lock:
+            cached = self._full_history
+            sequence = self._sequence
+        if cached is not None:
+            return cached
+        payload = json.dumps(self.history())
+        with self._lock:
+            if self._sequence == sequence:
+                self._full_history = payload
+        return payload
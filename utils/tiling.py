@@ -0,0 +1,246 @@
+import shutil
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+
+from utils.detections import DetectionSet, detections_path, save_packed_detections
+from utils.png_bands import save_png_bands, tile_bands
+
+# Gel scans routinely exceed Pillow's decompression bomb limit
+Image.MAX_IMAGE_PIXELS = None
+
+
+def plan_tiles(width, height, tile_size, overlap):
+    """Cover a width x height image with overlapping (x0, y0, x1, y1) tiles"""
+    step = max(1, tile_size - overlap)
+
+    def starts(length):
+        if length <= tile_size:
+            return [0]
+        positions = list(range(0, length - tile_size, step))
+        positions.append(length - tile_size)  # last tile flush with the edge
+        return positions
+
+    return [
+        (x0, y0, min(x0 + tile_size, width), min(y0 + tile_size, height))
+        for y0 in starts(height)
+        for x0 in starts(width)
+    ]
+
+
+def split_image(image_path, tiles_dir, tile_size, overlap):
+    """Write overlapping tiles of image_path and return the tiling plan.
+
+    Pillow decodes the whole scan before the first crop, so this takes
+    memory proportional to the image, bounded only by INGEST_MAX_PIXELS.
+    It runs in an ingest worker process (see ImageIngestor.split_tiles)
+    where one is available, which keeps that peak out of the web process.
+    """
+    tiles_dir = Path(tiles_dir)
+    tiles_dir.mkdir(parents=True, exist_ok=True)
+
+    tiles = []
+    with Image.open(image_path) as image:
+        width, height = image.size
+        for index, box in enumerate(plan_tiles(width, height, tile_size, overlap)):
+            stem = f'tile_{index:04d}_x{box[0]}_y{box[1]}'
+            image.crop(box).save(tiles_dir / f'{stem}.png', compress_level=1)
+            tiles.append({'stem': stem, 'box': list(box)})
+
+    return {
+        'image_size': [width, height],
+        'tile_size': tile_size,
+        'overlap': overlap,
+        'tiles': tiles
+    }
+
+
+def _intersection(a, b):
+    x0, y0 = max(a[0], b[0]), max(a[1], b[1])
+    x1, y1 = min(a[2], b[2]), min(a[3], b[3])
+    return (x0, y0, x1, y1) if x0 < x1 and y0 < y1 else None
+
+
+def _box_iomin(a, b):
+    """Pairwise intersection over the smaller box area, (len(a), len(b))"""
+    ix = np.clip(np.minimum(a[:, None, 2], b[None, :, 2]) - np.maximum(a[:, None, 0], b[None, :, 0]), 0, None)
+    iy = np.clip(np.minimum(a[:, None, 3], b[None, :, 3]) - np.maximum(a[:, None, 1], b[None, :, 1]), 0, None)
+    area_a = (a[:, 2] - a[:, 0]) * (a[:, 3] - a[:, 1])
+    area_b = (b[:, 2] - b[:, 0]) * (b[:, 3] - b[:, 1])
+    smaller = np.minimum(area_a[:, None], area_b[None, :])
+    return np.where(smaller > 0, ix * iy / np.maximum(smaller, 1e-6), 0.0)
+
+
+def stitch_detections(tile_sets, tile_boxes, match_threshold=0.5):
+    """Merge per-tile detections into image coordinates.
+
+    A spot in an overlap region is detected by every tile that covers
+    it, often truncated by one tile's edge. Detections of neighbouring
+    tiles are matched one-to-one (mutual best intersection-over-smaller-
+    box above match_threshold, same label); each matched group becomes a
+    single detection with the union box, the highest score and the
+    pixel-wise maximum of the soft masks.
+    """
+    offsets = np.array([[x0, y0, x0, y0] for x0, y0, _, _ in tile_boxes], dtype=np.float32)
+    tile_of = np.concatenate([np.full(len(s), t, dtype=np.int32) for t, s in enumerate(tile_sets)])
+    local_index = np.concatenate([np.arange(len(s), dtype=np.int32) for s in tile_sets])
+    scores = np.concatenate([s.scores for s in tile_sets])
+    labels = np.concatenate([s.labels for s in tile_sets])
+    boxes = np.concatenate([s.boxes + offsets[t] for t, s in enumerate(tile_sets)])
+    mask_boxes = np.concatenate([s.mask_boxes + offsets[t].astype(np.int32) for t, s in enumerate(tile_sets)])
+    starts = np.concatenate([[0], np.cumsum([len(s) for s in tile_sets])]).astype(np.int64)
+
+    # Union-find over detections matched across tile overlaps
+    parent = np.arange(len(scores))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    for a in range(len(tile_boxes)):
+        for b in range(a + 1, len(tile_boxes)):
+            region = _intersection(tile_boxes[a], tile_boxes[b])
+            if region is None:
+                continue
+            region = np.array(region, dtype=np.float32)
+
+            candidates = []
+            for t in (a, b):
+                tile_boxes_global = boxes[starts[t]:starts[t + 1]]
+                touches = ((tile_boxes_global[:, 0] < region[2]) & (tile_boxes_global[:, 2] > region[0]) &
+                           (tile_boxes_global[:, 1] < region[3]) & (tile_boxes_global[:, 3] > region[1]))
+                candidates.append(starts[t] + np.flatnonzero(touches))
+            ia, ib = candidates
+            if not len(ia) or not len(ib):
+                continue
+
+            overlap = _box_iomin(boxes[ia], boxes[ib])
+            overlap[labels[ia][:, None] != labels[ib][None, :]] = 0
+            best_b = overlap.argmax(axis=1)
+            best_a = overlap.argmax(axis=0)
+            mutual = (best_a[best_b] == np.arange(len(ia))) & (overlap[np.arange(len(ia)), best_b] >= match_threshold)
+            for i, j in zip(ia[mutual], ib[best_b[mutual]]):
+                root_i, root_j = find(i), find(j)
+                if root_i != root_j:
+                    parent[root_j] = root_i
+
+    roots = np.array([find(i) for i in range(len(scores))], dtype=np.int64)
+    groups = {}
+    for i, root in enumerate(roots):
+        groups.setdefault(root, []).append(i)
+
+    out_scores, out_boxes, out_labels, out_mask_boxes, out_crops = [], [], [], [], []
+    for members in groups.values():
+        crops = [tile_sets[tile_of[i]].crop(local_index[i]) for i in members]
+        if len(members) == 1:
+            mask_box, crop = mask_boxes[members[0]], crops[0]
+        else:
+            member_boxes = mask_boxes[members]
+            mask_box = np.array([member_boxes[:, 0].min(), member_boxes[:, 1].min(),
+                                 member_boxes[:, 2].max(), member_boxes[:, 3].max()], dtype=np.int32)
+            crop = np.zeros((mask_box[3] - mask_box[1], mask_box[2] - mask_box[0]), dtype=np.uint8)
+            for (x0, y0, x1, y1), member_crop in zip(member_boxes, crops):
+                region = crop[y0 - mask_box[1]:y1 - mask_box[1], x0 - mask_box[0]:x1 - mask_box[0]]
+                np.maximum(region, member_crop, out=region)
+
+        member_boxes = boxes[members]
+        out_scores.append(scores[members].max())
+        out_labels.append(labels[members[0]])
+        out_boxes.append([member_boxes[:, 0].min(), member_boxes[:, 1].min(),
+                          member_boxes[:, 2].max(), member_boxes[:, 3].max()])
+        out_mask_boxes.append(mask_box)
+        out_crops.append(crop)
+
+    # Highest scores first, like the model's own output
+    order = np.argsort(-np.array(out_scores, dtype=np.float32), kind='stable')
+    return {
+        'scores': np.array(out_scores, dtype=np.float32)[order],
+        'boxes': np.array(out_boxes, dtype=np.float32).reshape(-1, 4)[order],
+        'labels': np.array(out_labels, dtype=np.int16)[order],
+        'mask_boxes': np.array(out_mask_boxes, dtype=np.int32).reshape(-1, 4)[order],
+        'crops': [out_crops[i] for i in order]
+    }
+
+
+class Tiler:
+    """Splits large scans into overlapping tiles and stitches their detections.
+
+    Splitting runs on pool (an ImageIngestor) when one is given, so the
+    web process never decodes a whole scan; the ingest worker does, once
+    per scan (see split_image). Stitched overlays and spot tables are
+    then built from the tiles, one row of tiles or one tile at a time.
+    """
+
+    def __init__(self, tile_size=1024, overlap=128, min_pixels=2048 * 2048, parallelism=4,
+                 match_threshold=0.5, pool=None):
+        if overlap >= tile_size:
+            raise ValueError('Tile overlap must be smaller than the tile size')
+        self.tile_size = tile_size
+        self.overlap = overlap
+        self.min_pixels = min_pixels
+        self.parallelism = parallelism
+        self.match_threshold = match_threshold
+        self.pool = pool
+
+    def needs_tiling(self, image_path):
+        """Check the image header (without decoding pixels) against the size limit"""
+        try:
+            with Image.open(image_path) as image:
+                width, height = image.size
+        except (OSError, ValueError):
+            return False
+        return width * height > self.min_pixels
+
+    def split(self, image_path, tiles_dir):
+        """Write overlapping tiles of image_path and return the tiling plan"""
+        if self.pool is not None:
+            return self.pool.split_tiles(image_path, tiles_dir, self.tile_size, self.overlap).result()
+        return split_image(image_path, tiles_dir, self.tile_size, self.overlap)
+
+    def stitch(self, results_dir, plan, image_path, stem, score_threshold, mask_threshold):
+        """Combine per-tile pipeline outputs into single-image outputs.
+
+        Tile outputs are moved from predictions/ to tiles/output/, and the
+        stitched detections, overlay and test_results.txt are written to
+        predictions/ under the original image's stem.
+        """
+        results_dir = Path(results_dir)
+        predictions_dir = results_dir / 'predictions'
+        tile_output_dir = results_dir / 'tiles' / 'output'
+        tile_output_dir.mkdir(parents=True, exist_ok=True)
+        predictions_dir.mkdir(exist_ok=True)
+        for path in predictions_dir.iterdir():
+            shutil.move(str(path), str(tile_output_dir / path.name))
+
+        tile_sets = []
+        for tile in plan['tiles']:
+            path = tile_output_dir / f"detections_{tile['stem']}.npz"
+            if not path.exists():
+                raise FileNotFoundError(f"Raw detections missing for {tile['stem']}; "
+                                        "tiled runs need a pipeline that supports --save_detections")
+            tile_sets.append(DetectionSet.load(path))
+
+        merged = stitch_detections(tile_sets, [tuple(t['box']) for t in plan['tiles']], self.match_threshold)
+        width, height = plan['image_size']
+        raw_path = save_packed_detections(
+            detections_path(results_dir, stem),
+            merged['scores'], merged['boxes'], merged['labels'], merged['mask_boxes'], merged['crops'],
+            (height, width),
+            min_score=max((s.min_score for s in tile_sets), default=0.0)
+        )
+
+        detections = DetectionSet.load(raw_path)
+        detected = detections.apply(score_threshold, mask_threshold)['detected_objects']
+        bands = tile_bands(plan['tiles'], results_dir / 'tiles' / 'input', width)
+        save_png_bands(predictions_dir / f'prediction_{stem}.png', width, height,
+                       detections.overlay_bands(bands, score_threshold, mask_threshold))
+
+        with open(predictions_dir / 'test_results.txt', 'w') as f:
+            f.write(f"Input image: {image_path}\n")
+            f.write(f"Detected objects: {detected}\n")
+            f.write(f"Tiles: {len(plan['tiles'])}\n")
+
+        return {'detected_objects': detected, 'tiles': len(plan['tiles'])}
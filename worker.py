@@ -0,0 +1,89 @@
+"""Worker tier process: runs the jobs the web app queues on WORKER_BROKER.
+
+Start one or more per node next to the web app:
+
+    WORKER_BROKER=file python worker.py      # single host, directory broker
+    WORKER_BROKER=celery python worker.py    # Celery/Redis, any node
+
+Workers need the same configuration as the web app, in particular the
+same job store (JOB_STORE_BACKEND=redis across nodes) and the pipeline,
+results and cache directories at the same paths.
+"""
+import os
+import sys
+import signal
+
+from config import config
+from nextflow_runner.brokers import create_broker
+from nextflow_runner.factory import create_pipeline_manager
+from nextflow_runner.model_registry import ModelRegistry
+from nextflow_runner.worker_tier import JobWorker
+from utils.result_cache import ResultCache
+from utils.spot_table import SpotTableStore
+
+
+def create_worker(cfg):
+    """Build the broker, pipeline manager and job worker from cfg"""
+    broker = create_broker(cfg['WORKER_BROKER'], cfg['WORKER_BROKER_DIR'], cfg['REDIS_URL'])
+    pipeline_manager = create_pipeline_manager(
+        cfg,
+        cache=ResultCache(cfg['RESULT_CACHE_DIR']),
+        model_registry=ModelRegistry(
+            cfg['MODEL_DIRS'].split(os.pathsep),
+            default_model=cfg['MODEL_DEFAULT'],
+            reload_interval=cfg['MODEL_RELOAD_INTERVAL']
+        ),
+        spot_tables=SpotTableStore(
+            recompute_workers=cfg['SPOT_RECOMPUTE_WORKERS'],
+            min_parallel=cfg['SPOT_RECOMPUTE_MIN_PARALLEL']
+        ),
+        role='worker'
+    )
+    job_worker = JobWorker(
+        pipeline_manager,
+        broker,
+        concurrency=cfg['WORKER_CONCURRENCY'],
+        prefetch=cfg['WORKER_PREFETCH']
+    )
+    if cfg['WORKER_BROKER'] == 'celery':
+        broker.register(job_worker.execute)
+    return broker, pipeline_manager, job_worker
+
+
+def main():
+    # Everything is built here rather than at import: warm workers and the
+    # ingest and spot pools spawn children that re-import this module
+    settings = config[os.environ.get('FLASK_CONFIG') or 'default']
+    cfg = {key: getattr(settings, key) for key in dir(settings) if key.isupper()}
+    if not cfg['WORKER_BROKER']:
+        sys.exit('Set WORKER_BROKER (file or celery) to run a worker')
+
+    broker, pipeline_manager, job_worker = create_worker(cfg)
+
+    if cfg['WORKER_BROKER'] == 'celery':
+        # One process with a thread per job: the jobs share this process's
+        # launch directories and warm workers. Celery prefetches in whole
+        # multiples of the concurrency.
+        concurrency = job_worker.concurrency
+        multiplier = -(-(concurrency + job_worker.prefetch) // concurrency)
+        job_worker.start_housekeeping()
+        broker.app.worker_main([
+            'worker', '--pool', 'threads',
+            '--concurrency', str(concurrency),
+            '--prefetch-multiplier', str(multiplier),
+            '--queues', broker.queue,
+            '--hostname', f'gel@{job_worker.worker_id}'
+        ])
+    else:
+        signal.signal(signal.SIGTERM, lambda *args: job_worker.stop())
+        try:
+            job_worker.run_forever()
+        except KeyboardInterrupt:
+            job_worker.stop()
+
+    if hasattr(pipeline_manager, 'shutdown'):
+        pipeline_manager.shutdown()
+
+
+if __name__ == '__main__':
+    main()